@@ -0,0 +1,104 @@
+# bench/bench_decode.py
+# 解码耗时基准: 不经网络, 直接向DetRing填充合成数据包, 比较每帧解码(含按idx排序)耗时
+#   cd src && python -m bench.bench_decode
+import time
+import struct
+import numpy as np
+from core.Det import Det, DetFrames
+from core.Det.DetRing import DetRing
+from core.Det.DetAsm import DetAsm
+
+
+def _packets(pixNum: int, bins: int, frames: int) -> tuple[np.dtype, np.dtype, list[bytes]]:
+    dt = Det.histDataType((0, bins - 1))
+    headType = dt(withInfo=True, withPos0=True, withPos1=True)
+    dataType = dt()
+    pkts = []
+    for f in range(frames):
+        for j in range(pixNum):
+            p = np.zeros(1, dtype=headType if j == 0 else dataType)
+            p["frame"] = f
+            p["idx"] = j
+            p["dLen"] = bins
+            p["data"] = j
+            pkts.append(b"VPDT" + struct.pack("<L", 2) + p.tobytes())
+    return (headType, dataType, pkts)
+
+
+def _fill(ring: DetRing, pkts: list[bytes]):
+    ring.clear()
+    for p in pkts:
+        ring.slot()[:len(p)] = p
+        ring.push(2, len(p))
+    ring.flush()
+
+
+def _legacy(det: Det, heads: np.ndarray, datas: np.ndarray):
+    # 旧实现: 每个包一次np.frombuffer
+    (num, per) = heads.shape
+    for i in range(num):
+        for j in range(per):
+            (ids, lens, rows) = det._qr.getView(1, 1)
+            data = rows[0, 8:lens[0]].tobytes()
+            if j == 0:
+                heads[i, j] = np.frombuffer(data, dtype=heads.dtype, count=1)
+            else:
+                datas[i, j] = np.frombuffer(data, dtype=datas.dtype, count=1)
+
+
+def _reorder(pkts: list[bytes], span: int) -> list[bytes]:
+    # 每span个包内打乱顺序, 模拟网络乱序
+    rng = np.random.default_rng(0)
+    out = []
+    for i in range(0, len(pkts), span):
+        part = pkts[i:i + span]
+        out += [part[j] for j in rng.permutation(len(part))]
+    return out
+
+
+def bench(pixNum: int, bins: int = 120, frames: int = 48, repeat: int = 20) -> dict[str, float]:
+    (headType, dataType, pkts) = _packets(pixNum, bins, frames)
+    det = Det("127.0.0.1")
+    det.addQueue((None, DetRing(slots=pixNum * frames)))
+    det._qr.reserve(8 + headType.itemsize)
+    asm = DetAsm(det._ip, headType, dataType, pixNum, frames)
+
+    def legacy():
+        heads = np.zeros((frames, pixNum), dtype=headType)
+        datas = np.zeros((frames, pixNum), dtype=dataType)
+        _legacy(det, heads, datas)
+        data = DetFrames.fromPackets(heads[:, 0], datas)
+        # 旧实现收齐后还要按idx逐帧排序
+        order = data["idx"].argsort()
+        for i in range(frames):
+            data.data[i] = data.data[i, order[i]]
+            data.pix[i] = data.pix[i, order[i]]
+        return data
+
+    def direct():
+        asm.reset()
+        return det._assemble(asm, frames, 1, False)
+
+    def defer():
+        asm.reset()
+        return det._assemble(asm, frames, 1, True)
+
+    res = {}
+    cases = (("legacy", legacy, pkts), ("direct", direct, pkts), ("defer", defer, pkts),
+             ("reorder", defer, _reorder(pkts, 4 * pixNum)))
+    for (name, fn, src) in cases:
+        cost = 0.0
+        for _ in range(repeat):
+            _fill(det._qr, src)
+            t = time.perf_counter()
+            data = fn()
+            cost += time.perf_counter() - t
+        assert (data["idx"] == np.arange(pixNum)).all() and (data["data"][:, :, 0] == np.arange(pixNum)).all()
+        res[name] = cost / repeat / frames * 1e6
+    return res
+
+
+if __name__ == "__main__":
+    for pixNum in (80, 256):
+        res = bench(pixNum)
+        print(f"pixNum={pixNum:4d}  " + "  ".join(f"{k}: {v:8.1f} us/frame" for (k, v) in res.items()))
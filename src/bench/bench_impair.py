@@ -0,0 +1,129 @@
+# bench/bench_impair.py
+# 网络损伤基准: 模拟器(tools.det_sim) -> 损伤代理(tools.det_impair) -> DetData, 三者各在独立进程中
+# 每种损伤场景下比较不同的收包/组帧方式, 报告完整帧/损坏帧/丢包/持续帧率
+# 损坏帧: 收到的包内容与模拟器的(idx + frame)不符; 组帧器按连续帧号编号, 内容相符即没有错位/跳帧
+#   cd src && python -m bench.bench_impair --num 2000 --intr 50
+import time
+import socket
+import argparse
+import multiprocessing
+import numpy as np
+from core.Det import Det, DetData
+from tools.det_sim import DetSim
+from tools.det_impair import DetImpair
+
+SCENARIOS = {
+    "clean": {},
+    "loss1%": {"loss": 0.01},
+    "dup1%": {"dup": 0.01},
+    "reorder5%": {"reorder": 0.05},
+    "jitter2ms": {"jitter": 0.002},
+    "burst": {"burstEvery": 2.0, "burstHold": 1.0, "rcvBuf": 256 * 1024},
+    "mixed": {"loss": 0.005, "dup": 0.005, "reorder": 0.02, "jitter": 0.0005},
+}
+# (名称, 接收进程, 延迟解码)
+STRATEGIES = (("thread", False, True), ("thread-direct", False, False), ("process", True, True))
+_SIM = "127.0.0.60"
+_PROXY = "127.0.0.61"
+
+
+def _sim(stop):
+    sim = DetSim(_SIM, heartbeat=0)
+    stop.wait()
+    sim.close()
+
+
+def _proxy(kw: dict, stop, out):
+    proxy = DetImpair(_PROXY, _SIM, **kw)
+    stop.wait()
+    proxy.close()
+    out.put(proxy.counts)
+
+
+def _check(data) -> tuple[int, int]:
+    """返回(完整帧数, 损坏帧数)"""
+    valid = data.valid
+    frame = data.head["frame"].astype(np.int64)
+    per = valid.shape[1]
+    expect = (np.arange(per)[None, :] + frame[:, None]) & 0xFFFF
+    first = data["data"].reshape(len(data), per, -1)[:, :, 0]
+    # head["frame"]由组帧器连续编号, 包内的帧号(data[0] - idx)与之相符即帧号连续
+    bad = ((first != expect) & valid).any(axis=1)
+    return (int((valid.all(axis=1) & ~bad).sum()), int(bad.sum()))
+
+
+def run(scenario: str, strategy: tuple, port: int, num: int, intr: int) -> dict:
+    (name, process, defer) = strategy
+    kw = dict(SCENARIOS[scenario])
+    rcvBuf = kw.pop("rcvBuf", None)
+    ctx = multiprocessing.get_context("spawn")
+    (stop, out) = (ctx.Event(), ctx.Queue())
+    proxy = ctx.Process(target=_proxy, args=(kw, stop, out), daemon=True)
+    proxy.start()
+    time.sleep(0.5)
+    srv = DetData("127.0.0.1", port=port, process=process)
+    if rcvBuf is not None:
+        srv._s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvBuf)
+    det = Det(_PROXY).getInstance("D80").addQueue(srv.addDet(_PROXY))
+    srv.listen()
+    (frames, complete, corrupted) = (0, 0, 0)
+    drops0 = srv.stats()["socket"]["kernelDrops"] or 0
+    t = time.perf_counter()
+    try:
+        for chunk in det.histStream(num, intr, chunk=64, defer=defer):
+            (c, b) = _check(chunk)
+            frames += len(chunk)
+            complete += c
+            corrupted += b
+    finally:
+        elapsed = time.perf_counter() - t
+        drops = (srv.stats()["socket"]["kernelDrops"] or 0) - drops0
+        stop.set()
+        counts = out.get(timeout=5)
+        proxy.join()
+        srv.close()
+    return {
+        "scenario": scenario,
+        "strategy": name,
+        "frames": frames,
+        "complete": complete,
+        "corrupted": corrupted,
+        "lostPackets": det.acqStats()["lostPackets"],
+        "kernelDrops": drops,
+        "fps": frames / elapsed,
+        "completeFps": complete / elapsed,
+        "proxy": counts,
+    }
+
+
+def bench(num: int = 2000, intr: int = 50, scenarios=None, strategies=STRATEGIES) -> list[dict]:
+    ctx = multiprocessing.get_context("spawn")
+    stop = ctx.Event()
+    sim = ctx.Process(target=_sim, args=(stop,), daemon=True)
+    sim.start()
+    time.sleep(0.5)
+    res = []
+    port = 7600
+    try:
+        for scenario in scenarios or SCENARIOS:
+            for strategy in strategies:
+                # 每次用新端口, 上一次的套接字可能尚未回收
+                port += 1
+                res.append(run(scenario, strategy, port, num, intr))
+    finally:
+        stop.set()
+        sim.join()
+    return res
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="网络损伤下的采集基准")
+    parser.add_argument("--num", type=int, default=2000, help="每次采集的帧数")
+    parser.add_argument("--intr", type=int, default=50, help="采集时间(100us), 决定包率")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="默认全部场景")
+    args = parser.parse_args()
+    print(f"{'scenario':<10} {'strategy':<14} {'frames':>7} {'complete':>8} {'corrupt':>7} "
+          f"{'lostPkts':>8} {'kDrops':>7} {'fps':>7} {'okFps':>7}")
+    for r in bench(args.num, args.intr, args.scenario):
+        print(f"{r['scenario']:<10} {r['strategy']:<14} {r['frames']:>7} {r['complete']:>8} {r['corrupted']:>7} "
+              f"{r['lostPackets']:>8} {r['kernelDrops']:>7} {r['fps']:>7.0f} {r['completeFps']:>7.0f}")
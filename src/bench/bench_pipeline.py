@@ -0,0 +1,297 @@
+# bench/bench_pipeline.py
+# 端到端基准: 收包 -> 解码组帧 -> 保存 -> 重建/显示, 各阶段以合成数据在生产规格下单独测量
+#   recv:        模拟器(tools.det_sim)按采集时间--intr发包, 经本机UDP发给DetData(接收进程), Det.histStream逐块收齐
+#                吞吐受包率限制, 主要看丢包/内核丢包和每块延迟
+#   decode:      合成数据包整块写入DetRing, 只计Det._assemble/_acqChunk组帧(与采集相同的延迟解码)
+#   save:        saveHist(hdf5storage.savemat)写临时文件
+#   reconstruct: 与showHist相同的求和后执行_show(错位校正插值/对数)
+#   show:        showHist完整执行(Agg后端, 不弹窗)
+# 每个(阶段, 规格)在新的子进程中执行, 峰值RSS只属于该阶段; 吞吐为帧/s和MB/s, 延迟为每块(64帧)或每次调用的分位数
+# save/reconstruct/show需要整体结果在内存中, 原始数据超过--budget的规格跳过
+#   cd src && python -m bench.bench_pipeline --json result.json
+#   cd src && python -m bench.bench_pipeline --full --stage decode --stage save
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import logging
+import platform
+import tempfile
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+STAGES = ("recv", "decode", "save", "reconstruct", "show")
+PIXELS = (80, 256)
+BINS = (120, 512)
+FRAMES = (1000, 8000)
+FRAMES_FULL = (1000, 8000, 64000)
+_CHUNK = 64
+# 逐块处理的阶段, 内存只与块大小有关, 不受--budget限制
+_STREAM = ("recv", "decode")
+_SIM = "127.0.0.50"
+
+
+def _rss() -> float | None:
+    """本进程的峰值RSS(MB), 不支持时为None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux为KB, macOS为字节
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def _det(pixNum: int):
+    from core.Det import Det
+    det = Det("127.0.0.1").getInstance("D80")
+    det.detParam = dict(det.detParam, pixNum=pixNum)
+    return det
+
+
+def _formats(bins: int):
+    from core.Det import Det
+    dt = Det.histDataType((0, bins - 1))
+    return (dt(withInfo=True, withPos0=True, withPos1=True), dt())
+
+
+def _frames(pixNum: int, bins: int, frames: int):
+    """合成的采集结果, 格式与histAcq相同"""
+    from core.Det import DetFrames
+    (headType, dataType) = _formats(bins)
+    data = DetFrames.fromPackets(np.zeros(1, headType), np.zeros((1, pixNum), dataType)).alloc(frames)
+    rng = np.random.default_rng(0)
+    data.head[:] = 0
+    data.head["frame"] = np.arange(frames)
+    for pos in ("pos0", "pos1"):
+        data.head[pos + "h"] = np.arange(frames) * 10
+        data.head[pos + "t"] = np.arange(frames) * 10 + 9
+    data.pix[:] = 0
+    data.pix["idx"] = np.arange(pixNum)
+    data.pix["dLen"] = bins
+    data.data[:] = rng.integers(0, 64, data.data.shape, dtype=np.uint16)
+    data.valid[:] = True
+    return data
+
+
+def _recv(pixNum: int, bins: int, frames: int, port: int, intr: int = 50) -> dict:
+    from core.Det.DetData import DetData
+    ctx = multiprocessing.get_context("spawn")
+    stop = ctx.Event()
+    sim = ctx.Process(target=_simMain, args=(pixNum, bins, stop), daemon=True)
+    sim.start()
+    time.sleep(0.5)
+    srv = DetData("127.0.0.1", port=port, process=True)
+    det = _det(pixNum).addQueue(srv.addDet(_SIM))
+    srv.listen()
+    samples = []
+    try:
+        t = time.perf_counter()
+        for chunk in det.histStream(frames, intr, _CHUNK):
+            now = time.perf_counter()
+            samples.append(now - t)
+            t = now
+        stats = srv.stats()
+    finally:
+        stop.set()
+        sim.join()
+        srv.close()
+    lost = det.acqStats()["lostPackets"]
+    extra = {"intr": intr, "lostPackets": lost, "kernelDrops": stats["socket"]["kernelDrops"]}
+    return {"samples": samples, "extra": extra}
+
+
+def _simMain(pixNum: int, bins: int, stop):
+    from tools.det_sim import DetSim
+    sim = DetSim(_SIM, pixNum=pixNum, bins=bins, speed=1.0, heartbeat=0)
+    stop.wait()
+    sim.close()
+
+
+def _put(ring, rows: np.ndarray, lens: np.ndarray):
+    """一块包整批写入环形缓冲区(代替接收线程)"""
+    n = rows.shape[0]
+    (w, slots) = (ring._w, ring._slots)
+    k = w % slots
+    m = min(n, slots - k)
+    for (dst, src) in ((slice(k, k + m), slice(0, m)), (slice(0, n - m), slice(m, n))):
+        ring._buf[dst, :rows.shape[1]] = rows[src]
+        ring._lens[dst] = lens[src]
+        ring._ids[dst] = 2
+    ring._w = w + n
+    ring.flush()
+
+
+def _decode(pixNum: int, bins: int, frames: int, port: int) -> dict:
+    from core.Det.DetRing import DetRing
+    (headType, dataType) = _formats(bins)
+    det = _det(pixNum)
+    n = _CHUNK * pixNum
+    det.addQueue((None, DetRing(slots=2 * n, budget=1 << 30)))
+    asm = det._acqPrepare("能谱", pixNum, headType, dataType, _CHUNK, 1)
+    # 一块包: 每帧第一个为包头包
+    width = asm.width
+    rows = np.zeros((n, width), dtype=np.uint8)
+    rows[:, :8] = np.frombuffer(b"VPDT" + (2).to_bytes(4, "little"), dtype=np.uint8)
+    isHead = np.arange(n) % pixNum == 0
+    lens = np.where(isHead, 8 + headType.itemsize, 8 + dataType.itemsize).astype(np.int32)
+    dv = rows[:, 8:8 + dataType.itemsize].view(dataType)[:, 0]
+    hv = rows[::pixNum, 8:8 + headType.itemsize].view(headType)[:, 0]
+    dv["idx"] = np.arange(n) % pixNum
+    dv["dLen"] = bins
+    hv["dLen"] = bins
+    local = np.arange(n) // pixNum
+    samples = []
+    frame0 = None
+    for c0 in range(0, frames, _CHUNK):
+        dv["frame"][~isHead] = (c0 + local)[~isHead]
+        hv["frame"] = c0 + np.arange(_CHUNK)
+        _put(det._qr, rows, lens)
+        t = time.perf_counter()
+        data = det._assemble(asm, _CHUNK, 1, True)
+        (data, frame0) = det._acqChunk(asm, data, 0, 1, frame0)
+        samples.append(time.perf_counter() - t)
+    assert data.valid.all()
+    return {"samples": samples}
+
+
+def _save(pixNum: int, bins: int, frames: int, port: int, repeat: int = 3) -> dict:
+    from core.AcqFunc.AcqFunc import saveHist
+    data = _frames(pixNum, bins, frames)
+    tmp = tempfile.mkdtemp()
+    samples = []
+    try:
+        for i in range(repeat):
+            path = os.path.join(tmp, f"bench{i}.mat")
+            t = time.perf_counter()
+            saveHist(data, path, None)
+            samples.append(time.perf_counter() - t)
+        size = os.path.getsize(path)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return {"samples": samples, "extra": {"fileMB": size / 1e6}}
+
+
+def _reconstruct(pixNum: int, bins: int, frames: int, port: int, repeat: int = 3) -> dict:
+    from core.AcqFunc.AcqFunc import _show
+    data = _frames(pixNum, bins, frames)
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        img = np.transpose(data["data"], (2, 1, 0)).sum(axis=0).astype(np.float64).T
+        pos = data["pos0h"][:, 0].astype(np.float64) * 0.0375
+        _show(img, pos, 1.18, True)
+        samples.append(time.perf_counter() - t)
+    return {"samples": samples}
+
+
+def _showStage(pixNum: int, bins: int, frames: int, port: int, repeat: int = 3) -> dict:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from core.AcqFunc.AcqFunc import showHist
+    data = _frames(pixNum, bins, frames)
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        showHist(data)
+        samples.append(time.perf_counter() - t)
+        plt.close("all")
+    return {"samples": samples}
+
+
+_STAGE_FN = {"recv": _recv, "decode": _decode, "save": _save, "reconstruct": _reconstruct, "show": _showStage}
+
+
+def _case(stage: str, pixNum: int, bins: int, frames: int, port: int, kw: dict) -> dict:
+    """子进程中执行一个(阶段, 规格)"""
+    logging.basicConfig(level=logging.ERROR)
+    base = _rss()
+    res = _STAGE_FN[stage](pixNum, bins, frames, port, **kw)
+    samples = np.array(res["samples"])
+    total = samples.sum()
+    # 每个样本处理的帧数: 流式阶段为一块, 其余为全部帧
+    per = _CHUNK if stage in _STREAM else frames
+    nbytes = frames * pixNum * bins * 2
+    out = {
+        "stage": stage,
+        "pixNum": pixNum,
+        "bins": bins,
+        "frames": frames,
+        "fps": float(per * len(samples) / total),
+        "MBps": float(nbytes / 1e6 * (per * len(samples) / frames) / total),
+        "latency": {"unit": "chunk" if per == _CHUNK else "call", **{
+            f"p{q}": float(np.percentile(samples, q) * 1e3) for q in (50, 90, 99)
+        }, "max": float(samples.max() * 1e3)},
+        "peakRssMB": _rss(),
+        "baseRssMB": base,
+    }
+    out.update(res.get("extra", {}))
+    return out
+
+
+def meta() -> dict:
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": socket.gethostname(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "cpus": os.cpu_count(),
+    }
+
+
+def bench(
+    stages=STAGES, pixels=PIXELS, bins=BINS, frames=FRAMES, budget: float = 512, intr: int = 50
+) -> list[dict]:
+    res = []
+    port = 7700
+    ctx = multiprocessing.get_context("spawn")
+    for stage in stages:
+        for pixNum in pixels:
+            for b in bins:
+                for num in frames:
+                    nbytes = num * pixNum * b * 2
+                    if stage not in _STREAM and nbytes > budget * 1024 * 1024:
+                        res.append({"stage": stage, "pixNum": pixNum, "bins": b, "frames": num, "skipped": "budget"})
+                        continue
+                    port += 1
+                    kw = {"intr": intr} if stage == "recv" else {}
+                    # 每个规格一个新进程, 峰值RSS互不影响
+                    with ProcessPoolExecutor(1, mp_context=ctx) as pool:
+                        res.append(pool.submit(_case, stage, pixNum, b, num, port, kw).result())
+    return res
+
+
+def _print(r: dict):
+    head = f"{r['stage']:<12} pix={r['pixNum']:<4} bins={r['bins']:<4} frames={r['frames']:<6}"
+    if "skipped" in r:
+        print(f"{head} skipped ({r['skipped']})")
+        return
+    lat = r["latency"]
+    print(f"{head} {r['fps']:10.0f} fps {r['MBps']:9.1f} MB/s  "
+          f"p50 {lat['p50']:9.2f} p99 {lat['p99']:9.2f} ms/{lat['unit']:<5} peakRSS {r['peakRssMB'] or 0:7.0f} MB"
+          + (f"  lost {r['lostPackets']} kDrops {r['kernelDrops']}" if "lostPackets" in r else ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="收包/解码/保存/重建各阶段的端到端基准")
+    parser.add_argument("--stage", action="append", choices=STAGES, help="默认全部阶段")
+    parser.add_argument("--full", action="store_true", help="帧数加上64000")
+    parser.add_argument("--budget", type=float, default=512, help="单个规格原始数据的上限(MB)")
+    parser.add_argument("--intr", type=int, default=50, help="recv阶段的采集时间(100us), 决定包率")
+    parser.add_argument("--json", help="结果写入JSON文件")
+    args = parser.parse_args()
+    frames = FRAMES_FULL if args.full else FRAMES
+    results = []
+    for stage in args.stage or STAGES:
+        for r in bench((stage,), frames=frames, budget=args.budget, intr=args.intr):
+            _print(r)
+            results.append(r)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"meta": meta(), "results": results}, f, indent=2)
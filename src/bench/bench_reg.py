@@ -0,0 +1,96 @@
+# bench/bench_reg.py
+# 寄存器事务基准: 模拟器(tools.det_sim) -> 损伤代理(tools.det_impair, 控制包也损伤) -> DetData
+# 每种控制包丢包率下反复读取全部状态(Det.status), 报告状态读取的延迟分位数/失败次数和事务层统计(重发/rto)
+#   cd src && python -m bench.bench_reg --num 200
+import time
+import argparse
+import multiprocessing
+import numpy as np
+from core.Det import Det, DetData
+from core.Det.DetTrans import TransError
+from tools.det_sim import DetSim
+from tools.det_impair import DetImpair
+
+LOSSES = (0.0, 0.01, 0.05, 0.1)
+_SIM = "127.0.0.62"
+_PROXY = "127.0.0.63"
+
+
+def _sim(stop):
+    sim = DetSim(_SIM, heartbeat=0)
+    stop.wait()
+    sim.close()
+
+
+def _proxy(loss: float, stop):
+    proxy = DetImpair(_PROXY, _SIM, loss=loss, ctrl=True)
+    stop.wait()
+    proxy.close()
+
+
+def run(loss: float, port: int, num: int) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    stop = ctx.Event()
+    proxy = ctx.Process(target=_proxy, args=(loss, stop), daemon=True)
+    proxy.start()
+    time.sleep(0.5)
+    srv = DetData("127.0.0.1", port=port)
+    srv.probeEvery = 0
+    srv.listen()
+    det = Det(_PROXY).getInstance("D80").addQueue(srv.addDet(_PROXY))
+    lat = []
+    failed = 0
+    try:
+        for _ in range(num):
+            # 每次都访问设备
+            det.shadow.invalidate(det.shadow.known())
+            t = time.perf_counter()
+            try:
+                det.status()
+            except TransError:
+                failed += 1
+            lat.append(time.perf_counter() - t)
+        reg = srv.stats()["reg"][_PROXY]
+    finally:
+        stop.set()
+        proxy.join()
+        srv.close()
+    lat = np.array(lat) * 1e3
+    return {
+        "loss": loss,
+        "p50": float(np.percentile(lat, 50)),
+        "p99": float(np.percentile(lat, 99)),
+        "max": float(lat.max()),
+        "failed": failed,
+        "reg": reg,
+    }
+
+
+def bench(num: int = 200, losses=LOSSES) -> list[dict]:
+    ctx = multiprocessing.get_context("spawn")
+    stop = ctx.Event()
+    sim = ctx.Process(target=_sim, args=(stop,), daemon=True)
+    sim.start()
+    time.sleep(0.5)
+    res = []
+    port = 7650
+    try:
+        for loss in losses:
+            port += 1
+            res.append(run(loss, port, num))
+    finally:
+        stop.set()
+        sim.join()
+    return res
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="控制包丢包下的寄存器读取延迟")
+    parser.add_argument("--num", type=int, default=200, help="每种丢包率下读取状态的次数")
+    args = parser.parse_args()
+    print(f"{'loss':>5} {'p50ms':>7} {'p99ms':>7} {'maxms':>7} {'failed':>6} {'requests':>8} {'retries':>7} "
+          f"{'regP99ms':>8} {'rtoMs':>6}")
+    for r in bench(args.num):
+        reg = r["reg"]
+        print(f"{r['loss']:>5.2f} {r['p50']:>7.2f} {r['p99']:>7.2f} {r['max']:>7.1f} {r['failed']:>6} "
+              f"{reg['requests']:>8} {reg['retries']:>7} {(reg['p99'] or 0) * 1e3:>8.2f} {reg['rto'] * 1e3:>6.1f}")
@@ -0,0 +1,74 @@
+# bench/bench_shard.py
+# 接收分片基准: 多个发包进程以127.0.0.x冒充设备尽速发送数据包, 比较所有设备共用一个接收进程与每个设备一个接收分片时的总包率
+# 发包进程也占CPU, 核数不少于2倍设备数时结果才反映接收端的扩展
+#   cd src && python -m bench.bench_shard
+import os
+import time
+import socket
+import struct
+import threading
+import multiprocessing
+from core.Det.DetData import DetData
+
+
+def _blast(ip: str, port: int, size: int, stop):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind((ip, 7493))
+    pkt = b"VPDT" + struct.pack("<L", 2) + bytes(size)
+    dst = ("127.0.0.1", port)
+    while not stop.is_set():
+        for _ in range(256):
+            try:
+                s.sendto(pkt, dst)
+            except OSError:
+                # 接收缓冲区满(ENOBUFS)
+                pass
+
+
+def _drain(srv: DetData, flag: list[bool]):
+    # 只测接收, 消费者直接丢弃环中的包
+    while flag[0]:
+        for ring in list(srv._detR.values()):
+            ring.clear()
+        time.sleep(0.005)
+
+
+def bench(devices: int, shard: bool, port: int = 7590, size: int = 1024, secs: float = 3) -> dict[str, float]:
+    ips = [f"127.0.0.{100 + i}" for i in range(devices)]
+    srv = DetData("127.0.0.1", port=port, process=True, shard=shard)
+    for ip in ips:
+        srv.addDet(ip)
+    srv.listen()
+    flag = [True]
+    threading.Thread(target=_drain, args=(srv, flag), daemon=True).start()
+    ctx = multiprocessing.get_context("spawn")
+    stop = ctx.Event()
+    procs = [ctx.Process(target=_blast, args=(ip, port, size, stop), daemon=True) for ip in ips]
+    for p in procs:
+        p.start()
+    try:
+        time.sleep(1)
+        drops0 = srv.stats()["socket"]["kernelDrops"] or 0
+        srv.throughput()
+        time.sleep(secs)
+        res = srv.throughput()
+        drops = (srv.stats()["socket"]["kernelDrops"] or 0) - drops0
+    finally:
+        stop.set()
+        for p in procs:
+            p.join()
+        flag[0] = False
+        srv.close()
+    return {"pps": res["pps"], "Mbps": res["bps"] / 1e6, "kernelDrops": drops}
+
+
+if __name__ == "__main__":
+    print(f"cpu: {os.cpu_count()}")
+    port = 7590
+    for devices in (1, 2, 4):
+        for shard in (False, True):
+            # 每次用新端口, 上一次的套接字可能尚未回收
+            port += 1
+            res = bench(devices, shard, port)
+            print(f"devices={devices}  shards={devices if shard else 1}  "
+                  f"pps: {res['pps']:10.0f}  Mbps: {res['Mbps']:8.1f}  kernelDrops: {res['kernelDrops']}")
@@ -18,30 +18,32 @@ def _move(speed, pos):
     time.sleep(3.5)
     return pause
 
+def _acqCnt(cnt, time, interval):
+    if cnt is None:
+        return int(time * 1000 * 10 / interval)
+    elif time is None:
+        return cnt
+    else:
+        raise ValueError("请传入时间或次数")
+
 def histAcq(det, speed, pos, interval = 5 * 10):
     movetime = _move(speed, pos)
     acq_time = 1 + movetime
-    acq_cnt = int(acq_time * 1000 * 10 / interval)
+    acq_cnt = _acqCnt(None, acq_time, interval)
     data = det.histAcq(acq_cnt, interval) # cnt & 0.1ms
-    sdataIdx = data["idx"].argsort()
-    for i in range(data.shape[0]):
-        data[i, :] = data[i, sdataIdx[i]]
     # delay back
     time.sleep(pos / 10000 + 1)
     return data
 
-def histAcqNoMove(det, cnt=None, time=None, interval = 5 * 10):
-    if cnt is None:
-        acq_cnt = int(time * 1000 * 10 / interval)
-    elif time is None:
-        acq_cnt = cnt
-    else:
-        raise ValueError("请传入时间或次数")
-    data = det.histAcq(acq_cnt, interval)
-    sdataIdx = data["idx"].argsort()
-    for i in range(data.shape[0]):
-        data[i, :] = data[i, sdataIdx[i]]
-    return data
+def histAcqNoMove(det, cnt=None, time=None, interval = 5 * 10, progress=None):
+    """progress(已采集帧数, 总帧数)在每收齐一块后调用"""
+    acq_cnt = _acqCnt(cnt, time, interval)
+    return det.histAcq(acq_cnt, interval, progress)
+
+def histStreamNoMove(det, cnt=None, time=None, interval = 5 * 10, chunk = 64):
+    """histAcqNoMove的流式版本, 每收齐chunk帧产出一段数据"""
+    acq_cnt = _acqCnt(cnt, time, interval)
+    yield from det.histStream(acq_cnt, interval, chunk)
 
 def move(speed, pos):
     pause = _move(speed, pos)
@@ -97,11 +99,12 @@ def _save(name, data):
 def saveHist(data, name, calFile: str | None = ""):
     d = {
         "d": {
-            "ypos": data[:, 0]["pos1h"],
-            "yposend": data[:, 0]["pos1t"],
-            "pos": data[:, 0]["pos0h"],
-            "posend": data[:, 0]["pos0t"],
-            "data": np.transpose(data["data"], (2, 1, 0))
+            "ypos": data["pos1h"][:, 0],
+            "yposend": data["pos1t"][:, 0],
+            "pos": data["pos0h"][:, 0],
+            "posend": data["pos0t"][:, 0],
+            "data": np.transpose(data["data"], (2, 1, 0)),
+            "valid": np.transpose(data["valid"], (1, 0)),
         }
     }
     # plt.figure()
@@ -2,3 +2,4 @@ from .AcqFunc import histAcq
 from .AcqFunc import saveHist
 from .AcqFunc import showHist
 from .AcqFunc import histAcqNoMove
+from .AcqFunc import histStreamNoMove
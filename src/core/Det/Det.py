@@ -1,22 +1,32 @@
 import time
 import struct
 import logging
+import threading
 import numpy as np
-from queue import Queue, Empty
-
-
-class DecodeError(Exception):
-    pass
+from queue import Empty
+from core.Det.DetRing import MTU_PAYLOAD
+from core.Det.DetTrans import TransError
+from core.Det.DetShadow import DetShadow
+from core.Det.DetTxn import DetTxn
+from core.Det.DetFrames import DetFrames
+from core.Det.DetAsm import DetAsm
 
 
 class Det():
     def __init__(self, ip: str):
         self._ip = ip
+        self.shadow = DetShadow()
+        # 当前线程正在暂存的配置事务
+        self._txnLocal = threading.local()
+        self._acqStat = {}
+        # 链路状态(DetLink), 有往返时延测量时据此确定采集的等待超时
+        self.link = None
 
     def _stAddr(self):
         return (self._ip, 7493)
 
     def getInstance(self, model: str) -> 'Det':
+        self.model = model
         modelRef = self.getModelRef()
         param = modelRef.get(model)
         if param is None:
@@ -25,37 +35,112 @@ class Det():
             self.detParam = param
         return self
 
-    def addQueue(self, q: tuple[Queue, Queue]):
-        (self._qr, self._qt) = q
+    def addQueue(self, q: tuple):
+        """q为DetData.addDet返回的(事务层, 环形缓冲区[, 链路状态])"""
+        (self._trans, self._qr, *link) = q
+        self.link = link[0] if link else None
         return self
 
+    def _regBurst(
+        self, writes: list[tuple[int, int]] = (), reads: list[int] = (),
+        cached: bool = True, errors: dict[int, str] = None
+    ) -> list[int]:
+        """
+        写入与读取放在同一个流水线窗口中, 返回读取结果, 写入失败的地址记录到errors(为None时抛出TransError)
+        读取失败(重发用尽或超时)抛出TransError
+        写入成功后同步到影子寄存器, 可缓存的读取命中影子时不访问设备
+        """
+        burst = self.armBurst(writes, reads, cached)
+        return self.waitBurst(burst, self.fireBurst(burst), errors)
+
+    def armBurst(self, writes: list[tuple[int, int]] = (), reads: list[int] = (), cached: bool = True) -> tuple:
+        """
+        准备一个突发但不发送: 依次调用fireBurst发送, waitBurst等待结果(同_regBurst)
+        多设备同步下发时先全部准备好, 再连续发送, 最后逐个等待
+        """
+        return self._burstReqs(writes, reads, cached)
+
+    def fireBurst(self, burst: tuple):
+        """只发送armBurst准备的突发, 返回交给waitBurst的凭据(截止时间)"""
+        (_, wReqs, rReqs) = burst
+        return self._trans.submit(wReqs + rReqs)
+
+    def waitBurst(self, burst: tuple, token, errors: dict[int, str] = None) -> list[int]:
+        (values, wReqs, rReqs) = burst
+        self._trans.collect(wReqs + rReqs, token)
+        return self._burstDone(values, wReqs, rReqs, errors)
+
+    def _burstReqs(self, writes, reads, cached: bool) -> tuple[list, list, list]:
+        """突发的请求: (命中影子的读取值, 写请求, 需访问设备的读请求)"""
+        written = {addr for (addr, _) in writes}
+        values = [self.shadow.get(addr) if cached and addr not in written else None for addr in reads]
+        wReqs = [self._trans.write(addr, data) for (addr, data) in writes]
+        rReqs = [self._trans.read(addr) for (addr, value) in zip(reads, values) if value is None]
+        return (values, wReqs, rReqs)
+
+    def _burstDone(self, values: list, wReqs: list, rReqs: list, errors: dict[int, str] = None) -> list[int]:
+        failed = {}
+        for req in wReqs:
+            if req.done:
+                self.shadow.put(req.addr, req.data)
+                logging.debug(f"设备({self._ip})写入地址{req.addr}成功")
+            else:
+                self.shadow.invalidate([req.addr])
+                failed[req.addr] = req.error or "超时"
+        if errors is not None:
+            errors.update(failed)
+        elif failed:
+            raise TransError(f"设备({self._ip})写入失败: {self._errText(failed)}")
+        lost = {req.addr: req.error or "超时" for req in rReqs if not req.done}
+        if lost:
+            raise TransError(f"设备({self._ip})读取失败: {self._errText(lost)}")
+        for req in rReqs:
+            self.shadow.put(req.addr, req.value)
+        rIter = iter(rReqs)
+        return [next(rIter).value if value is None else value for value in values]
+
+    @staticmethod
+    def _errText(errors: dict[int, str]) -> str:
+        return ", ".join(f"0x{addr:04X}({err})" for (addr, err) in errors.items())
+
+    def transaction(self, diff: bool = True) -> DetTxn:
+        """配置事务, 期间本线程的寄存器写入暂存并在退出时合并下发"""
+        return DetTxn(self, diff)
+
+    def DetectRegSetMany(self, items: list[tuple[int, int]]):
+        txn = getattr(self._txnLocal, "txn", None)
+        if txn is not None:
+            for (addr, data) in items:
+                txn.set(addr, data)
+            return
+        self._regBurst(writes=items)
+
+    def DetectRegReadMany(self, addrs: list[int], cached: bool = True) -> list[int]:
+        return self._regBurst(reads=addrs, cached=cached)
+
     def DetectRegSet(self, addr: int, data: int):
-        stId = 1
-        stData = struct.pack("<HHL", 1, addr, data)  # write
-        self._qt.put((self._ip, stId, stData))
-        self._qr.queue.clear()
-        try:
-            id = 0
-            while id != stId:
-                (ip, id, data) = self._qr.get(timeout=2)
-            logging.debug(f"设备({self._ip})写入地址{addr}成功")
-        except Empty as e:
-            logging.warning(f"设备({self._ip})写地址{addr}超时: {e}")
-
-    def DetectRegRead(self, addr: int) -> int:
-        stId = 1
-        stData = struct.pack("<HH", 0, addr)  # read
-        self._qt.put((self._ip, stId, stData))
-        self._qr.queue.clear()
-        try:
-            id = 0
-            while id != stId:
-                (ip, id, data) = self._qr.get(timeout=2)
-                (flag, rAddr, data) = struct.unpack("<HHL", data)
-            logging.debug(f"设备({self._ip})读取地址{addr}成功")
-        except Empty as e:
-            logging.warning(f"设备({self._ip})读取地址{addr}超时: {e}")
-        return data
+        self.DetectRegSetMany([(addr, data)])
+
+    def DetectRegRead(self, addr: int, cached: bool = True) -> int:
+        return self.DetectRegReadMany([addr], cached)[0]
+
+    def shadowSync(self, addrs: list[int] = None) -> 'Det':
+        """
+        从设备重新读取影子寄存器(默认为已缓存的全部地址)
+        设备重新上电或被其他上位机改写后调用
+        """
+        addrs = self.shadow.known() if addrs is None else addrs
+        self.shadow.invalidate(addrs)
+        self._regBurst(reads=addrs, cached=False)
+        return self
+
+    def _regs(self, addrs: list[int], reg: dict[int, int] = None) -> dict[int, int]:
+        """在一个窗口内读取reg中还没有的地址"""
+        reg = {} if reg is None else reg
+        addrs = [addr for addr in addrs if addr not in reg]
+        if addrs:
+            reg.update(zip(addrs, self.DetectRegReadMany(addrs)))
+        return reg
 
     def setWinNum(self, num: int) -> 'Det':
         winNum = self.detParam["winNum"]
@@ -90,10 +175,11 @@ class Det():
         logging.info(f"设置能窗{win}为[{low}, {high}]")
         return self
     
-    def statusPower(self) -> dict[str, float]:
-        voltage = self.DetectRegRead(0x97) * 1.25 / 1000
-        currnet = self.DetectRegRead(0x98) * 1.0 / 1000
-        power = self.DetectRegRead(0x99) * 25 / 1000
+    def statusPower(self, reg: dict[int, int] = None) -> dict[str, float]:
+        reg = self._regs([0x97, 0x98, 0x99], reg)
+        voltage = reg[0x97] * 1.25 / 1000
+        currnet = reg[0x98] * 1.0 / 1000
+        power = reg[0x99] * 25 / 1000
         return {"voltage": voltage, "currnet": currnet, "power": power}
     
     def setPowerSwitch(self, power: dict) -> 'Det':
@@ -105,12 +191,13 @@ class Det():
         self.DetectRegSet(0x60, cr)
         return self
     
-    def statusPowerSwitch(self) -> dict[str, str|bool]:
+    def statusPowerSwitch(self, reg: dict[int, int] = None) -> dict[str, str|bool]:
         """
         status = {"vcc12": 1, "laser1": 0, "laser0": 0, "vdd25": "11111111", "opa": "1111111111111111", "vbias": "00000000"}
         """
-        localPower = self.DetectRegRead(0x61)
-        ioBoardPower = self.DetectRegRead(0x62)
+        reg = self._regs([0x61, 0x62], reg)
+        localPower = reg[0x61]
+        ioBoardPower = reg[0x62]
         status = {}
         status["vcc12"] = (ioBoardPower & (1 << 6)) != 0
         status["laser1"] = (ioBoardPower & (1 << 5)) != 0
@@ -129,6 +216,7 @@ class Det():
         """
         def real2pos(position):
             return struct.unpack('I', struct.pack('i', position))[0]
+        items = []
         for cfg in encoderCfg:
             pos = cfg.get("pos")
             if pos is None:
@@ -137,12 +225,13 @@ class Det():
             if not (0 <= pos < 2):
                 logging.error(f"pos编号必须在[0,2)之间")
                 continue
-            self.DetectRegSet(0x43 + pos * 8, real2pos(cfg["zeroShift"]))
+            items.append((0x43 + pos * 8, real2pos(cfg["zeroShift"])))
             cr = ((cfg["en"] != 0) << 2) | ((cfg["clearPos"] != 0) << 1) | (cfg["polarity"] != 0)
-            self.DetectRegSet(0x41 + pos * 8, cr)
+            items.append((0x41 + pos * 8, cr))
+        self.DetectRegSetMany(items)
         return self
     
-    def statusPosition(self, lsb: float = None) -> dict[str, int|float|bool]:
+    def statusPosition(self, lsb: float = None, reg: dict[int, int] = None) -> dict[str, int|float|bool]:
         """
         status = {"pos0": 3333, "pos1": 22222, "pos0A": 0, "pos0B": 1, "pos1A": 1, "pos1B": 0}
         """
@@ -152,137 +241,312 @@ class Det():
                 return pos
             else:
                 return pos * lsb
+        reg = self._regs([0x40, 0x42, 0x48, 0x4A], reg)
         status = {}
         for i in range(2):
-            sig = self.DetectRegRead(0x40 + i * 8)
+            sig = reg[0x40 + i * 8]
             status[f"pos{i}A"] = (sig & 1) != 0
             status[f"pos{i}B"] = (sig & 2) != 0
-            status[f"pos{i}"] = pos2real(self.DetectRegRead(0x42 + i * 8))
+            status[f"pos{i}"] = pos2real(reg[0x42 + i * 8])
         return status
 
-    def statusTemperature(self) -> dict[str, float|int]:
+    def statusTemperature(self, reg: dict[int, int] = None) -> dict[str, float|int]:
         def temp2real(tempRaw):
             return struct.unpack('h', struct.pack('H', tempRaw))[0] / 128
+        reg = self._regs([0x80, 0x91], reg)
         status = {}
-        boardNum = self.DetectRegRead(0x80)
+        boardNum = reg[0x80]
         status["boardNum"] = boardNum
-        ioBoardTemper = self.DetectRegRead(0x91)
+        ioBoardTemper = reg[0x91]
         status["temperIO_0"] = temp2real(ioBoardTemper & 0xFFFF)
         status["temperIO_1"] = temp2real(ioBoardTemper >> 16)
+        reg = self._regs(self._temperAddr(boardNum), reg)
         for i in range(boardNum):
             for j in range(2):
-                temper = self.DetectRegRead(0x81 + i * 2 + j)
+                temper = reg[0x81 + i * 2 + j]
                 status[f"temper{i}_{j * 2}"] = temp2real(temper & 0xFFFF)
                 status[f"temper{i}_{j * 2 + 1}"] = temp2real(temper >> 16)
         return status
 
-    def statusFanSpeed(self) -> dict[str, int]:
+    def statusFanSpeed(self, reg: dict[int, int] = None) -> dict[str, int]:
         def raw2speed(raw):
             return struct.unpack('h', struct.pack('H', raw))[0]
+        reg = self._regs([0x92], reg)
         status = {}
-        fanNum = self.DetectRegRead(0x92)
+        fanNum = reg[0x92]
         status["fanNum"] = fanNum
+        reg = self._regs(self._fanAddr(fanNum), reg)
         for i in range(0, fanNum, 2):
-            value = self.DetectRegRead(0x93 + i // 2)
+            value = reg[0x93 + i // 2]
             status[f"fanSpeed{i}"] = raw2speed(value & 0xFFFF)
             if i + 1 < fanNum:
                 status[f"fanSpeed{i+1}"] = raw2speed(value >> 16)
         return status
 
-    def histAcq(self, num: int, intr: int = 10000):
-        if num > 65535:
-            raise NotImplementedError("暂时没实现超过65535采样次数")
-            # 做个循环合并起来就好
-        if intr > 65535:
-            raise NotImplementedError("暂时没实现超过6.5535sec的采样时间")
-            # 做个循环合并起来就好
-        delay = (intr + 10000) / 10000 * 2
-
-        self.DetectRegSet(0x0012, 0x03)  # set mode auto
-        self.DetectRegSet(0x0013, 0x01)  # set detect hist mode
-        self.DetectRegSet(0x0014, intr)  # set auto acq time (100 us)
-        self.DetectRegSet(0x0015, num)  # set auto acq count
-
-        winRange = self.DetectRegRead(0x0021 + 0)
-        winHigh = winRange >> 16
-        winLow = winRange & 0xFFFF
-        head = self.DetectRegRead(0x0018)
-        infoEn = (head & (1 << 8)) != 0
-        pos0En = (head & (1 << 29)) != 0
-        pos1En = (head & (1 << 30)) != 0
-        dt = self.histDataType((winLow, winHigh))
-        headType = dt(withInfo=infoEn, withPos0=pos0En, withPos1=pos1En)
-        dataType = dt()
-        heads = np.zeros((num, self.detParam["pixNum"]), dtype=headType)
-        datas = np.zeros((num, self.detParam["pixNum"]), dtype=dataType)
-
-        logging.info(f"能谱模式采样开始, t:{time.time()}")
-        self.DetectRegSet(0x0011, 1)  # start acq
-        for i in range(num):
-            for j in range(self.detParam["pixNum"]):
-                (_, id, data) = self._qr.get(timeout=delay)
-                assert (id == 2)
-                if j == 0:
-                    heads[i, j] = np.frombuffer(data, dtype=headType, count=1)
+    @staticmethod
+    def _temperAddr(boardNum: int) -> list[int]:
+        return [0x81 + i for i in range(boardNum * 2)]
+
+    @staticmethod
+    def _fanAddr(fanNum: int) -> list[int]:
+        return [0x93 + i // 2 for i in range(0, fanNum, 2)]
+
+    def status(self, lsb: float = None) -> dict[str, dict]:
+        """
+        流水线读取全部状态, 固定地址一个窗口, 依赖板数/风扇数的地址一个窗口
+        """
+        reg = self._regs([0x80, 0x91, 0x92, 0x97, 0x98, 0x99, 0x61, 0x62, 0x40, 0x42, 0x48, 0x4A])
+        reg = self._regs(self._temperAddr(reg[0x80]) + self._fanAddr(reg[0x92]), reg)
+        return {
+            "temperature": self.statusTemperature(reg),
+            "position": self.statusPosition(lsb, reg),
+            "power": self.statusPower(reg),
+            "powerSwitch": self.statusPowerSwitch(reg),
+            "fanSpeed": self.statusFanSpeed(reg),
+        }
+
+    def _recvRaw(self, raw: np.ndarray, lens: np.ndarray, timeout: float) -> int:
+        """
+        延迟解码: 采集时只把包原样整批拷入raw的连续行, 不做任何解码
+        超时返回已收到的包数, 一个包都没有收到时抛出Empty
+        """
+        width = raw.shape[1]
+        k = 0
+        while k < raw.shape[0]:
+            try:
+                (ids, ls, rows) = self._qr.getView(raw.shape[0] - k, timeout)
+            except Empty:
+                if k == 0:
+                    raise
+                break
+            n = ids.shape[0]
+            raw[k:k + n] = rows[:, :width]
+            lens[k:k + n] = ls
+            k += n
+        return k
+
+    def _assemble(self, asm: DetAsm, n: int, timeout: float, defer: bool) -> DetFrames:
+        """
+        收齐接下来的n帧, 每个包按(frame, idx)放置, 乱序到达无需再排序
+        defer为True时按缺少的包数整批拷贝原始包后一次组帧, 否则逐批直接在环形缓冲区上组帧
+        丢包的帧在设备越过之后或超时后带着缺失标记产出, 整块超时没有任何数据时抛出Empty
+        """
+        while not asm.ready(n):
+            miss = asm.missing(n)
+            try:
+                if defer:
+                    raw = np.empty((miss, asm.width), dtype=np.uint8)
+                    lens = np.empty(miss, dtype=np.int32)
+                    got = self._recvRaw(raw, lens, timeout)
+                    asm.feed(lens[:got], raw[:got])
+                    if got < miss:
+                        raise Empty()
                 else:
-                    datas[i, j] = np.frombuffer(data, dtype=dataType, count=1)
-        logging.info(f"能谱模式采样结束, t:{time.time()}")
-
-        tgtFields = set(headType.names)
-        srcFields = set(dataType.names)
-        for field in (srcFields & tgtFields):
-            heads[:, 1:][field] = datas[:, 1:][field]
-        for field in tgtFields - srcFields:
-            heads[:, 1:][field] = np.tile(heads[:, 0][field][:, np.newaxis], (1, self.detParam["pixNum"] - 1))
-
-        return heads
-
-    def thrAcq(self, num: int, intr: int = 10000):
-        if num > 65535:
-            raise NotImplementedError("暂时没实现超过65535采样次数")
-            # 做个循环合并起来就好
-        if intr > 65535:
-            raise NotImplementedError("暂时没实现超过6.5535sec的采样时间")
-            # 做个循环合并起来就好
-        delay = (intr + 10000) / 10000 * 2
-
-        self.DetectRegSet(0x0012, 0x03)  # set mode auto
-        self.DetectRegSet(0x0013, 0x00)  # detect thr mode
-        self.DetectRegSet(0x0014, intr)  # set auto acq time (100 us)
-        self.DetectRegSet(0x0015, num)  # set auto acq count
-
-        winNum = self.DetectRegRead(0x0020) + 1
-        head = self.DetectRegRead(0x0018)
-        infoEn = (head & (1 << 8)) != 0
-        pos0En = (head & (1 << 29)) != 0
-        pos1En = (head & (1 << 30)) != 0
+                    (ids, lens, rows) = self._qr.getView(miss, timeout)
+                    asm.feed(lens, rows)
+            except Empty:
+                if asm.missing(n) == n * asm.per:
+                    raise
+                logging.warning(f"设备({self._ip})等待数据超时, 缺{asm.missing(n)}个包的帧按丢包处理")
+                break
+        return asm.take(n)
+
+    def _acqDelay(self, hwIntr: int) -> float:
+        """
+        等待数据的超时: 有往返时延测量时为两帧时间加rto和4倍心跳抖动(不少于0.2s, 留给本机调度),
+        否则按固定估计(两倍的帧时间加1s)
+        """
+        link = self.link
+        if link is None or not link.rtt.measured():
+            return (hwIntr + 10000) / 10000 * 2
+        return hwIntr / 10000 * 2 + max(0.2, link.rtt.rto() + 4 * link.jitter)
+
+    @classmethod
+    def subFrames(cls, intr: int) -> int:
+        """采集时间intr(100us)的一帧由几个硬件子帧组成"""
+        return cls._splitIntr(intr)[0]
+
+    @staticmethod
+    def _splitIntr(intr: int) -> tuple[int, int]:
+        """
+        单帧采集时间超过寄存器上限(65535 * 100us)时拆成k个等长子帧, 返回(k, 子帧时间)
+        无法等分时抛出ValueError, 不按缩短的时间采集
+        """
+        k = max(1, -(-intr // 65535))
+        for d in range(k, 4 * k + 1):
+            if intr % d == 0:
+                return (d, intr // d)
+        raise ValueError(f"采集时间{intr}无法等分为不超过65535的子帧, 可改为{k * (intr // k)}")
+
+    def _acqStream(
+        self, name: str, num: int, k: int, per: int,
+        headType: np.dtype, dataType: np.dtype, delay: float, chunk: int, defer: bool, start=None
+    ):
+        """
+        分段采集, 共num帧, 每帧由k个硬件子帧组成
+        每段不超过65535个硬件帧, 段之间只重新下发采集次数(有变化时)和启动命令
+        帧号跨段连续, 产出的每块最多chunk帧
+        defer为True时采集中只拷贝原始包, 每块收齐后一次组帧
+        start不为None时代替每段的启动命令, 由调用者(多设备同步启动)下发
+        """
+        asm = self._acqPrepare(name, per, headType, dataType, chunk, k)
+        frame0 = None
+        for (s0, segNum, sizes) in self._acqSegments(name, num, k, chunk):
+            writes = self._segWrites(segNum)
+            if writes:
+                self._regBurst(writes=writes)
+            if start is None:
+                self.DetectRegSet(0x0011, 1)  # start acq
+            else:
+                start()
+            # 设备每次启动从0计帧
+            asm.reset(0)
+            for n in sizes:
+                frames = self._assemble(asm, n, delay, defer)
+                (frames, frame0) = self._acqChunk(asm, frames, s0, k, frame0)
+                yield frames
+        self._acqFinish(name, asm)
+
+    @staticmethod
+    def _acqSegments(name: str, num: int, k: int, chunk: int):
+        """分段计划, 同步/异步采集共用: 产出(段起点, 段内硬件帧数, 各块的硬件帧数)"""
+        total = num * k
+        seg = 65535 // k * k
+        for s0 in range(0, total, seg):
+            if s0 > 0:
+                logging.info(f"{name}模式第{s0 // seg}段结束, 重新启动")
+            segNum = min(seg, total - s0)
+            yield (s0, segNum, [min(chunk * k, segNum - c0) for c0 in range(0, segNum, chunk * k)])
+
+    def _segWrites(self, segNum: int) -> list[tuple[int, int]]:
+        """每段启动前的写入: 采集次数与影子寄存器相同时不再下发"""
+        if self.shadow.get(0x0015) == segNum:
+            return []
+        return [(0x0015, segNum)]  # set auto acq count
+
+    def _acqPrepare(
+        self, name: str, per: int, headType: np.dtype, dataType: np.dtype, chunk: int, k: int
+    ) -> DetAsm:
+        # 接收行宽按当前数据格式确定, 包头包不小于数据包
+        pktLen = 8 + max(headType.itemsize, dataType.itemsize)
+        if pktLen > MTU_PAYLOAD:
+            logging.warning(f"{name}模式数据包{pktLen}字节, 超过标准MTU, 需要网卡开启巨型帧")
+        self._qr.reserve(pktLen)
+        # 丢弃上一次未读完的数据
+        self._qr.clear()
+        logging.info(f"{name}模式采样开始, t:{time.time()}")
+        return DetAsm(self._ip, headType, dataType, per, 2 * chunk * k, stat=self._qr.stat)
+
+    @staticmethod
+    def _acqChunk(asm: DetAsm, frames: DetFrames, s0: int, k: int, frame0: int) -> tuple[DetFrames, int]:
+        """帧号接续之前的段并合并子帧, 返回(产出的块, 第一帧帧号)"""
+        if frame0 is None:
+            frame0 = asm.first
+        if s0 > 0:
+            # 设备每段重新计帧, 接续上一段
+            frames.head["frame"] += np.uint32((frame0 + s0 - asm.first) & 0xFFFFFFFF)
+        return (frames if k == 1 else frames.mergeSub(k, frame0), frame0)
+
+    def _acqFinish(self, name: str, asm: DetAsm):
+        self._acqStat = asm.stats()
+        if self._acqStat["lostPackets"]:
+            logging.warning(f"设备({self._ip}){name}模式丢包: {self._acqStat}")
+        logging.info(f"{name}模式采样结束, t:{time.time()}")
+
+    def acqStats(self) -> dict[str, int]:
+        """最近一次采集的丢包统计, 各项含义见DetAsm.stats"""
+        return dict(self._acqStat)
+
+    @classmethod
+    def _acqJoin(cls, stream, num: int, progress=None) -> DetFrames:
+        """
+        流式结果拷入一次分配的整体结果, 峰值内存为结果加一块
+        progress不为None时每块拷入后调用progress(已采集帧数, num)
+        """
+        (data, done) = (None, 0)
+        for chunk in stream:
+            (data, done) = cls._acqPut(data, done, chunk, num, progress)
+        return data
+
+    @staticmethod
+    def _acqPut(data: DetFrames, done: int, chunk: DetFrames, num: int, progress=None) -> tuple[DetFrames, int]:
+        """一块拷入整体结果(第一块时分配), 返回(整体结果, 已拷入帧数)"""
+        if data is None:
+            data = chunk.alloc(num)
+        data[done:done + len(chunk)] = chunk
+        done += len(chunk)
+        if progress is not None:
+            progress(done, num)
+        return (data, done)
+
+    def histStream(self, num: int, intr: int = 10000, chunk: int = 64, defer: bool = False, start=None):
+        """
+        能谱模式流式采集, 每收齐chunk帧产出一个(chunk, pixNum)的DetFrames, 格式与histAcq相同
+        内存占用只与chunk有关, 保存/累加能谱/预览可与采集同时进行
+        超过65535帧或单帧超过6.5535sec时自动分段/拆分子帧, 对调用者仍是一个连续的帧流
+        默认逐批直接在接收缓冲区上组帧; defer为True时先整批拷贝原始包再组帧, 多一次拷贝, 一般更慢
+        """
+        (k, delay, writes, reads) = self._acqMode(True, intr)
+        (per, headType, dataType) = self._acqFormat(True, self._regBurst(writes=writes, reads=reads))
+        yield from self._acqStream("能谱", num, k, per, headType, dataType, delay, chunk, defer, start)
+
+    def _acqMode(self, hist: bool, intr: int) -> tuple[int, float, list[tuple[int, int]], list[int]]:
+        """
+        采集前的配置, 同步/异步采集共用: 返回(子帧数, 等待数据的超时, 模式寄存器写入, 格式寄存器读取)
+        写入与读取在一个突发中完成, 读取结果交给_acqFormat
+        """
+        (k, hwIntr) = self._splitIntr(intr)
+        writes = self._modeRegs(0x01 if hist else 0x00, hwIntr)
+        reads = [0x0021 + 0, 0x0018] if hist else [0x0020, 0x0018]
+        return (k, self._acqDelay(hwIntr), writes, reads)
+
+    def _acqFormat(self, hist: bool, values: list[int]) -> tuple[int, np.dtype, np.dtype]:
+        """由_acqMode读取的寄存器确定(每帧包数, 包头包格式, 数据包格式)"""
+        if hist:
+            return (self.detParam["pixNum"],) + self._histFormat(*values)
+        return self._thrFormat(*values)
+
+    @staticmethod
+    def _modeRegs(mode: int, hwIntr: int) -> list[tuple[int, int]]:
+        return [
+            (0x0012, 0x03),  # set mode auto
+            (0x0013, mode),  # detect mode: 1 hist, 0 thr
+            (0x0014, hwIntr),  # set auto acq time (100 us)
+        ]
+
+    @staticmethod
+    def _headFlags(head: int) -> dict[str, bool]:
+        return {
+            "withInfo": (head & (1 << 8)) != 0,
+            "withPos0": (head & (1 << 29)) != 0,
+            "withPos1": (head & (1 << 30)) != 0,
+        }
+
+    def _histFormat(self, winRange: int, head: int) -> tuple[np.dtype, np.dtype]:
+        """由能窗0范围和包头寄存器(0x18)确定能谱模式的(包头包格式, 数据包格式)"""
+        dt = self.histDataType((winRange & 0xFFFF, winRange >> 16))
+        return (dt(**self._headFlags(head)), dt())
+
+    def _thrFormat(self, winNum: int, head: int) -> tuple[int, np.dtype, np.dtype]:
+        """由能窗数寄存器(0x20)和包头寄存器确定阈值模式的(每帧包数, 包头包格式, 数据包格式)"""
         slice = self.detParam["pixNum"] // self.detParam["packagePix"]
-        dt = self.winDataType(winNum, self.detParam["packagePix"])
-        headType = dt(withInfo=infoEn, withPos0=pos0En, withPos1=pos1En)
-        dataType = dt()
-        heads = np.zeros((num, slice), dtype=headType)
-        datas = np.zeros((num, slice), dtype=dataType)
-
-        logging.info(f"阈值模式采样开始, t:{time.time()}")
-        self.DetectRegSet(0x0011, 1)  # start acq
-        for i in range(num):
-            for j in range(slice):
-                (_, id, data) = self._qr.get(timeout=delay)
-                assert (id == 2)
-                if j == 0:
-                    heads[i, j] = np.frombuffer(data, dtype=headType, count=1)
-                else:
-                    datas[i, j] = np.frombuffer(data, dtype=dataType, count=1)
-        logging.info(f"阈值模式采样结束, t:{time.time()}")
+        dt = self.winDataType(winNum + 1, self.detParam["packagePix"])
+        return (slice, dt(**self._headFlags(head)), dt())
+
+    def histAcq(self, num: int, intr: int = 10000, progress=None):
+        return self._acqJoin(self.histStream(num, intr, chunk=256), num, progress)
 
-        tgtFields = set(headType.names)
-        srcFields = set(dataType.names)
-        for field in (srcFields & tgtFields):
-            heads[:, 1:][field] = datas[:, 1:][field]
-        for field in tgtFields - srcFields:
-            heads[:, 1:][field] = np.tile(heads[:, 0][field][:, np.newaxis], (1, slice - 1))
+    def thrStream(self, num: int, intr: int = 10000, chunk: int = 64, defer: bool = False, start=None):
+        """
+        阈值模式流式采集, 每收齐chunk帧产出一个(chunk, pixNum // packagePix)的DetFrames, 格式与thrAcq相同
+        defer与histStream相同
+        """
+        (k, delay, writes, reads) = self._acqMode(False, intr)
+        (per, headType, dataType) = self._acqFormat(False, self._regBurst(writes=writes, reads=reads))
+        yield from self._acqStream("阈值", num, k, per, headType, dataType, delay, chunk, defer, start)
 
-        return heads
+    def thrAcq(self, num: int, intr: int = 10000, progress=None):
+        return self._acqJoin(self.thrStream(num, intr, chunk=256), num, progress)
 
     @classmethod
     def getModelRef(cls) -> dict:
@@ -0,0 +1,363 @@
+import os
+import time
+import asyncio
+import struct
+import logging
+import ipaddress
+import threading
+from collections import deque
+from concurrent.futures import Future
+from queue import Empty
+from core.Det import Det
+from core.Det.DetAsm import DetAsm
+from core.Det.DetData import DetData
+from core.Det.DetFrames import DetFrames
+from core.Det.DetRing import DetRing
+from core.Det.DetTrans import DetTrans, DetReq
+from core.Det.DetRecv import DetRecv
+from core.Det.DetCap import DetCapWriter
+
+
+class DetAioTrans(DetTrans):
+    """
+    DetTrans的asyncio版本, 应答在事件循环中关联, 每个请求等待一个future
+    流水线窗口由信号量限制, 超时重发与DetTrans相同, 只能在事件循环线程中使用
+    """
+
+    def __init__(self, ip: str, send, window: int = 16):
+        super().__init__(ip, None, window)
+        self._send = send
+        self._futs: dict[int, asyncio.Future] = {}
+        self._free = asyncio.Semaphore(window)
+
+    def feed(self, data: memoryview):
+        req = self._match(data)
+        if req is None:
+            return
+        fut = self._futs.pop(req.tag, None)
+        if fut is not None and not fut.done():
+            fut.set_result(req)
+        self._free.release()
+
+    def _put(self, data: bytes):
+        self._send(self._ip, 1, data)
+
+    def _fail(self, req: DetReq, error: str):
+        super()._fail(req, error)
+        self._futs.pop(req.tag, None)
+        self._free.release()
+
+    async def run(self, reqs: list[DetReq], timeout: float = 2) -> list[DetReq]:
+        """发送并等待一组事务完成, 未完成的事务done为False, error为原因"""
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout
+        try:
+            for req in reqs:
+                await asyncio.wait_for(self._free.acquire(), max(0, deadline - time.monotonic()))
+                self._futs[req.tag] = loop.create_future()
+                self._pend.setdefault(req.addr, deque()).append(req)
+                self._busy += 1
+                self._transmit(req, time.monotonic())
+        except TimeoutError:
+            pass
+        while True:
+            now = time.monotonic()
+            due = self._expire(reqs, now, deadline)
+            if due is None:
+                break
+            futs = [self._futs[req.tag] for req in reqs if req.tag in self._futs]
+            await asyncio.wait(futs, timeout=max(0, min(due, deadline) - now))
+        self._report(reqs)
+        return reqs
+
+
+class _SyncTrans():
+    """其他线程中的同步Det经事件循环使用DetAioTrans"""
+
+    def __init__(self, trans: DetAioTrans, loop: asyncio.AbstractEventLoop):
+        self._trans = trans
+        self._loop = loop
+
+    def read(self, addr: int) -> DetReq:
+        return self._trans.read(addr)
+
+    def write(self, addr: int, data: int) -> DetReq:
+        return self._trans.write(addr, data)
+
+    def run(self, reqs: list[DetReq], timeout: float = 2) -> list[DetReq]:
+        return self.collect(reqs, self.submit(reqs, timeout))
+
+    def submit(self, reqs: list[DetReq], timeout: float = 2) -> Future:
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            raise RuntimeError("事件循环线程中不能调用同步接口, 请使用DetAio")
+        return asyncio.run_coroutine_threadsafe(self._trans.run(reqs, timeout), self._loop)
+
+    def collect(self, reqs: list[DetReq], fut: Future) -> list[DetReq]:
+        return fut.result()
+
+
+class DetAio():
+    """
+    单个设备的异步接口, 多个设备和状态轮询共用一个事件循环, 不再每次调用开线程
+    型号参数/数据格式/状态解析/影子寄存器与同步接口共用, det为同一设备的同步Det, 可在其他线程中照常使用
+
+    value = await dev.read(0x80)
+    values = await dev.readMany([0x97, 0x98, 0x99])
+    async for frames in dev.histStream(1000, 10000):
+        ...
+    """
+
+    def __init__(self, det: Det, trans: DetAioTrans, ring: DetRing):
+        self.det = det
+        self._ip = det._ip
+        self._trans = trans
+        self._qr = ring
+        # 接收到数据包时置位
+        self._ready = asyncio.Event()
+
+    async def _regBurst(
+        self, writes: list[tuple[int, int]] = (), reads: list[int] = (),
+        cached: bool = True, errors: dict[int, str] = None
+    ) -> list[int]:
+        (values, wReqs, rReqs) = self.det._burstReqs(writes, reads, cached)
+        await self._trans.run(wReqs + rReqs)
+        return self.det._burstDone(values, wReqs, rReqs, errors)
+
+    async def read(self, addr: int, cached: bool = True) -> int:
+        return (await self._regBurst(reads=[addr], cached=cached))[0]
+
+    async def readMany(self, addrs: list[int], cached: bool = True) -> list[int]:
+        return await self._regBurst(reads=addrs, cached=cached)
+
+    async def write(self, addr: int, data: int) -> dict[int, str]:
+        return await self.writeMany([(addr, data)])
+
+    async def writeMany(self, items: list[tuple[int, int]]) -> dict[int, str]:
+        """流水线写入, 返回失败的地址"""
+        errors = {}
+        await self._regBurst(writes=items, errors=errors)
+        return errors
+
+    async def _regs(self, addrs: list[int], reg: dict[int, int] = None) -> dict[int, int]:
+        reg = {} if reg is None else reg
+        addrs = [addr for addr in addrs if addr not in reg]
+        if addrs:
+            reg.update(zip(addrs, await self.readMany(addrs)))
+        return reg
+
+    async def status(self, lsb: float = None) -> dict[str, dict]:
+        """与Det.status相同, 寄存器读齐后由同步Det解析"""
+        det = self.det
+        reg = await self._regs([0x80, 0x91, 0x92, 0x97, 0x98, 0x99, 0x61, 0x62, 0x40, 0x42, 0x48, 0x4A])
+        reg = await self._regs(det._temperAddr(reg[0x80]) + det._fanAddr(reg[0x92]), reg)
+        return {
+            "temperature": det.statusTemperature(reg),
+            "position": det.statusPosition(lsb, reg),
+            "power": det.statusPower(reg),
+            "powerSwitch": det.statusPowerSwitch(reg),
+            "fanSpeed": det.statusFanSpeed(reg),
+        }
+
+    async def _assemble(self, asm: DetAsm, n: int, timeout: float) -> DetFrames:
+        """与Det._assemble相同, 缓冲区为空时让出事件循环等待数据"""
+        while not asm.ready(n):
+            try:
+                (ids, lens, rows) = self._qr.getView(asm.missing(n), 0)
+            except Empty:
+                self._ready.clear()
+                try:
+                    await asyncio.wait_for(self._ready.wait(), timeout)
+                except TimeoutError:
+                    if asm.missing(n) == n * asm.per:
+                        raise Empty()
+                    logging.warning(f"设备({self._ip})等待数据超时, 缺{asm.missing(n)}个包的帧按丢包处理")
+                    break
+                continue
+            asm.feed(lens, rows)
+        return asm.take(n)
+
+    async def _acqStream(
+        self, name: str, num: int, k: int, per: int, headType, dataType, delay: float, chunk: int
+    ):
+        """与Det._acqStream相同(分段计划/帧号接续由Det提供), 只有寄存器读写和等待数据在事件循环中"""
+        det = self.det
+        asm = det._acqPrepare(name, per, headType, dataType, chunk, k)
+        frame0 = None
+        for (s0, segNum, sizes) in det._acqSegments(name, num, k, chunk):
+            writes = det._segWrites(segNum)
+            if writes:
+                await self._regBurst(writes=writes)
+            await self._regBurst(writes=[(0x0011, 1)])  # start acq
+            # 设备每次启动从0计帧
+            asm.reset(0)
+            for n in sizes:
+                frames = await self._assemble(asm, n, delay)
+                (frames, frame0) = det._acqChunk(asm, frames, s0, k, frame0)
+                yield frames
+        det._acqFinish(name, asm)
+
+    async def _acqRun(self, hist: bool, num: int, intr: int, chunk: int):
+        det = self.det
+        (k, delay, writes, reads) = det._acqMode(hist, intr)
+        (per, headType, dataType) = det._acqFormat(hist, await self._regBurst(writes=writes, reads=reads))
+        async for frames in self._acqStream("能谱" if hist else "阈值", num, k, per, headType, dataType, delay, chunk):
+            yield frames
+
+    def histStream(self, num: int, intr: int = 10000, chunk: int = 64):
+        """能谱模式流式采集, 与Det.histStream相同, 每块为(chunk, pixNum)的DetFrames"""
+        return self._acqRun(True, num, intr, chunk)
+
+    def thrStream(self, num: int, intr: int = 10000, chunk: int = 64):
+        """阈值模式流式采集, 与Det.thrStream相同"""
+        return self._acqRun(False, num, intr, chunk)
+
+    @staticmethod
+    async def _acqJoin(stream, num: int) -> DetFrames:
+        (data, done) = (None, 0)
+        async for chunk in stream:
+            (data, done) = Det._acqPut(data, done, chunk, num)
+        return data
+
+    async def histAcq(self, num: int, intr: int = 10000) -> DetFrames:
+        return await self._acqJoin(self.histStream(num, intr, chunk=256), num)
+
+    async def thrAcq(self, num: int, intr: int = 10000) -> DetFrames:
+        return await self._acqJoin(self.thrStream(num, intr, chunk=256), num)
+
+    def acqStats(self) -> dict[str, int]:
+        return self.det.acqStats()
+
+
+class DetAioData(DetData):
+    """
+    基于asyncio的DetData, 套接字由事件循环监视, 收发全部设备的包都在事件循环线程中, 没有接收/发送线程
+    可读时以DetRecv一次收完内核缓冲区中的包(DatagramProtocol每次唤醒只收一个包, 高包率下跟不上)
+    数据包仍收进每个设备的DetRing, 统计(stats/throughput)与DetData相同, 链路监视线程在open时启动
+    事件循环中使用DetAio的协程接口, 其他线程中使用DetAio.det(同步Det), 二者可同时使用
+
+    srv = await DetAioData("10.20.22.1").open()
+    devs = await srv.findDet()
+
+    不在事件循环中时, start()在后台线程中运行事件循环:
+    srv = DetAioData.start("10.20.22.1")
+    devs = srv.call(srv.findDet())
+    devs[ip].det.status()
+    """
+
+    def __init__(self, ip, port=7494, batch=64):
+        super().__init__(ip, port, batch)
+        self._devs: dict[str, DetAio] = {}
+        self._loop = None
+        # 查找设备期间的应答
+        self._found: asyncio.Queue | None = None
+        self._recv = DetRecv(
+            self._s, self._detR, self._onCtrl, batch, self._main.counters, self._onUnknown, self._onBeat
+        )
+
+    async def open(self) -> 'DetAioData':
+        self._loop = asyncio.get_running_loop()
+        self._s.setblocking(False)
+        self._loop.add_reader(self._s, self._readReady)
+        self._listenFlag[0] = True
+        threading.Thread(target=self._loopL, args=(self._listenFlag,), name="DetLink", daemon=True).start()
+        return self
+
+    @classmethod
+    def start(cls, ip, port=7494) -> 'DetAioData':
+        """在新的后台线程中运行事件循环并打开"""
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, name="DetAio", daemon=True).start()
+        srv = cls(ip, port)
+        return asyncio.run_coroutine_threadsafe(srv.open(), loop).result()
+
+    def call(self, coro):
+        """在其他线程中执行协程并等待结果"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def listen(self):
+        raise RuntimeError("DetAioData请使用open()或start()")
+
+    def close(self):
+        self._listenFlag[0] = False
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.remove_reader, self._s)
+        self.capture(None)
+        return self
+
+    def capture(self, path: str | None) -> list[str]:
+        """与DetData.capture相同, 抓包文件在事件循环中切换"""
+        writer = None if path is None else DetCapWriter(os.path.abspath(path))
+        if writer is not None:
+            # 接收者取到writer之前写入, 不会与收包交错
+            for (ip, port, data) in self._capState(list(self._device)):
+                writer.write(ip, port, data)
+        self._recv.capture(writer)
+        if self._loop is None:
+            self._recv.applyCapture()
+        else:
+            self._loop.call_soon_threadsafe(self._recv.applyCapture)
+        return [] if writer is None else [writer.path]
+
+    def _readReady(self):
+        # 每次最多收若干批, 避免高包率时其他协程得不到运行
+        if self._recv.drain(self._batch * 16):
+            for dev in self._devs.values():
+                dev._ready.set()
+
+    def _probeTrans(self, ip: str):
+        # 监视线程不在事件循环中, 经同步接口探测
+        return self._devs[ip].det._trans
+
+    def _onUnknown(self, ip: str, data: bytes):
+        if self._found is not None:
+            self._found.put_nowait((ip, data))
+
+    def _sendTo(self, ip: str, id: int, data: bytes):
+        self._s.sendto(b"VPDT" + struct.pack("<L", id) + data, (ip, 7493))
+
+    async def findDet(self, expect=None, quiet: float = 2.0, timeout: float = 10, hint=()) -> dict[str, DetAio]:
+        """与DetData.findDet相同: 先单播查询hint再广播, 找齐expect或连续quiet秒没有新的设备或超过timeout结束"""
+        loop = asyncio.get_running_loop()
+        logging.info("开始查找内网设备")
+        start = loop.time()
+        self._found = asyncio.Queue()
+        self._findSend(hint)
+        parts = {}
+        found = {}
+        (end, last) = (start + timeout, start)
+        try:
+            while not self._findDone(expect, found):
+                wait = min(end, last + quiet) - loop.time()
+                if wait <= 0:
+                    break
+                try:
+                    (ip, recv) = await asyncio.wait_for(self._found.get(), wait)
+                except TimeoutError:
+                    break
+                m = self._findReply(recv, parts.setdefault(ip, {}))
+                if m is not None and ip not in found:
+                    last = loop.time()
+                    found[ip] = self.addDet(ip, m)
+        finally:
+            self._found = None
+        logging.info(f"结束查找内网设备, 共找到设备{len(found)}个, 用时{loop.time() - start:.3f}s")
+        self._device.update({ip: dev.det for (ip, dev) in found.items()})
+        return found
+
+    def addDet(self, ip: str, model: str = None) -> DetAio:
+        """添加设备, 需在open()之后于事件循环线程中调用"""
+        ipaddress.ip_address(ip)
+        trans = DetAioTrans(ip, self._sendTo)
+        ring = DetRing()
+        det = Det(ip).getInstance(model)
+        with self._detRLock:
+            self._detC[ip] = trans
+            self._detR[ip] = ring
+        det.addQueue((_SyncTrans(trans, self._loop), ring, self._newLink(ip)))
+        dev = DetAio(det, trans, ring)
+        self._devs[ip] = dev
+        return dev
@@ -0,0 +1,219 @@
+import logging
+import numpy as np
+from core.Det.DetFrames import DetFrames
+from core.Det.DetStat import DetStat
+
+
+class DetAsm():
+    """
+    组帧器, 每个包按包内的(frame, idx)直接放到所在帧的对应位置, 与到达顺序无关
+    带包头的包按长度识别, 其包头字段写入所在帧的head
+    内部为cap帧的帧环, 帧号相对base计算: reset(start)时base为设备启动后计数的起点start,
+    段内第一帧即start, 开头整帧丢失时该帧为无效帧, 不会移动起点;
+    start为None时base为收到的第一个包的帧号, 段内第一帧在产出第一块前按最小帧号确定:
+    已产出的帧的包为迟到包, 重复的包丢弃并计数
+    设备已越过某帧horizon帧后该帧即可产出, 缺的包在valid中标为False, 数据置0
+    连续收到远离帧环的包时认为帧号跳变, 以新帧号接续当前位置重新同步
+    序号跳跃/乱序/dLen不符/迟到/重复/缺失同时累加到设备的DetStat
+    """
+
+    def __init__(
+        self, ip: str, headType: np.dtype, dataType: np.dtype, per: int, cap: int,
+        horizon: int = 16, stat: DetStat = None
+    ):
+        self._ip = ip
+        self._stat = DetStat() if stat is None else stat
+        # dLen为包内数据的uint16个数
+        self._dLen = int(np.prod(dataType["data"].shape))
+        self._dLenWarned = False
+        self._headType = headType
+        self._dataType = dataType
+        self.per = per
+        self._horizon = horizon
+        self._cap = cap + horizon
+        self._headFields = [f for f in headType.names if f not in DetFrames.PIX and f != "data"]
+        # 包头与数据包等长时(未开启任何包头字段)不区分包头
+        self._headLen = 8 + headType.itemsize if headType.itemsize > dataType.itemsize else 0
+        self.width = 8 + max(headType.itemsize, dataType.itemsize)
+        # 多出的最后一帧接收丢弃的包, 整批散射前不必先筛选
+        proto = DetFrames.fromPackets(np.zeros(1, headType), np.zeros((1, per), dataType))
+        self._ring = proto.alloc(self._cap + 1)
+        self._seen = np.zeros((self._cap, per), dtype=bool)
+        self._hasHead = np.zeros(self._cap + 1, dtype=bool)
+        self._stats = dict.fromkeys(("frames", "lostFrames", "lostPackets", "late", "dup", "stray", "resync"), 0)
+        self.reset()
+
+    def reset(self, start: int = None):
+        """开始新的一段, start为设备启动后的第一帧帧号, None时以下一个包为基准"""
+        self.base = start
+        self._base0 = start
+        self.first = start
+        self._lo = 0
+        self._hi = -1
+        self._stray = 0
+        self._seq = None
+        self._seen[:] = False
+        self._hasHead[:] = False
+
+    def stats(self) -> dict[str, int]:
+        """
+        frames: 已产出帧数, lostFrames: 其中不完整的帧数, lostPackets: 缺的包数
+        late: 迟到丢弃的包数, dup: 重复的包数, stray: 帧号不可信而丢弃的包数, resync: 重新同步次数
+        """
+        return dict(self._stats)
+
+    def _rel(self, frame: np.ndarray) -> np.ndarray:
+        # 帧号按uint32回绕计算与base的距离
+        return (frame - np.uint32(self.base)).astype(np.int32).astype(np.int64)
+
+    def feed(self, lens: np.ndarray, rows: np.ndarray):
+        """放置一批包, rows为(n, size)的原始包(含8字节VPDT包头), lens为每个包的长度"""
+        dsz = self._dataType.itemsize
+        short = lens < 8 + dsz
+        if short.any():
+            # 长度不足的包(被截断或格式不符)不解析
+            self._stat.malformed += int(short.sum())
+            return self._feedSome(lens, rows, ~short)
+        datas = rows[:, 8:8 + dsz].view(self._dataType)[:, 0]
+        (frame, idx, dLen) = (datas["frame"], datas["idx"], datas["dLen"])
+        if self._headLen:
+            isHead = lens >= self._headLen
+            heads = rows[:, 8:self._headLen].view(self._headType)[:, 0]
+            frame = np.where(isHead, heads["frame"], frame)
+            idx = np.where(isHead, heads["idx"], idx)
+            dLen = np.where(isHead, heads["dLen"], dLen)
+        else:
+            isHead = np.ones(lens.shape[0], dtype=bool)
+        bad = dLen != self._dLen
+        if bad.any():
+            # dLen与当前数据格式不符, 按该格式解析会错位
+            self._stat.dLenErr += int(bad.sum())
+            if not self._dLenWarned:
+                self._dLenWarned = True
+                logging.warning(f"设备({self._ip})数据包dLen为{int(dLen[bad][0])}, 当前数据格式为{self._dLen}, 已丢弃")
+            return self._feedSome(lens, rows, ~bad)
+        if self.base is None:
+            self.base = self._base0 = int(frame[0])
+        rel = self._rel(frame)
+        idx = idx.astype(np.int64)
+        if self.first is None:
+            # 尚未产出时, 乱序先到的后续帧不决定段内第一帧
+            near = rel[(rel > self._lo - self._cap) & (rel < self._lo + self._cap)]
+            if near.size:
+                hi = max(self._hi, int(near.max()))
+                near = near[near > hi - self._cap]
+                # 产出前已收到超过帧环的帧时可能没有可用的起点, 保持当前起点
+                if near.size:
+                    self._lo = min(self._lo, int(near.min()))
+
+        stray = (rel >= self._lo + self._cap) | (rel < self._lo - self._cap)
+        if stray.all():
+            self._stray += stray.size
+            if self._stray >= 2 * self.per:
+                # 帧号跳变(设备重新计帧等), 新帧号接续已收到的最后一帧
+                shift = int(rel.min()) - max(self._hi + 1, self._lo)
+                logging.warning(f"设备({self._ip})帧号由{(self.base + self._hi) & 0xFFFFFFFF}"
+                                f"跳变到{(self.base + int(rel.min())) & 0xFFFFFFFF}, 重新同步")
+                self._stats["resync"] += 1
+                self._stray = 0
+                self.base = (self.base + shift) & 0xFFFFFFFF
+                self._seq = None
+                rel = self._rel(frame)
+                stray = (rel >= self._lo + self._cap) | (rel < self._lo - self._cap)
+        else:
+            self._stray = 0
+        late = ~stray & (rel < self._lo)
+        keep = ~stray & ~late & (idx < self.per)
+        self._stats["stray"] += int(stray.sum()) + int((~stray & ~late & ~keep).sum())
+        self._stats["late"] += int(late.sum())
+        self._stat.late += int(late.sum())
+        self._count(rel[~stray] * self.per + idx[~stray])
+        if not keep.any():
+            return
+        self._hi = max(self._hi, int(rel[keep].max()))
+
+        slot = np.where(keep, rel % self._cap, self._cap)
+        idx = np.where(keep, idx, 0)
+        seen = self._seen.reshape(-1)
+        lin = slot[keep] * self.per + idx[keep]
+        fresh = ~seen[lin]
+        keep[keep] = fresh
+        # 同一批内重复的包写入相同的内容, 只影响计数
+        before = np.count_nonzero(seen)
+        seen[lin[fresh]] = True
+        dup = lin.size - int(np.count_nonzero(seen) - before)
+        self._stats["dup"] += dup
+        self._stat.dup += dup
+
+        ring = self._ring
+        slot[~keep] = self._cap
+        hsel = np.flatnonzero(keep & isHead)
+        self._hasHead[slot[hsel]] = True
+        if self._headLen:
+            dslot = slot.copy()
+            dslot[hsel] = self._cap
+        else:
+            dslot = slot
+        for f in DetFrames.PIX:
+            ring.pix[f][dslot, idx] = datas[f]
+        ring.data[dslot, idx] = datas["data"]
+        if self._headLen and hsel.size:
+            heads = heads[hsel]
+            (hslot, hidx) = (slot[hsel], idx[hsel])
+            for f in DetFrames.PIX:
+                ring.pix[f][hslot, hidx] = heads[f]
+            ring.data[hslot, hidx] = heads["data"]
+            for f in self._headFields:
+                ring.head[f][hslot] = heads[f]
+
+    def _feedSome(self, lens: np.ndarray, rows: np.ndarray, ok: np.ndarray):
+        if ok.any():
+            self.feed(lens[ok], rows[ok])
+
+    def _count(self, seq: np.ndarray):
+        # 按到达顺序比较包序号(帧*per+idx)与之前的最大序号
+        stat = self._stat
+        if not seq.size:
+            return
+        last = seq[0] - 1 if self._seq is None else self._seq
+        prev = np.maximum.accumulate(np.concatenate(([last], seq[:-1])))
+        stat.reorders += int((seq < prev).sum())
+        stat.gaps += int((seq > prev + 1).sum())
+        self._seq = max(last, int(seq.max()))
+
+    def _slots(self, n: int) -> np.ndarray:
+        return np.arange(self._lo, self._lo + n) % self._cap
+
+    def missing(self, n: int) -> int:
+        """接下来n帧还缺的包数"""
+        return n * self.per - int(np.count_nonzero(self._seen[self._slots(n)]))
+
+    def ready(self, n: int) -> bool:
+        """接下来n帧已收齐, 或设备已越过最后一帧horizon帧(其余视为丢失)"""
+        return self._hi >= self._lo + n - 1 + self._horizon or self.missing(n) == 0
+
+    def take(self, n: int) -> DetFrames:
+        """取出接下来的n帧, 缺的包valid为False; head["frame"]为设备帧号, first为段内第一帧的设备帧号"""
+        slots = self._slots(n)
+        ring = self._ring
+        valid = self._seen[slots]
+        out = DetFrames(ring.head[slots], ring.data[slots], ring.pix[slots], valid)
+        lost = ~valid
+        if lost.any():
+            out.data[lost] = 0
+            out.pix[lost] = 0
+            out.pix["idx"][lost] = np.nonzero(lost)[1]
+            out.head[~self._hasHead[slots]] = 0
+            self._stats["lostFrames"] += int(lost.any(axis=1).sum())
+            self._stats["lostPackets"] += int(lost.sum())
+            self._stat.lost += int(lost.sum())
+        # 重新同步后帧号仍接续之前产出的帧
+        out.head["frame"] = (self._base0 + np.arange(self._lo, self._lo + n)) & 0xFFFFFFFF
+        if self.first is None:
+            self.first = (self._base0 + self._lo) & 0xFFFFFFFF
+        self._seen[slots] = False
+        self._hasHead[slots] = False
+        self._hi = max(self._hi, self._lo + n - 1)
+        self._lo += n
+        self._stats["frames"] += n
+        return out
@@ -0,0 +1,75 @@
+import os
+import mmap
+import time
+import heapq
+import socket
+import struct
+import logging
+
+# 抓包文件: 文件头魔数(含版本), 之后每个数据报一条记录: 接收时间(time.time), 源ip, 源端口, 长度, 数据报原文
+CAP_MAGIC = b"VPCAP\x00\x01\x00"
+_REC = struct.Struct("<d4sHL")
+
+
+class DetCapWriter():
+    """
+    追加写入抓包文件, 由接收线程/进程调用, 写入经大缓冲区合并, 每个包只有两次内存拷贝
+    已有的文件须是抓包文件, 接着追加
+    """
+
+    def __init__(self, path: str, bufSize: int = 4 * 1024 * 1024):
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as f:
+                if f.read(len(CAP_MAGIC)) != CAP_MAGIC:
+                    raise ValueError(f"{path}不是抓包文件")
+        self.path = path
+        self._f = open(path, "ab", buffering=bufSize)
+        if self._f.tell() == 0:
+            self._f.write(CAP_MAGIC)
+        self._ips: dict[str, bytes] = {}
+        self.packets = 0
+
+    def write(self, ip: str, port: int, data: memoryview):
+        addr = self._ips.get(ip)
+        if addr is None:
+            addr = self._ips[ip] = socket.inet_aton(ip)
+        self._f.write(_REC.pack(time.time(), addr, port, len(data)))
+        self._f.write(data)
+        self.packets += 1
+
+    def close(self):
+        self._f.close()
+        logging.info(f"抓包结束, {self.path}共写入{self.packets}个包")
+
+
+def writeCap(path: str, recs: list[tuple[str, int, bytes]]):
+    """不经接收线程/进程直接追加几条记录(ip, 端口, 数据报), 须在该文件交给接收者之前调用"""
+    w = DetCapWriter(path)
+    for (ip, port, data) in recs:
+        w.write(ip, port, data)
+    w._f.close()
+
+
+def readCap(path: str):
+    """逐条读出抓包文件中的(时间, 源ip, 源端口, 数据报), 末尾写了一半的记录(异常退出)被忽略"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size <= len(CAP_MAGIC):
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            if m[:len(CAP_MAGIC)] != CAP_MAGIC:
+                raise ValueError(f"{path}不是抓包文件")
+            pos = len(CAP_MAGIC)
+            end = len(m)
+            while pos + _REC.size <= end:
+                (t, addr, port, n) = _REC.unpack_from(m, pos)
+                pos += _REC.size
+                if pos + n > end:
+                    logging.warning(f"{path}末尾的记录不完整, 已忽略")
+                    break
+                yield (t, socket.inet_ntoa(addr), port, m[pos:pos + n])
+                pos += n
+
+
+def readCaps(paths: list[str]):
+    """多个抓包文件(各分片的文件)按时间合并读出"""
+    return heapq.merge(*(readCap(p) for p in paths), key=lambda rec: rec[0])
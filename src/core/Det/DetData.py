@@ -1,78 +1,266 @@
 from queue import Queue, Empty
 from threading import Thread, Lock
+import os
 import socket
 import struct
 import logging
 import ipaddress
 import time
 from core.Det import Det
+from core.Det.DetRing import DetRing
+from core.Det.DetTrans import DetTrans
+from core.Det.DetRecv import MAX_DATAGRAM, RX_PKTS, RX_BYTES, RX_BATCH, RX_FOREIGN
+from core.Det.DetShard import DetShard
+from core.Det.DetLink import DetLink
+from core.Det.DetCap import writeCap
+
+# 查找设备: 广播读取地址0和1(型号)
+_FIND = [b"VPDT" + struct.pack("<LHH", 1, 0, addr) for addr in (0, 1)]
 
 
 class DetData():
+    """
+    process=True时在独立的接收进程中收包, 数据写入共享内存环, 本进程的GIL占用(绘图/保存/分析)不影响收包
+    控制包由接收进程经管道转回本进程, 发送仍在本进程
+    shard=True时每个设备一个接收分片: 以SO_REUSEPORT在同一端口上另开一个连接(connect)到该设备的套接字,
+    内核按源地址把该设备的包只投递到这个套接字, 由它自己的接收线程/进程收包, 各设备的数据流可在不同的核上接收
+    多网卡时每个网卡的地址各建一个DetData
+    listen后由监视线程检测各设备的在线状态(心跳包/应答/数据包超时), 每probeEvery秒读一次寄存器测量往返时延,
+    状态变化时调用onLinkChange注册的回调
+    """
+
+    def __init__(self, ip, port=7494, batch=64, process=False, shard=False):
+        self._initState(ip, batch, process, shard)
+        s = self._socket()
+        s.bind((ip, port))
+        # 用于广播包发现
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        # 内核可能按上限(net.core.rmem_max)截断, 以实际值为准
+        self._rcvBuf = s.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        if self._rcvBuf < 64 * 1024 * 1024:
+            logging.warning(f"接收缓冲区实际为{self._rcvBuf / 1024 / 1024:.1f}MB, 高速采集时可能丢包")
+        s.settimeout(2)
+        self._s = s
+        # 主套接字的分片接收未分片的设备和查找应答, 分片的设备各有一个
+        self._main = DetShard(s, self._onCtrl, batch, process, onBeat=self._onBeat)
+        self._shards: list[DetShard] = [self._main]
 
-    def __init__(self, ip, port=7494):
+    def _initState(self, ip, batch: int, process: bool, shard: bool):
+        """套接字和接收分片以外的状态, 回放(DetReplay)等其他包源共用"""
         self._ip = ip
-        self._detR: dict[str, Queue] = {}
+        # 每个设备的控制通道(id 1)和数据通道(id 2)分开, 寄存器读写不会触碰数据流
+        self._detC: dict[str, DetTrans] = {}
+        self._detR: dict[str, DetRing] = {}
         self._detT: Queue = Queue()
         self._detRLock = Lock()
         self._device = {}
         self._listenFlag = [False]
+        # 单次唤醒最多连续接收的包数, 满一批才通知消费者
+        self._batch = batch
+        self._process = process
+        if shard and not hasattr(socket, "SO_REUSEPORT"):
+            logging.warning("系统不支持SO_REUSEPORT, 所有设备共用一个接收分片")
+            shard = False
+        self._shard = shard
+        self._rxMark = (time.perf_counter(), 0, 0, 0)
+        # 抓包时各分片的文件名
+        self._capPath = None
+        # 链路监视: 每个设备的DetLink, 状态变化回调, 往返时延探测周期(s, 0不探测)
+        self._links: dict[str, DetLink] = {}
+        self._linkCbs = []
+        self.probeEvery = 5.0
+        self._rcvBuf = 0
 
+    def _socket(self) -> socket.socket:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.bind((ip, port))
-        # 用于广播包发现
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        if self._shard:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         # 防止能谱模式丢数据
         s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1536 * 1024 * 1024)
-        s.settimeout(2)
-        self._s = s
+        return s
+
+    def _shardFor(self, ip: str) -> DetShard:
+        """设备专用的接收分片: 同一端口上连接到设备的套接字, 内核优先把完全匹配的包投递给它"""
+        s = self._socket()
+        s.bind(self._s.getsockname())
+        s.connect((ip, 7493))
+        shard = DetShard(s, self._onCtrl, self._batch, self._process, ip, self._onBeat)
+        self._shards.append(shard)
+        if self._capPath is not None:
+            shard.capture(self._capPath(shard))
+        if self._listenFlag[0]:
+            shard.start()
+        return shard
 
     def listen(self):
         if not self._listenFlag[0]:
+            for shard in self._shards:
+                shard.start()
             self._listenFlag[0] = True
-            self._listenerR = Thread(
-                target=self._loopR,
-                args=(self._listenFlag,)
-            )
             self._listenerT = Thread(
                 target=self._loopT,
                 args=(self._listenFlag,)
             )
-            self._listenerR.start()
             self._listenerT.start()
+            Thread(target=self._loopL, args=(self._listenFlag,), name="DetLink", daemon=True).start()
         return self
 
     def close(self):
+        """停止接收并关闭套接字(含设备分片的), 之后可在同一端口上重新建立DetData"""
         self._listenFlag[0] = False
+        for shard in self._shards:
+            shard.stop()
+        for shard in self._shards:
+            shard.close()
+        self._s.close()
         return self
 
-    def _loopR(self, flag: list[bool]):
+    def capture(self, path: str | None) -> list[str]:
+        """
+        把收到的每个数据报(数据/控制/心跳包和查找应答)原样追加写入抓包文件, path为None时停止, 返回写入的文件
+        由接收线程/进程写入; 设备分片各写一个文件(文件名后加设备ip), 回放时一起读入
+        开始时先写入已找到的设备的型号(查找应答)和影子寄存器(读取应答), 查找/配置之后才开始的抓包也能回放
+        """
+        if path is None:
+            self._capPath = None
+        else:
+            (stem, ext) = os.path.splitext(os.path.abspath(path))
+            self._capPath = lambda shard: stem + ext if shard.ip is None else f"{stem}-{shard.ip}{ext}"
+        shardIps = {shard.ip for shard in self._shards}
+        paths = []
+        for shard in self._shards:
+            p = None if self._capPath is None else self._capPath(shard)
+            if p is not None:
+                ips = [ip for ip in self._device if (ip if ip in shardIps else None) == shard.ip]
+                writeCap(p, self._capState(ips))
+            shard.capture(p)
+            if p is not None:
+                paths.append(p)
+        return paths
+
+    def _onCtrl(self, ip: str, data):
+        self._detC[ip].feed(data)
+        link = self._links.get(ip)
+        if link is not None:
+            link.seen(time.monotonic())
+
+    def _onBeat(self, ip: str, t: float):
+        link = self._links.get(ip)
+        if link is not None:
+            link.beat(t)
+
+    def link(self, ip: str) -> DetLink:
+        """设备的链路状态"""
+        return self._links[ip]
+
+    def onLinkChange(self, callback):
+        """注册设备在线状态变化的回调callback(ip, online), 在监视线程中调用"""
+        self._linkCbs.append(callback)
+        return self
+
+    def _linkChanged(self, ip: str, online: bool):
+        for callback in list(self._linkCbs):
+            callback(ip, online)
+
+    def _probeTrans(self, ip: str):
+        return self._detC[ip]
+
+    def probeLinks(self):
+        """依次读取每个设备的寄存器0测量往返时延"""
+        for (ip, link) in list(self._links.items()):
+            link.probe(self._probeTrans(ip))
+
+    def checkLinks(self) -> dict[str, bool | None]:
+        """按心跳/应答/收包情况更新每个设备的在线状态, 返回{ip: online}"""
+        now = time.monotonic()
+        with self._detRLock:
+            rings = dict(self._detR)
+        state = {}
+        for (ip, link) in list(self._links.items()):
+            ring = rings.get(ip)
+            state[ip] = link.check(now, None if ring is None else ring.stat.packets)
+        return state
+
+    def _loopL(self, flag: list[bool]):
+        lastProbe = 0.0
         while flag[0]:
-            try:
-                (recv, (ip, port)) = self._s.recvfrom(500)
-                if port != 7493 or len(recv) < 8:
-                    continue
-                ((hd, id), data) = (struct.unpack("<4sL", recv[:8]), recv[8:])
-                if hd != b"VPDT":
-                    continue
-                if not ip in self._detR:
-                    # new device
-                    continue
-                with self._detRLock:
-                    match id:
-                        case 1:
-                            # logging.debug(f"接收到控制包, ip:{ip}")
-                            self._detR[ip].put_nowait((ip, id, data))
-                        case 2:
-                            # logging.debug(f"接收到数据包", {ip})
-                            self._detR[ip].put_nowait((ip, id, data))
-                        case 3:
-                            logging.debug(f"接收到心跳包/校正包, ip:{ip}")
-                            # TODO 实现心跳包超时的检测(在线检测)
-                        case _:
-                            logging.warning("接收到无效数据包")
-            except socket.timeout as e:
-                pass
+            if self.probeEvery and time.monotonic() - lastProbe >= self.probeEvery:
+                lastProbe = time.monotonic()
+                self.probeLinks()
+            self.checkLinks()
+            time.sleep(0.2)
+
+    def _rx(self, i: int) -> int:
+        return sum(shard.counters[i] for shard in self._shards)
+
+    def throughput(self) -> dict[str, float]:
+        """自上次调用以来的接收速率"""
+        now = time.perf_counter()
+        (t, pkts, nbytes, batch) = self._rxMark
+        (rxPkts, rxBytes, rxBatch) = (self._rx(RX_PKTS), self._rx(RX_BYTES), self._rx(RX_BATCH))
+        self._rxMark = (now, rxPkts, rxBytes, rxBatch)
+        dt = max(now - t, 1e-9)
+        dBatch = rxBatch - batch
+        return {
+            "pps": (rxPkts - pkts) / dt,
+            "bps": (rxBytes - nbytes) * 8 / dt,
+            "batchSize": (rxPkts - pkts) / dBatch if dBatch else 0.0,
+            "packets": rxPkts,
+            "overrun": sum(ring.overrun() for ring in self._detR.values()),
+        }
+
+    def _kernelStat(self) -> tuple[int, int] | None:
+        """
+        从/proc/net/udp读取本端口各套接字(含分片的套接字)合计的(接收队列字节数, 内核丢包数), 非Linux返回None
+        """
+        try:
+            (ip, port) = self._s.getsockname()
+        except OSError:
+            # 已关闭
+            return None
+        local = f"{struct.unpack('<I', socket.inet_aton(ip))[0]:08X}:{port:04X}"
+        (queue, drops, found) = (0, 0, False)
+        try:
+            with open("/proc/net/udp") as f:
+                for line in f:
+                    cols = line.split()
+                    if len(cols) > 12 and cols[1] == local:
+                        queue += int(cols[4].split(":")[1], 16)
+                        drops += int(cols[-1])
+                        found = True
+        except OSError:
+            pass
+        return (queue, drops) if found else None
+
+    def stats(self) -> dict[str, dict]:
+        """
+        接收统计, 可在采集过程中随时调用
+        device: 每个设备的DetStat计数及速率, 环形缓冲区的积压(queue)/最大积压(highWater)/溢出(overrun)
+        socket: 实际接收缓冲区(rcvBuf), 内核接收队列(kernelQueue)和内核丢包(kernelDrops, 非Linux为None),
+                非设备端口或未添加设备的包数(foreign)
+        link: 每个设备的在线状态, 心跳间隔/抖动和往返时延, 见DetLink.stats
+        reg: 每个设备的寄存器事务数/重发/失败和延迟分位数, 见DetTrans.stats
+        """
+        with self._detRLock:
+            rings = dict(self._detR)
+            trans = dict(self._detC)
+        device = {}
+        for (ip, ring) in rings.items():
+            d = ring.stat.snapshot()
+            d.update(queue=ring.qsize(), highWater=ring.highWater(), overrun=ring.overrun())
+            device[ip] = d
+        (kernelQueue, kernelDrops) = self._kernelStat() or (None, None)
+        return {
+            "device": device,
+            "socket": {
+                "rcvBuf": self._rcvBuf,
+                "kernelQueue": kernelQueue,
+                "kernelDrops": kernelDrops,
+                "foreign": self._rx(RX_FOREIGN),
+            },
+            "link": {ip: link.stats() for (ip, link) in list(self._links.items())},
+            "reg": {ip: t.stats() for (ip, t) in trans.items()},
+        }
 
     def _loopT(self, flag: list[bool]):
         while flag[0]:
@@ -82,47 +270,115 @@ class DetData():
                 self._s.sendto(ds, (ip, 7493))
             except Empty:
                 pass
+            except OSError as e:
+                # close之后套接字已关闭
+                if flag[0]:
+                    logging.warning(f"向设备({ip})发送失败: {e}")
 
     def device(self) -> dict:
         return self._device.copy()
 
-    def findDet(self) -> dict[str, Det]:
-        dH = b"VPDT" + struct.pack("<L", 1)
-        dD0 = struct.pack("<HH", 0, 0)  # read addr 0
-        dD1 = struct.pack("<HH", 0, 1)  # read addr 1
+    def _findSend(self, hint) -> list[str]:
+        """先向hint中的地址单播查找, 再广播, 返回去重后的hint"""
+        hint = list(dict.fromkeys(hint or ()))
+        for dst in [(ip, 7493) for ip in hint] + [("255.255.255.255", 7493)]:
+            for query in _FIND:
+                try:
+                    self._s.sendto(query, dst)
+                except OSError as e:
+                    logging.warning(f"查找设备{dst[0]}发送失败: {e}")
+        return hint
+
+    @staticmethod
+    def _findDone(expect, found: dict) -> bool:
+        """expect为设备数或ip列表, 已全部找到时返回True"""
+        if expect is None:
+            return False
+        if isinstance(expect, int):
+            return len(found) >= expect
+        return all(ip in found for ip in expect)
 
+    def findDet(self, expect=None, quiet: float = 2.0, timeout: float = 10, hint=()) -> dict[str, Det]:
+        """
+        查找设备, 需在listen之前调用: 先向hint中的地址(上次连接的设备)单播查询, 再广播
+        expect为设备数或ip列表时找齐即返回, 否则连续quiet秒没有找到新的设备或超过timeout结束
+        重新连接已知设备时 findDet(expect=ips, hint=ips) 在收到应答后立即返回
+        listen之后接收线程/进程已在读取同一个套接字, 不能再查找
+        """
+        if self._listenFlag[0]:
+            raise RuntimeError("listen之后不能查找设备, 请在listen之前调用findDet")
         logging.info("开始查找内网设备")
-        self._s.sendto(dH + dD0, ("255.255.255.255", 7493))
-        self._s.sendto(dH + dD1, ("255.255.255.255", 7493))
-        model = {}
+        start = time.monotonic()
+        prevTimeout = self._s.gettimeout()
+        self._findSend(hint)
+        parts = {}
         dataBuf = {}
-        timeout_value = time.time() + 10
+        (end, last) = (start + timeout, start)
         try:
-            while timeout_value >= time.time():
-                (recv, (ip, port)) = self._s.recvfrom(1500)
-                if port != 7493 or len(recv) != 16:
-                    continue
-                (head, id) = struct.unpack("<4sL", recv[:8])
-                (ctr, addr, data) = struct.unpack("<HH4s", recv[8:])
-                if head != b"VPDT" or id != 1 or ctr != 0 or addr > 2:
+            while not self._findDone(expect, dataBuf):
+                wait = min(end, last + quiet) - time.monotonic()
+                if wait <= 0:
+                    break
+                self._s.settimeout(wait)
+                (recv, (ip, port)) = self._s.recvfrom(MAX_DATAGRAM)
+                if port != 7493 or ip in dataBuf:
                     continue
-                if addr == 0:
-                    model[ip] = data
-                else:
-                    m = (model[ip] + data).strip(b'\xff').decode('ascii').rstrip('\x00')
-                    if ip not in dataBuf:
-                        dataBuf[ip] = Det(ip).getInstance(m)
-                        dataBuf[ip].addQueue(self.addDet(ip))
-        except socket.timeout as e:
+                m = self._findReply(recv, parts.setdefault(ip, {}))
+                if m is not None:
+                    last = time.monotonic()
+                    dataBuf[ip] = Det(ip).getInstance(m)
+                    dataBuf[ip].addQueue(self.addDet(ip))
+        except socket.timeout:
             pass
-        logging.info(f"结束查找内网设备, 共找到设备{len(dataBuf)}个")
+        finally:
+            self._s.settimeout(prevTimeout)
+        logging.info(f"结束查找内网设备, 共找到设备{len(dataBuf)}个, 用时{time.monotonic() - start:.3f}s")
         self._device.update(dataBuf)
         return dataBuf
 
-    def addDet(self, ip: str) -> tuple[Queue, Queue]:
+    @staticmethod
+    def _findReply(recv: bytes, parts: dict[int, bytes]) -> str | None:
+        """查找应答(读取地址0/1)记入parts, 型号的两部分都收到后返回型号"""
+        if len(recv) != 16:
+            return None
+        (head, id, ctr, addr, data) = struct.unpack("<4sLHH4s", recv)
+        if head != b"VPDT" or id != 1 or ctr != 0 or addr > 1:
+            return None
+        parts[addr] = data
+        if len(parts) < 2:
+            return None
+        return (parts[0] + parts[1]).strip(b'\xff').decode('ascii').rstrip('\x00')
+
+    @staticmethod
+    def _findReplies(model: str) -> list[bytes]:
+        """型号对应的两个查找应答(_findReply的逆)"""
+        name = model.encode("ascii")[:8].ljust(8, b"\x00")
+        return [b"VPDT" + struct.pack("<LHH", 1, 0, addr) + name[4 * addr:4 * addr + 4] for addr in (0, 1)]
+
+    def _capState(self, ips: list[str]) -> list[tuple[str, int, bytes]]:
+        """抓包开始时写入的设备状态: 型号和影子寄存器, 格式与设备的读取应答相同"""
+        recs = []
+        for ip in ips:
+            det = self._device[ip]
+            model = getattr(det, "model", None)
+            if model:
+                recs += [(ip, 7493, data) for data in self._findReplies(model)]
+            for (addr, value) in det.shadow.items().items():
+                recs.append((ip, 7493, b"VPDT" + struct.pack("<LHHL", 1, 0, addr, value)))
+        return recs
+
+    def _newLink(self, ip: str) -> DetLink:
+        link = DetLink(ip, self._linkChanged, interval=self.probeEvery or 5.0, rtt=self._detC[ip].rtt)
+        self._links[ip] = link
+        return link
+
+    def addDet(self, ip: str) -> tuple[DetTrans, DetRing, DetLink]:
         ipaddress.ip_address(ip)
-        qR = Queue()
-        qT = self._detT
+        qC = DetTrans(ip, self._detT)
+        shard = self._shardFor(ip) if self._shard else self._main
+        with self._detRLock:
+            self._detC[ip] = qC
+        qR = shard.newRing(ip)
         with self._detRLock:
             self._detR[ip] = qR
-        return (qR, qT)
+        return (qC, qR, self._newLink(ip))
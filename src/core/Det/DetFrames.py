@@ -0,0 +1,109 @@
+import logging
+import numpy as np
+
+
+class DetFrames():
+    """
+    紧凑的采集结果, 代替每个包都带完整包头的(frames, per)结构数组
+    head: (frames,) 每帧一行的包头表(frame/pos0h/pos0t/pos1h/pos1t/info等)
+    pix:  (frames, per) 每个包自身的字段(flag/idx/dLen)
+    data: (frames, per, ...) 连续的uint16计数, 能谱模式为(frames, pixNum, bins)
+    valid: (frames, per) 包是否收到, 丢失的包计数为0
+    data["data"]/data["idx"]/data["pos0h"]等访问方式保持不变, 每帧字段以(frames, per)的只读广播视图给出
+    """
+    PIX = ("flag", "idx", "dLen")
+
+    def __init__(self, head: np.ndarray, data: np.ndarray, pix: np.ndarray, valid: np.ndarray = None):
+        self.head = head
+        self.data = data
+        self.pix = pix
+        self.valid = np.ones(pix.shape, dtype=bool) if valid is None else valid
+
+    @classmethod
+    def fromPackets(cls, heads: np.ndarray, datas: np.ndarray) -> 'DetFrames':
+        """heads: (frames,) 每帧第一个包, datas: (frames, per) 其余的包, 第0列不使用"""
+        (num, per) = datas.shape
+        headFields = [f for f in heads.dtype.names if f not in cls.PIX and f != "data"]
+        head = np.empty(num, dtype=[(f, heads.dtype[f]) for f in headFields])
+        for f in headFields:
+            head[f] = heads[f]
+        pix = np.empty((num, per), dtype=[(f, datas.dtype[f]) for f in cls.PIX])
+        for f in cls.PIX:
+            pix[:, 0][f] = heads[f]
+            pix[:, 1:][f] = datas[:, 1:][f]
+        data = np.empty((num, per) + datas.dtype["data"].shape, dtype=np.uint16)
+        data[:, 0] = heads["data"]
+        data[:, 1:] = datas[:, 1:]["data"]
+        return cls(head, data, pix)
+
+    def alloc(self, num: int) -> 'DetFrames':
+        """按本对象的格式分配num帧的空结果"""
+        return DetFrames(
+            np.empty(num, dtype=self.head.dtype),
+            np.empty((num,) + self.data.shape[1:], dtype=self.data.dtype),
+            np.empty((num,) + self.pix.shape[1:], dtype=self.pix.dtype),
+            np.empty((num,) + self.pix.shape[1:], dtype=bool),
+        )
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.pix.shape
+
+    @property
+    def names(self) -> tuple[str, ...]:
+        return self.head.dtype.names + self.PIX + ("data", "valid")
+
+    @property
+    def nbytes(self) -> int:
+        return self.head.nbytes + self.data.nbytes + self.pix.nbytes + self.valid.nbytes
+
+    def complete(self) -> np.ndarray:
+        """(frames,) 每帧是否收齐"""
+        return self.valid.all(axis=1)
+
+    def __len__(self) -> int:
+        return self.head.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key == "data":
+                return self.data
+            if key == "valid":
+                return self.valid
+            if key in self.PIX:
+                return self.pix[key]
+            return np.broadcast_to(self.head[key][:, np.newaxis], self.shape)
+        if isinstance(key, int):
+            key = slice(key, key + 1 or None)
+        return DetFrames(self.head[key], self.data[key], self.pix[key], self.valid[key])
+
+    def __setitem__(self, key, value: 'DetFrames'):
+        self.head[key] = value.head
+        self.data[key] = value.data
+        self.pix[key] = value.pix
+        self.valid[key] = value.valid
+
+    def mergeSub(self, k: int, frame0: int) -> 'DetFrames':
+        """k个子帧合并为一帧: 包头取第一个子帧, 结束位置取最后一个子帧, 计数累加, 任一子帧丢包即无效"""
+        num = len(self) // k
+        head = self.head[0::k].copy()
+        for field in ("pos0t", "pos1t"):
+            if field in head.dtype.names:
+                head[field] = self.head[k - 1::k][field]
+        head["frame"] = (head["frame"] - frame0) // k + frame0
+        total = self.data.reshape((num, k) + self.data.shape[1:]).sum(axis=1, dtype=np.uint32)
+        if (total > 0xFFFF).any():
+            logging.warning("合并子帧后计数超过65535, 已截断")
+        data = np.minimum(total, 0xFFFF).astype(np.uint16)
+        valid = self.valid.reshape((num, k) + self.shape[1:]).all(axis=1)
+        return DetFrames(head, data, self.pix[0::k].copy(), valid)
+
+    def toStruct(self) -> np.ndarray:
+        """还原为每个包都带完整包头的(frames, per)结构数组"""
+        dtype = [(f, self.head.dtype[f]) for f in self.head.dtype.names]
+        dtype += [(f, self.pix.dtype[f]) for f in self.PIX]
+        dtype += [("data", self.data.dtype, self.data.shape[2:]), ("valid", bool)]
+        out = np.empty(self.shape, dtype=dtype)
+        for f in self.names:
+            out[f] = self[f]
+        return out
@@ -0,0 +1,216 @@
+import time
+import logging
+import threading
+import numpy as np
+from queue import Queue, Full
+from core.Det.Det import Det
+from core.Det.DetFrames import DetFrames
+from core.Det.DetTrans import TransError
+
+
+class DetGroup():
+    """
+    多设备同步采集(多板拼接等): 各设备在各自的线程中并行配置和接收, 每段的启动命令在所有设备就绪后连续下发
+    每次产出{ip: DetFrames}, 各设备同一位置的帧对齐:
+    align="frame": 按设备帧号对齐(设备启动时从0重新计帧), 丢失的帧保留为无效帧, 位置不移动;
+        开头丢失的帧同样为无效帧, 各设备同一位置为同一帧号; 第一帧帧号仍不同时在较晚的设备前补无效帧
+    align="pos0"/"pos1": 按包头中的位置对齐, 每台设备多采skew帧, 跳过开头位置还未到达其他设备起点的帧
+
+    group = DetGroup(srv.findDet().values())
+    for chunks in group.histStream(1000, 100):
+        ...
+    """
+
+    def __init__(self, dets, timeout: float = 30):
+        self.dets: list[Det] = list(dets)
+        self._timeout = timeout
+        # 最近一次启动时各启动命令发出的时间跨度(秒)
+        self.startSpread = 0.0
+
+    def _fire(self):
+        """全部设备到达启动点后由最后到达的线程执行: 先连续发出所有启动命令, 再统一等待应答"""
+        bursts = [det.armBurst([(0x0011, 1)]) for det in self.dets]
+        t0 = time.perf_counter()
+        tokens = [det.fireBurst(burst) for (det, burst) in zip(self.dets, bursts)]
+        self.startSpread = time.perf_counter() - t0
+        failed = {}
+        for (det, burst, token) in zip(self.dets, bursts, tokens):
+            errors = {}
+            det.waitBurst(burst, token, errors)
+            if errors:
+                failed[det._ip] = errors
+        if failed:
+            raise TransError(f"同步启动失败: {failed}")
+        logging.info(f"{len(self.dets)}台设备同步启动, 命令跨度{self.startSpread * 1e6:.0f}us")
+
+    def _run(self, stream, q: Queue, stop: threading.Event, barrier: threading.Barrier):
+        def put(item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.5)
+                    return True
+                except Full:
+                    pass
+            return False
+        try:
+            for frames in stream:
+                if not put(frames):
+                    break
+            put(None)
+        except BaseException as e:
+            # 其他设备不再等待本设备到达启动点
+            barrier.abort()
+            put(e)
+
+    def _stream(self, mode: str, num: int, intr: int, chunk: int):
+        barrier = threading.Barrier(len(self.dets), action=self._fire)
+
+        def start():
+            barrier.wait(self._timeout)
+
+        stop = threading.Event()
+        qs = []
+        for det in self.dets:
+            q = Queue(4)
+            stream = getattr(det, mode)(num, intr, chunk, start=start)
+            threading.Thread(target=self._run, args=(stream, q, stop, barrier), daemon=True).start()
+            qs.append(q)
+        try:
+            while True:
+                items = [q.get() for q in qs]
+                errors = [e for e in items if isinstance(e, BaseException)]
+                if errors:
+                    raise errors[0]
+                if any(item is None for item in items):
+                    break
+                yield {det._ip: frames for (det, frames) in zip(self.dets, items)}
+        finally:
+            stop.set()
+
+    @staticmethod
+    def _cat(a: DetFrames, b: DetFrames) -> DetFrames:
+        if a is None or len(a) == 0:
+            return b
+        out = a.alloc(len(a) + len(b))
+        out[:len(a)] = a
+        out[len(a):] = b
+        return out
+
+    @staticmethod
+    def posOffsets(pos: dict[str, np.ndarray]) -> dict[str, int] | None:
+        """
+        pos为各设备开头若干帧的位置, 返回各设备需跳过的帧数, 使各设备从同一位置开始
+        以最晚开始的设备的第一帧位置为起点, 找不到所有设备共有的起点时返回None
+        """
+        best = None
+        for p in (v[0] for v in pos.values()):
+            idx = {ip: np.flatnonzero(v == p) for (ip, v) in pos.items()}
+            if not all(i.size for i in idx.values()):
+                continue
+            offs = {ip: int(i[0]) for (ip, i) in idx.items()}
+            if best is None or sum(offs.values()) > sum(best.values()):
+                best = offs
+        return best
+
+    @staticmethod
+    def frameOffsets(first: dict[str, int], k: int = 1, limit: int = None) -> dict[str, int]:
+        """
+        first为各设备第一帧的设备帧号, 返回各设备开头需补的无效帧数, 使各设备从最早的帧号开始
+        k个子帧合并为一帧时按合并后的帧数取整; 相差超过limit帧时认为帧号不可比, 全部返回0
+        """
+        ref = next(iter(first.values()))
+        # 帧号按uint32回绕计算
+        rel = {ip: ((f - ref + (1 << 31)) & 0xFFFFFFFF) - (1 << 31) for (ip, f) in first.items()}
+        start = min(rel.values())
+        pads = {ip: (r - start + k // 2) // k for (ip, r) in rel.items()}
+        if limit is not None and max(pads.values()) > limit:
+            logging.warning(f"各设备第一帧帧号相差过大{first}, 按到达顺序对齐")
+            return dict.fromkeys(first, 0)
+        return pads
+
+    @staticmethod
+    def _blank(like: DetFrames, n: int) -> DetFrames:
+        """n帧无效帧, 帧号接在like第一帧之前"""
+        out = like.alloc(n)
+        out.head[:] = np.zeros(n, out.head.dtype)
+        out.pix[:] = np.zeros(out.pix.shape, out.pix.dtype)
+        out.pix["idx"] = np.arange(out.shape[1])
+        out.data[:] = 0
+        out.valid[:] = False
+        out.head["frame"] = (int(like.head["frame"][0]) - n + np.arange(n)) & 0xFFFFFFFF
+        return out
+
+    def _alignFrame(self, stream, num: int, k: int, limit: int):
+        def first(chunks):
+            pads = self.frameOffsets({ip: int(c.head["frame"][0]) for (ip, c) in chunks.items()}, k, limit)
+            if any(pads.values()):
+                logging.warning(f"设备开头丢帧, 按帧号对齐, 各设备补无效帧数: {pads}")
+            return {ip: self._cat(self._blank(c, pads[ip]), c) if pads[ip] else c for (ip, c) in chunks.items()}
+        return self._zipAligned(stream, num, first)
+
+    def _alignPos(self, stream, field: str, num: int):
+        def first(chunks):
+            offs = self.posOffsets({ip: c.head[field] for (ip, c) in chunks.items()})
+            if offs is None:
+                logging.warning(f"各设备开头的{field}没有共同的起点, 按帧计数对齐")
+                offs = dict.fromkeys(chunks, 0)
+            else:
+                logging.info(f"按{field}对齐, 各设备跳过帧数: {offs}")
+            return {ip: c[offs[ip]:] for (ip, c) in chunks.items()}
+        return self._zipAligned(stream, num, first)
+
+    def _zipAligned(self, stream, num: int, first):
+        """first调整各设备的第一块使开头对齐, 之后按各设备都已有的帧数产出, 共num帧"""
+        bufs = {det._ip: None for det in self.dets}
+        done = 0
+        for (i, chunks) in enumerate(stream):
+            if i == 0:
+                chunks = first(chunks)
+            bufs = {ip: self._cat(bufs[ip], c) for (ip, c) in chunks.items()}
+            n = min(min(len(b) for b in bufs.values()), num - done)
+            if n > 0:
+                yield {ip: b[:n] for (ip, b) in bufs.items()}
+                bufs = {ip: b[n:] for (ip, b) in bufs.items()}
+                done += n
+        if done < num:
+            logging.warning(f"对齐后只有{done}帧, 少于{num}帧(按位置对齐时需增大skew)")
+
+    def _aligned(self, mode: str, num: int, intr: int, chunk: int, align: str, skew: int):
+        if align == "frame":
+            # 补帧的设备多出的结尾几帧不再产出
+            return self._alignFrame(self._stream(mode, num, intr, chunk), num, Det.subFrames(intr), chunk)
+        if align not in ("pos0", "pos1"):
+            raise ValueError(f"不支持的对齐方式: {align}")
+        if skew >= chunk:
+            raise ValueError("skew必须小于chunk, 起点需在第一块内找到")
+        return self._alignPos(self._stream(mode, num + skew, intr, chunk), align + "h", num)
+
+    def histStream(self, num: int, intr: int = 10000, chunk: int = 64, align: str = "frame", skew: int = 0):
+        """能谱模式同步采集, 每块为{ip: (chunk, pixNum)的DetFrames}"""
+        return self._aligned("histStream", num, intr, chunk, align, skew)
+
+    def thrStream(self, num: int, intr: int = 10000, chunk: int = 64, align: str = "frame", skew: int = 0):
+        """阈值模式同步采集, 每块为{ip: DetFrames}"""
+        return self._aligned("thrStream", num, intr, chunk, align, skew)
+
+    @staticmethod
+    def _acqJoin(stream, num: int) -> dict[str, DetFrames]:
+        data = {}
+        done = 0
+        for chunks in stream:
+            for (ip, chunk) in chunks.items():
+                if ip not in data:
+                    data[ip] = chunk.alloc(num)
+                data[ip][done:done + len(chunk)] = chunk
+            done += len(next(iter(chunks.values())))
+        return {ip: d[:done] for (ip, d) in data.items()}
+
+    def histAcq(self, num: int, intr: int = 10000, align: str = "frame", skew: int = 0) -> dict[str, DetFrames]:
+        return self._acqJoin(self.histStream(num, intr, 256, align, skew), num)
+
+    def thrAcq(self, num: int, intr: int = 10000, align: str = "frame", skew: int = 0) -> dict[str, DetFrames]:
+        return self._acqJoin(self.thrStream(num, intr, 256, align, skew), num)
+
+    def acqStats(self) -> dict[str, dict[str, int]]:
+        """各设备最近一次采集的丢包统计"""
+        return {det._ip: det.acqStats() for det in self.dets}
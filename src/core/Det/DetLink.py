@@ -0,0 +1,117 @@
+import time
+import logging
+import threading
+from core.Det.DetTrans import DetRtt
+
+
+class DetLink():
+    """
+    一台设备的链路状态: 心跳包(id 3)的到达间隔和抖动, 在线检测, 往返时延
+    心跳间隔以1/8平滑, 抖动为间隔偏差的绝对值以1/16平滑(同RFC 3550)
+    心跳包, 探测应答和数据包都算作设备的响应, 超过timeout()没有任何响应即为离线, 再次响应后恢复在线
+    状态只在check中改变, 变化时调用onChange(ip, online); 还没有收到心跳时按interval(探测周期)计算超时
+    时刻均为time.monotonic(), 接收进程中记录的时刻与本进程可比
+    """
+
+    def __init__(self, ip: str, onChange=None, missed: int = 3, interval: float = 5.0, rtt: DetRtt = None):
+        self.ip = ip
+        # None为尚未判断
+        self.online: bool | None = None
+        self.lastSeen: float | None = None
+        self.lastBeat: float | None = None
+        self.beats = 0
+        self.beatInterval: float | None = None
+        self.jitter = 0.0
+        # 往返时延由设备的事务层在每次寄存器读写时估计
+        self.rtt = DetRtt() if rtt is None else rtt
+        self._onChange = onChange
+        self._missed = missed
+        self._interval = interval
+        self._since = time.monotonic()
+        self._packets = 0
+        self._lock = threading.Lock()
+
+    def beat(self, t: float):
+        """收到心跳包, t为接收时刻"""
+        with self._lock:
+            if self.lastBeat is not None and t > self.lastBeat:
+                d = t - self.lastBeat
+                if self.beatInterval is None:
+                    self.beatInterval = d
+                else:
+                    self.jitter += (abs(d - self.beatInterval) - self.jitter) / 16
+                    self.beatInterval += (d - self.beatInterval) / 8
+            self.lastBeat = t
+            self.beats += 1
+            self._seen(t)
+
+    def seen(self, t: float):
+        """收到设备的其他响应(控制应答/数据包)"""
+        with self._lock:
+            self._seen(t)
+
+    def _seen(self, t: float):
+        if self.lastSeen is None or t > self.lastSeen:
+            self.lastSeen = t
+
+    def timeout(self, now: float = None) -> float:
+        """多久没有响应判为离线: missed个预期响应间隔, 按心跳判断时加4倍抖动"""
+        now = time.monotonic() if now is None else now
+        slow = self._missed * self._interval
+        if self.beatInterval is None or now - self.lastBeat > slow:
+            # 没有心跳或心跳已停止很久(设备不再发送心跳), 按探测周期
+            return slow
+        return self._missed * min(self.beatInterval, self._interval) + 4 * self.jitter
+
+    def probe(self, trans, addr: int = 0x0000) -> float | None:
+        """读取一次寄存器(往返时延由事务层记入rtt), 返回本次延迟, 失败返回None"""
+        req = trans.run([trans.read(addr)])[0]
+        if not req.done:
+            return None
+        now = time.monotonic()
+        self.seen(now)
+        return now - req.sent
+
+    def check(self, now: float = None, packets: int = None) -> bool | None:
+        """
+        监视线程定期调用, packets为该设备累计收到的包数(有增加即有响应)
+        返回当前状态, 状态变化时调用onChange
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if packets is not None and packets != self._packets:
+                self._packets = packets
+                self._seen(now)
+            last = self._since if self.lastSeen is None else self.lastSeen
+        online = now - last <= self.timeout(now)
+        if online == self.online or (self.lastSeen is None and online):
+            # 还没有任何响应时只在超时后判为离线
+            return self.online
+        self.online = online
+        if online:
+            logging.info(f"设备({self.ip})在线")
+        else:
+            logging.warning(f"设备({self.ip}){now - last:.1f}s没有响应, 判为离线")
+        if self._onChange is not None:
+            try:
+                self._onChange(self.ip, online)
+            except Exception:
+                logging.exception(f"设备({self.ip})链路状态回调异常")
+        return online
+
+    def stats(self) -> dict:
+        """链路统计: 在线状态, 距最近响应/心跳的秒数, 心跳间隔/抖动, 往返时延(秒)"""
+        now = time.monotonic()
+        rtt = self.rtt
+        return {
+            "online": self.online,
+            "sinceSeen": None if self.lastSeen is None else now - self.lastSeen,
+            "sinceBeat": None if self.lastBeat is None else now - self.lastBeat,
+            "beats": self.beats,
+            "beatInterval": self.beatInterval,
+            "jitter": self.jitter,
+            "rtt": rtt.last,
+            "srtt": rtt.srtt,
+            "rttvar": rtt.rttvar,
+            "rto": rtt.rto() if rtt.measured() else None,
+        }
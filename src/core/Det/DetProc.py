@@ -0,0 +1,247 @@
+import time
+import logging
+import numpy as np
+from threading import Thread, Lock
+from multiprocessing.shared_memory import SharedMemory
+from core.Det.DetRing import DetRing, MTU_PAYLOAD
+from core.Det.DetStat import DetStat
+from core.Det.DetRecv import DetRecv
+from core.Det.DetCap import DetCapWriter
+
+# 共享控制区(int64): 写/读位置, 溢出, 最大积压, 之后为接收进程累加的DetStat字段
+(_W, _R, _OVERRUN, _HIGH_WATER) = range(4)
+_RX_FIELDS = ("packets", "bytes", "ctrl", "heartbeat", "malformed")
+_CTL_LEN = 16
+
+
+def _shared(i: int) -> property:
+    return property(
+        lambda self: self._ctl[i],
+        lambda self, value: self._ctl.__setitem__(i, value),
+    )
+
+
+def _release(shm: SharedMemory, unlink: bool):
+    try:
+        shm.close()
+    except BufferError:
+        # 仍有视图引用该内存, 由垃圾回收关闭
+        pass
+    if unlink:
+        shm.unlink()
+
+
+class _SemCond():
+    """
+    以进程间信号量代替Condition: 接收进程每批release一次(不会阻塞), 消费者acquire等待并最多10ms检查一次条件
+    不用Event, 其内部锁可能被停顿中的主进程线程持有而阻塞接收进程
+    """
+
+    def __init__(self, sem):
+        self._sem = sem
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, exc, tb):
+        return False
+
+    def notify_all(self):
+        self._sem.release()
+
+    def wait_for(self, pred, timeout: float = None) -> bool:
+        end = None if timeout is None else time.monotonic() + timeout
+        # 丢弃之前积累的通知
+        while self._sem.acquire(False):
+            pass
+        while not pred():
+            left = 0.01 if end is None else min(0.01, end - time.monotonic())
+            if left <= 0:
+                return False
+            self._sem.acquire(timeout=left)
+        return True
+
+
+class _ShmStat(DetStat):
+    """接收进程累加的字段在共享控制区中, 组帧累加的字段在本进程中"""
+    packets = _shared(_HIGH_WATER + 1)
+    bytes = _shared(_HIGH_WATER + 2)
+    ctrl = _shared(_HIGH_WATER + 3)
+    heartbeat = _shared(_HIGH_WATER + 4)
+    malformed = _shared(_HIGH_WATER + 5)
+
+    def __init__(self, ctl: memoryview):
+        # 共享环重新映射时替换_ctl
+        self._ctl = ctl
+        for f in self.FIELDS:
+            if f not in _RX_FIELDS:
+                setattr(self, f, 0)
+        self._mark = (time.perf_counter(), 0, 0)
+
+
+class DetShmRing(DetRing):
+    """
+    共享内存中的DetRing, 由接收进程写入, 本进程按DetRing的方式读取
+    布局: 控制区, lens, ids, buf, 由本进程创建和释放, 接收进程按名称映射
+    重新分配(reserve)后通过onAlloc(ring)通知接收进程重新映射, 确认后释放旧内存
+    默认容量远大于DetRing: 主进程停顿(绘图/保存)期间的数据积压在这里, 而不是受rmem_max限制的内核缓冲区
+    """
+    _w = _shared(_W)
+    _r = _shared(_R)
+    _overrun = _shared(_OVERRUN)
+    _highWater = _shared(_HIGH_WATER)
+
+    def __init__(self, sem, onAlloc=None, slots: int = 262144, size: int = MTU_PAYLOAD,
+                 budget: int = 256 * 1024 * 1024):
+        self._shm = None
+        self._ctl = None
+        self._onAlloc = onAlloc
+        super().__init__(slots, size, budget)
+        self._cond = _SemCond(sem)
+        self.stat = _ShmStat(self._ctl)
+
+    @classmethod
+    def attach(cls, sem, name: str, slots: int, size: int) -> 'DetShmRing':
+        """接收进程中按名称映射已创建的共享环"""
+        ring = cls.__new__(cls)
+        (ring._shm, ring._ctl) = (None, None)
+        (ring._gen, ring._slotGen, ring._hold, ring._full) = (0, 0, 0, False)
+        ring._cond = _SemCond(sem)
+        ring.stat = None
+        ring.remap(name, slots, size)
+        ring.stat = _ShmStat(ring._ctl)
+        return ring
+
+    def name(self) -> str:
+        return self._shm.name
+
+    def _layout(self, shm: SharedMemory, slots: int, size: int) -> tuple[np.ndarray, ...]:
+        ctl = np.ndarray(_CTL_LEN, dtype=np.int64, buffer=shm.buf)
+        lens = np.ndarray(slots, dtype=np.int32, buffer=shm.buf, offset=ctl.nbytes)
+        ids = np.ndarray(slots, dtype=np.uint32, buffer=shm.buf, offset=ctl.nbytes + lens.nbytes)
+        buf = np.ndarray((slots, size), dtype=np.uint8, buffer=shm.buf, offset=ctl.nbytes + lens.nbytes + ids.nbytes)
+        return (ctl, buf, lens, ids)
+
+    def _arrays(self, slots: int, size: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        shm = SharedMemory(create=True, size=_CTL_LEN * 8 + slots * (8 + size))
+        (ctl, buf, lens, ids) = self._layout(shm, slots, size)
+        if self._ctl is not None:
+            # 读写位置和接收计数接续旧环
+            ctl[:] = self._ctl
+        self._setCtl(shm, ctl.nbytes)
+        return (buf, lens, ids)
+
+    def _setCtl(self, shm: SharedMemory, nbytes: int):
+        (self._shm, self._ctl) = (shm, shm.buf[:nbytes].cast("q"))
+        if getattr(self, "stat", None) is not None:
+            self.stat._ctl = self._ctl
+
+    def slot(self) -> memoryview:
+        # 与DetRing相同, 读写位置只读写一次共享控制区
+        ctl = self._ctl
+        self._slotGen = self._gen
+        w = ctl[_W]
+        self._full = w - ctl[_R] >= self._slots
+        if self._full:
+            return self._spare
+        return self._rows[w % self._slots]
+
+    def push(self, id: int, n: int):
+        ctl = self._ctl
+        if self._full or self._slotGen != self._gen:
+            ctl[_OVERRUN] += 1
+            return
+        w = ctl[_W]
+        k = w % self._slots
+        self._lens[k] = n
+        self._ids[k] = id
+        # 包内容和长度写入后再提交写位置
+        ctl[_W] = w = w + 1
+        if w - ctl[_R] > ctl[_HIGH_WATER]:
+            ctl[_HIGH_WATER] = w - ctl[_R]
+
+    def reserve(self, size: int):
+        old = self._shm
+        oldCtl = self._ctl
+        super().reserve(size)
+        if self._shm is not old:
+            if self._onAlloc is not None:
+                self._onAlloc(self)
+            oldCtl.release()
+            _release(old, unlink=True)
+
+    def remap(self, name: str, slots: int, size: int):
+        """接收进程中映射本进程重新分配的共享环"""
+        (old, oldCtl) = (self._shm, self._ctl)
+        shm = SharedMemory(name)
+        (ctl, buf, lens, ids) = self._layout(shm, slots, size)
+        self._setCtl(shm, ctl.nbytes)
+        self._map(buf, lens, ids)
+        if old is not None:
+            oldCtl.release()
+            _release(old, unlink=False)
+
+    def close(self, unlink: bool = True):
+        self._ctl.release()
+        (self._buf, self._lens, self._ids, self._rows) = (None, None, None, [])
+        _release(self._shm, unlink)
+
+
+def _procCmd(conn, rings: dict[str, DetShmRing], sem, flag: list[bool], send, recv: DetRecv):
+    while flag[0]:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            # 主进程已退出
+            break
+        match msg:
+            case ("ring", ip, name, slots, size):
+                ring = rings.get(ip)
+                if ring is None:
+                    rings[ip] = DetShmRing.attach(sem, name, slots, size)
+                else:
+                    ring.remap(name, slots, size)
+                send(("ack", ip))
+            case ("capture", path):
+                try:
+                    writer = None if path is None else DetCapWriter(path)
+                except (OSError, ValueError) as e:
+                    send(("capAck", str(e)))
+                    continue
+                if not recv.capture(writer).wait(5):
+                    logging.error("接收循环未响应抓包切换")
+                send(("capAck", None))
+            case ("stop",):
+                break
+    flag[0] = False
+
+
+def procMain(s, conn, sem, batch: int, rxName: str):
+    """
+    接收进程入口, s为与主进程共用的UDP套接字(主进程只用它发送)
+    数据包收进共享环, 控制包和心跳包的接收时刻经conn转发给主进程, conn上的命令映射新的共享环, 切换抓包文件或结束接收
+    """
+    s.setblocking(False)
+    rxShm = SharedMemory(rxName)
+    rx = rxShm.buf.cast("q")
+    rings: dict[str, DetShmRing] = {}
+    flag = [True]
+    lock = Lock()
+
+    def send(msg):
+        with lock:
+            conn.send(msg)
+
+    recv = DetRecv(
+        s, rings, lambda ip, data: send(("ctrl", ip, bytes(data))), batch, rx,
+        onBeat=lambda ip, t: send(("beat", ip, t)),
+    )
+    Thread(target=_procCmd, args=(conn, rings, sem, flag, send, recv), daemon=True).start()
+    try:
+        recv.run(flag)
+    except Exception:
+        logging.exception("接收进程异常退出")
+    for ring in rings.values():
+        ring.close(unlink=False)
+    rx.release()
+    _release(rxShm, unlink=False)
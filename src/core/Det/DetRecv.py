@@ -0,0 +1,152 @@
+import time
+import select
+import struct
+import logging
+import threading
+from core.Det.DetRing import DetRing
+
+# VPDT包头: 魔数 + 包类型id
+_VPDT = struct.Struct("<4sL")
+# UDP包的最大长度
+MAX_DATAGRAM = 65536
+# counters中各计数的位置: 收包数, 字节数, 批数, 非设备端口或未添加设备的包数
+(RX_PKTS, RX_BYTES, RX_BATCH, RX_FOREIGN) = range(4)
+
+
+class DetRecv():
+    """
+    接收循环, 数据包直接收进各设备的DetRing, 控制包交给onCtrl(ip, data), 心跳包的接收时刻交给onBeat(ip, t)
+    既可作为DetData的接收线程, 也可在独立的接收进程中运行(rings为共享内存环, counters为共享内存),
+    事件循环中由套接字可读回调调用drain
+    """
+
+    def __init__(
+        self, s, rings: dict[str, DetRing], onCtrl, batch: int = 64, counters=None, onUnknown=None, onBeat=None
+    ):
+        self._s = s
+        self._rings = rings
+        self._onCtrl = onCtrl
+        # 未添加设备从设备端口发来的包(查找设备的应答), 为None时只计数
+        self._onUnknown = onUnknown
+        self._onBeat = onBeat
+        # 单次唤醒最多连续接收的包数, 满一批才通知消费者
+        self._batch = batch
+        self.counters = [0] * 4 if counters is None else counters
+        self._spare = memoryview(bytearray(MAX_DATAGRAM))
+        self._last = (None, None, None)
+        self._dirty = set()
+        # 抓包: 收到的每个数据报写入DetCapWriter, 切换只在接收循环中进行
+        self._cap = None
+        self._capNext = None
+
+    def run(self, flag: list[bool]):
+        while flag[0]:
+            if self.drain(4096) < 4096:
+                # 内核缓冲区已读空
+                select.select((self._s,), (), (), 2)
+        self.applyCapture()
+        if self._cap is not None:
+            self._cap.close()
+            self._cap = None
+
+    def capture(self, writer) -> threading.Event:
+        """请求切换抓包的DetCapWriter(None停止), 旧的在接收循环中关闭, 返回切换完成的事件"""
+        done = threading.Event()
+        self._capNext = (writer, done)
+        return done
+
+    def applyCapture(self):
+        """在接收循环(或唯一调用drain的线程)中执行待切换的抓包"""
+        if self._capNext is None:
+            return
+        (writer, done) = self._capNext
+        self._capNext = None
+        if self._cap is not None:
+            self._cap.close()
+        self._cap = writer
+        done.set()
+
+    def drain(self, limit: int) -> int:
+        """非阻塞地接收, 直到内核缓冲区读空或收满limit个包, 返回收到的包数"""
+        recv = self._s.recvfrom_into
+        unpack = _VPDT.unpack_from
+        counters = self.counters
+        spare = self._spare
+        dirty = self._dirty
+        (lastIp, ring, stat) = self._last
+        if self._capNext is not None:
+            self.applyCapture()
+        cap = self._cap
+        pend = 0
+        got = 0
+        while got < limit:
+            # 大概率与上一个包来自同一设备, 直接收进该设备的环形缓冲区
+            buf = spare if ring is None else ring.slot()
+            try:
+                (n, (ip, port)) = recv(buf)
+            except BlockingIOError:
+                break
+            got += 1
+            counters[RX_PKTS] += 1
+            counters[RX_BYTES] += n
+            if cap is not None:
+                cap.write(ip, port, buf[:n])
+            if port != 7493:
+                counters[RX_FOREIGN] += 1
+                continue
+            if ip != lastIp:
+                dst = self._rings.get(ip)
+                if dst is None:
+                    # new device
+                    counters[RX_FOREIGN] += 1
+                    if self._onUnknown is not None:
+                        self._onUnknown(ip, bytes(buf[:n]))
+                    continue
+                if dst is not ring:
+                    row = dst.slot()
+                    if n >= len(row):
+                        dst.stat.malformed += 1
+                        continue
+                    row[:n] = buf[:n]
+                (lastIp, ring, stat) = (ip, dst, dst.stat)
+            stat.packets += 1
+            stat.bytes += n
+            if n < 8 or n >= len(buf):
+                # 过短, 或填满了接收行(包被截断)
+                stat.malformed += 1
+                continue
+            (hd, id) = unpack(buf)
+            if hd != b"VPDT":
+                stat.malformed += 1
+                continue
+            match id:
+                case 1:
+                    # 控制包: 直接交给事务层匹配, 数据环中该行下次复用
+                    stat.ctrl += 1
+                    self._onCtrl(ip, buf[8:n])
+                case 2:
+                    ring.push(id, n)
+                    dirty.add(ring)
+                    pend += 1
+                    if pend >= self._batch:
+                        self._flush(dirty, pend)
+                        pend = 0
+                case 3:
+                    stat.heartbeat += 1
+                    logging.debug(f"接收到心跳包/校正包, ip:{ip}")
+                    if self._onBeat is not None:
+                        self._onBeat(ip, time.monotonic())
+                case _:
+                    stat.malformed += 1
+                    logging.warning("接收到无效数据包")
+        self._last = (lastIp, ring, stat)
+        self._flush(dirty, pend)
+        return got
+
+    def _flush(self, dirty: set, pend: int):
+        if pend == 0:
+            return
+        for ring in dirty:
+            ring.flush()
+        dirty.clear()
+        self.counters[RX_BATCH] += 1
@@ -0,0 +1,240 @@
+import time
+import struct
+import logging
+import threading
+from collections import deque
+from queue import Empty
+from threading import Thread, Lock
+from core.Det import Det
+from core.Det.DetData import DetData
+from core.Det.DetShard import DetShard
+from core.Det.DetRecv import DetRecv
+from core.Det.DetCap import readCaps
+
+_VPDT = struct.Struct("<4sL")
+# 控制应答: 操作(0读/1写), 地址, 数据
+_REG = struct.Struct("<HHL")
+
+
+class _Capture():
+    """
+    一台设备的抓包内容: 以启动寄存器(0x11)写入的应答把抓包分成若干段
+    regs[w]为第w段启动前(第w-1段启动后)收到的寄存器应答, runs[w]为第w段启动后的数据包/心跳包(时间, 数据报)
+    """
+
+    def __init__(self):
+        self.regs: list[dict[int, int]] = [{}]
+        self.runs: list[list[tuple[float, bytes]]] = [[]]
+
+    def add(self, t: float, data: bytes):
+        if len(data) < 8:
+            return
+        (hd, id) = _VPDT.unpack_from(data)
+        if hd != b"VPDT":
+            return
+        if id == 1 and len(data) == 8 + _REG.size:
+            (flag, addr, value) = _REG.unpack_from(data, 8)
+            if flag == 1 and addr == 0x0011:
+                self.regs.append({})
+                self.runs.append([])
+            else:
+                self.regs[-1][addr] = value
+        elif id in (2, 3):
+            self.runs[-1].append((t, data))
+
+    def done(self):
+        # 第一次启动之前的数据并入第一段
+        if len(self.runs) > 1:
+            self.runs[1] = self.runs[0] + self.runs[1]
+            del self.runs[0]
+
+    def reg(self, w: int, addr: int) -> int | None:
+        """第w段启动时的寄存器值: 启动前最近的应答, 没有时依次往前再往后找"""
+        for i in list(range(min(w, len(self.regs) - 1), -1, -1)) + list(range(w + 1, len(self.regs))):
+            if addr in self.regs[i]:
+                return self.regs[i][addr]
+        return None
+
+
+class _ReplaySock():
+    """
+    回放的包源, 代替DetRecv的套接字: recvfrom_into取出一个到时的包, 没有时抛出BlockingIOError
+    寄存器应答立即到达; 数据包按抓包中的间隔除以speed到达(speed为None时尽快), 设备的环形缓冲区满时暂停该设备, 不丢包
+    """
+
+    def __init__(self, caps: dict[str, _Capture], rings: dict, speed: float | None):
+        self._caps = caps
+        self._rings = rings
+        self._speed = speed
+        self._replies: deque[tuple[str, bytes]] = deque()
+        # 每台设备当前放出的段: [数据包, 下一个包的序号, 放出时刻, 段首包时间]
+        self._runs: dict[str, list] = {}
+        self._lock = Lock()
+        self.wake = threading.Event()
+
+    def reply(self, ip: str, data: bytes):
+        self._replies.append((ip, data))
+        self.wake.set()
+
+    def release(self, ip: str, run: list[tuple[float, bytes]]):
+        """放出一段数据, 上一段未送出的包丢弃(设备重新启动后不会再发)"""
+        with self._lock:
+            self._runs[ip] = [run, 0, time.monotonic(), run[0][0] if run else 0.0]
+        self.wake.set()
+
+    def _full(self, ip: str) -> bool:
+        ring = self._rings.get(ip)
+        return ring is not None and ring._w - ring._r >= ring._slots
+
+    def _next(self, now: float) -> tuple[float, str | None]:
+        """最早到时的设备, 返回(到时时刻, ip), 没有可发送的包时ip为None"""
+        best = (float("inf"), None)
+        for (ip, (run, i, t0, first)) in self._runs.items():
+            if i >= len(run) or self._full(ip):
+                continue
+            due = now if self._speed is None else t0 + (run[i][0] - first) / self._speed
+            if due < best[0]:
+                best = (due, ip)
+        return best
+
+    def wait(self) -> float | None:
+        """到下一个包到时的秒数, 没有待发送的包时返回None"""
+        if self._replies:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            (due, ip) = self._next(now)
+        return None if ip is None else max(0.0, due - now)
+
+    def recvfrom_into(self, buf) -> tuple[int, tuple[str, int]]:
+        if self._replies:
+            (ip, data) = self._replies.popleft()
+        else:
+            now = time.monotonic()
+            with self._lock:
+                (due, ip) = self._next(now)
+                if ip is None or due > now:
+                    raise BlockingIOError()
+                run = self._runs[ip]
+                data = run[0][run[1]][1]
+                run[1] += 1
+        n = min(len(data), len(buf))
+        buf[:n] = data[:n]
+        return (n, (ip, 7493))
+
+
+class DetReplay(DetData):
+    """
+    抓包文件(DetData.capture)回放, 代替网络作为包源, 回放的包经与实时采集相同的DetRecv/DetRing/DetAsm解码组帧
+    寄存器读取按抓包中当前段启动前的应答回答, 写入直接确认, 写启动寄存器(0x11)时放出该设备的下一段数据
+    在回放上重新执行抓包时的采集调用即可重现当时的数据, 用于复现现场问题和离线测试解码性能
+
+    srv = DetReplay(["cap.vpcap"], speed=None).listen()
+    dets = srv.findDet()
+    data = dets[ip].histAcq(1000, 100)
+    """
+
+    def __init__(self, paths: str | list[str], speed: float | None = 1.0, batch: int = 64):
+        paths = [paths] if isinstance(paths, str) else list(paths)
+        self._caps: dict[str, _Capture] = {}
+        for (t, ip, port, data) in readCaps(paths):
+            if port == 7493:
+                self._caps.setdefault(ip, _Capture()).add(t, data)
+        for cap in self._caps.values():
+            cap.done()
+        self._initState(None, batch, False, False)
+        self.probeEvery = 0
+        # 每台设备已放出的段数
+        self._started = dict.fromkeys(self._caps, 0)
+        self._s = _ReplaySock(self._caps, self._detR, speed)
+        self._main = DetShard(self._s, self._onCtrl, batch)
+        self._shards = [self._main]
+        runs = {ip: len(cap.runs) for (ip, cap) in self._caps.items()}
+        logging.info(f"抓包回放: {len(self._caps)}台设备, 各设备段数: {runs}")
+
+    def listen(self):
+        if not self._listenFlag[0]:
+            self._listenFlag[0] = True
+            recv = DetRecv(self._s, self._detR, self._onCtrl, self._batch, self._main.counters)
+            Thread(target=self._loopR, args=(recv, self._listenFlag), name="DetReplay", daemon=True).start()
+            self._listenerT = Thread(target=self._loopT, args=(self._listenFlag,), daemon=True)
+            self._listenerT.start()
+        return self
+
+    def close(self):
+        self._listenFlag[0] = False
+        self._s.wake.set()
+        return self
+
+    def capture(self, path: str | None) -> list[str]:
+        raise RuntimeError("回放不能再抓包")
+
+    def _loopR(self, recv: DetRecv, flag: list[bool]):
+        src = self._s
+        while flag[0]:
+            wait = src.wait()
+            if wait is None:
+                # 没有待发送的包, 或环形缓冲区满等待消费者
+                src.wake.wait(0.005)
+                src.wake.clear()
+            elif wait > 0:
+                src.wake.wait(min(wait, 0.1))
+                src.wake.clear()
+            else:
+                recv.drain(4096)
+
+    def _loopT(self, flag: list[bool]):
+        """代替发送线程, 按抓包内容应答寄存器请求"""
+        while flag[0]:
+            try:
+                (ip, id, data) = self._detT.get(timeout=2)
+            except Empty:
+                continue
+            cap = self._caps.get(ip)
+            if cap is None or id != 1:
+                continue
+            if len(data) == 4:
+                (ctr, addr) = struct.unpack("<HH", data)
+                value = cap.reg(self._started[ip], addr)
+                if value is None:
+                    logging.warning(f"抓包中没有设备({ip})寄存器0x{addr:04X}的应答, 按0回答")
+                    value = 0
+            else:
+                (ctr, addr, value) = _REG.unpack(data)
+                if addr == 0x0011 and value:
+                    self._startRun(ip, cap)
+            self._s.reply(ip, b"VPDT" + struct.pack("<L", 1) + _REG.pack(ctr, addr, value))
+
+    def _startRun(self, ip: str, cap: _Capture):
+        w = self._started[ip]
+        if w >= len(cap.runs):
+            logging.warning(f"抓包中设备({ip})的{len(cap.runs)}段采集已全部回放")
+            self._s.release(ip, [])
+            return
+        self._started[ip] = w + 1
+        self._s.release(ip, cap.runs[w])
+        logging.info(f"回放设备({ip})第{w + 1}段, {len(cap.runs[w])}个包")
+
+    def _kernelStat(self) -> tuple[int, int] | None:
+        return None
+
+    def findDet(self, model: str = None) -> dict[str, Det]:
+        """
+        抓包中的全部设备, 型号取抓包中的查找应答(寄存器0/1, 抓包开始时写入), 没有时为model
+        都没有或型号未知时抛出ValueError
+        """
+        found = {}
+        models = Det.getModelRef()
+        for (ip, cap) in self._caps.items():
+            parts = {}
+            m = None
+            for addr in (0, 1):
+                value = cap.reg(0, addr)
+                if value is not None:
+                    m = self._findReply(b"VPDT" + struct.pack("<LHHL", 1, 0, addr, value), parts)
+            m = m or model
+            if m not in models:
+                raise ValueError(f"抓包中没有设备({ip})的型号{'' if m is None else f'({m}未知)'}, 请用findDet(model)指定")
+            found[ip] = Det(ip).getInstance(m).addQueue(self.addDet(ip))
+        self._device.update(found)
+        return found
@@ -0,0 +1,121 @@
+import threading
+import numpy as np
+from queue import Empty
+from core.Det.DetStat import DetStat
+
+# 标准以太网MTU(1500)下UDP负载的最大长度, 更大的包需要网卡开启巨型帧
+MTU_PAYLOAD = 1472
+
+
+class DetRing():
+    """
+    单设备接收环形缓冲区, (slots, size)的uint8数组, 每行存放一个完整的VPDT包
+    接收线程直接recvfrom_into到slot()返回的行, 消费者以跨行视图的方式按批取出
+    取出的视图在下一次取数(或clear)之前有效
+    行宽比最大包长至少多1字节, 收到的长度等于行宽即说明包被截断
+    """
+
+    def __init__(self, slots: int = 16384, size: int = MTU_PAYLOAD, budget: int = 64 * 1024 * 1024):
+        self._maxSlots = slots
+        self._budget = budget
+        self._gen = 0
+        self._slotGen = 0
+        self._alloc(size)
+        self._w = 0  # 已提交的包数, 仅接收线程修改
+        self._r = 0  # 已释放的包数, 仅消费者修改
+        self._hold = 0  # 已取出但尚未释放的包数
+        self._full = False
+        self._overrun = 0
+        self._highWater = 0
+        self._cond = threading.Condition()
+        self.stat = DetStat()
+
+    def _alloc(self, size: int):
+        # 行宽按8字节对齐, 保证包内字段视图对齐; 巨型帧时减少行数, 总内存不超过budget
+        size = (size + 1 + 7) & ~7
+        slots = max(1024, min(self._maxSlots, self._budget // size))
+        self._map(*self._arrays(slots, size))
+
+    def _arrays(self, slots: int, size: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """分配(buf, lens, ids)三个数组, 子类可改为放在共享内存中"""
+        return (
+            np.zeros((slots, size), dtype=np.uint8),
+            np.zeros(slots, dtype=np.int32),
+            np.zeros(slots, dtype=np.uint32),
+        )
+
+    def _map(self, buf: np.ndarray, lens: np.ndarray, ids: np.ndarray):
+        (self._buf, self._lens, self._ids) = (buf, lens, ids)
+        (self._slots, self._size) = buf.shape
+        self._spare = memoryview(bytearray(self._size))
+        self._rows = [memoryview(row) for row in buf]
+        # 旧行上正在进行的接收在push时按溢出丢弃
+        self._gen += 1
+
+    def reserve(self, size: int):
+        """保证每行至少能容纳size字节的包(含8字节包头), 需在开始采集前调用"""
+        if size >= self._size:
+            self.clear()
+            self._alloc(size)
+
+    def size(self) -> int:
+        """行宽, 不截断的最大包长为size() - 1"""
+        return self._size
+
+    def slot(self) -> memoryview:
+        """接收线程获取下一个可写行, 环满时返回备用行(该包将被丢弃)"""
+        self._slotGen = self._gen
+        self._full = self._w - self._r >= self._slots
+        if self._full:
+            return self._spare
+        return self._rows[self._w % self._slots]
+
+    def push(self, id: int, n: int):
+        """提交slot()中写入的包, 不唤醒消费者"""
+        if self._full or self._slotGen != self._gen:
+            self._overrun += 1
+            return
+        k = self._w % self._slots
+        self._lens[k] = n
+        self._ids[k] = id
+        self._w += 1
+        if self._w - self._r > self._highWater:
+            self._highWater = self._w - self._r
+
+    def flush(self):
+        """一批包提交完成后唤醒消费者"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def getView(self, count: int, timeout: float = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        取出最多count个连续的包, 不跨越环尾, 不拷贝
+        返回(ids, lens, rows), rows为(n, size)的行视图, 包头8字节之后为包内容
+        """
+        self._r += self._hold
+        self._hold = 0
+        if self._w == self._r:
+            with self._cond:
+                if not self._cond.wait_for(lambda: self._w != self._r, timeout):
+                    raise Empty()
+        k = self._r % self._slots
+        n = min(count, self._w - self._r, self._slots - k)
+        self._hold = n
+        return (self._ids[k:k + n], self._lens[k:k + n], self._buf[k:k + n])
+
+    def clear(self):
+        self._hold = 0
+        self._r = self._w
+
+    def qsize(self) -> int:
+        return self._w - self._r - self._hold
+
+    def overrun(self) -> int:
+        return self._overrun
+
+    def highWater(self, reset: bool = False) -> int:
+        """积压包数的最大值"""
+        hw = self._highWater
+        if reset:
+            self._highWater = 0
+        return hw
@@ -0,0 +1,72 @@
+import threading
+
+
+class DetShadow():
+    """
+    寄存器影子, 记录每个地址最后一次写入或读出的值
+    可缓存的配置寄存器命中时不再访问设备, 其余(状态/计数/触发)寄存器总是穿透到设备
+    """
+    # 可缓存的配置寄存器
+    CACHEABLE = {
+        0x0012, 0x0013, 0x0014, 0x0015,  # 采集模式/探测模式/采集时间/采集次数
+        0x0018,  # 包头配置
+        0x0020, *range(0x0021, 0x0021 + 16),  # 能窗数量/能窗范围
+        # 编码器配置(0x41/0x49)带清零位, 每次写入都要下发, 不缓存
+        0x0043, 0x004B,  # 零点偏移
+        0x0060,  # 电源开关
+    }
+
+    def __init__(self, enable: bool = True):
+        self.enable = enable
+        self._val: dict[int, int] = {}
+        self._policy: dict[int, bool] = {}
+        self._hit = 0
+        self._miss = 0
+        self._lock = threading.Lock()
+
+    def cacheable(self, addr: int) -> bool:
+        return self._policy.get(addr, addr in self.CACHEABLE)
+
+    def setPolicy(self, addr: int, cacheable: bool) -> 'DetShadow':
+        with self._lock:
+            self._policy[addr] = cacheable
+            if not cacheable:
+                self._val.pop(addr, None)
+        return self
+
+    def get(self, addr: int) -> int | None:
+        if not self.enable or not self.cacheable(addr):
+            return None
+        with self._lock:
+            value = self._val.get(addr)
+            if value is None:
+                self._miss += 1
+            else:
+                self._hit += 1
+            return value
+
+    def put(self, addr: int, value: int):
+        if self.cacheable(addr):
+            with self._lock:
+                self._val[addr] = value
+
+    def invalidate(self, addrs: list[int] = None):
+        """addrs为None时清空全部影子"""
+        with self._lock:
+            if addrs is None:
+                self._val.clear()
+            else:
+                for addr in addrs:
+                    self._val.pop(addr, None)
+
+    def known(self) -> list[int]:
+        with self._lock:
+            return sorted(self._val)
+
+    def items(self) -> dict[int, int]:
+        """全部影子值, 不计入命中统计"""
+        with self._lock:
+            return dict(self._val)
+
+    def stats(self) -> dict[str, int]:
+        return {"hit": self._hit, "miss": self._miss, "size": len(self._val)}
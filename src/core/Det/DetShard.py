@@ -0,0 +1,189 @@
+from queue import Queue, Empty
+from threading import Thread, Lock
+from multiprocessing.shared_memory import SharedMemory
+import multiprocessing
+import logging
+from core.Det.DetRing import DetRing
+from core.Det.DetRecv import DetRecv
+from core.Det.DetProc import DetShmRing, procMain
+from core.Det.DetCap import DetCapWriter
+
+
+class DetShard():
+    """
+    接收分片: 一个套接字和收它的接收线程(process=True时为接收进程), 包收进rings中各设备的环形缓冲区
+    控制包交给onCtrl(ip, data), 心跳包的接收时刻交给onBeat(ip, t), 接收进程中的经管道转回本进程再交给它们
+    counters为收包数, 字节数, 批数, 非设备端口或未添加的设备发来的包数
+    ip为分片专收的设备, None为主套接字的分片
+    """
+
+    def __init__(self, s, onCtrl, batch: int = 64, process: bool = False, ip: str = None, onBeat=None):
+        self._s = s
+        self._onCtrl = onCtrl
+        self._onBeat = onBeat
+        self._batch = batch
+        self._process = process
+        self.ip = ip
+        self._name = "DetRecv" if ip is None else f"DetRecv-{ip}"
+        self.rings: dict[str, DetRing] = {}
+        self._flag = [False]
+        self._proc = None
+        self._recv = None
+        self._thread = None
+        self._closed = False
+        # 抓包文件, 启动前设置的在启动时生效
+        self._cap = None
+        if process:
+            # 接收进程以spawn启动, 不继承Qt等线程状态
+            self._ctx = multiprocessing.get_context("spawn")
+            self._sem = self._ctx.Semaphore(0)
+            self._acks: Queue = Queue()
+            self._capAcks: Queue = Queue()
+            self._connLock = Lock()
+            self._rxShm = SharedMemory(create=True, size=8 * 4)
+            self.counters = self._rxShm.buf.cast("q")
+        else:
+            self.counters = [0] * 4
+
+    def newRing(self, ip: str) -> DetRing:
+        """为设备创建本分片写入的环形缓冲区, 接收进程已启动时等待其映射"""
+        if self._process:
+            ring = DetShmRing(self._sem, lambda ring: self._sendRing(ip, ring))
+        else:
+            ring = DetRing()
+        self.rings[ip] = ring
+        self._sendRing(ip, ring)
+        return ring
+
+    def start(self):
+        if self._flag[0]:
+            return
+        if self._closed and self._process:
+            raise RuntimeError("接收进程已关闭, 不能再次启动")
+        self._flag[0] = True
+        self._s.setblocking(False)
+        if self._process:
+            self._startProc()
+        else:
+            self._recv = DetRecv(self._s, self.rings, self._onCtrl, self._batch, self.counters, onBeat=self._onBeat)
+            if self._cap is not None:
+                self._recv.capture(DetCapWriter(self._cap))
+            self._thread = Thread(target=self._recv.run, args=(self._flag,), name=self._name)
+            self._thread.start()
+
+    def capture(self, path: str | None):
+        """切换抓包文件(None停止), 接收循环空闲时最多等待一次select超时(2s)"""
+        self._cap = path
+        if self._process:
+            if self._proc is None:
+                return
+            with self._connLock:
+                self._conn.send(("capture", path))
+            try:
+                err = self._capAcks.get(timeout=5)
+            except Empty:
+                logging.error(f"接收进程({self._name})未确认抓包切换")
+                return
+            if err is not None:
+                raise OSError(err)
+        elif self._recv is not None and self._flag[0]:
+            writer = None if path is None else DetCapWriter(path)
+            if not self._recv.capture(writer).wait(5):
+                logging.error(f"接收线程({self._name})未响应抓包切换")
+
+    def _startProc(self):
+        (self._conn, child) = self._ctx.Pipe()
+        self._proc = self._ctx.Process(
+            target=procMain,
+            args=(self._s, child, self._sem, self._batch, self._rxShm.name),
+            name=self._name,
+            daemon=True,
+        )
+        self._proc.start()
+        child.close()
+        self._listenerC = Thread(target=self._loopC, args=(self._flag,))
+        self._listenerC.start()
+        for (ip, ring) in list(self.rings.items()):
+            self._sendRing(ip, ring)
+        if self._cap is not None:
+            self.capture(self._cap)
+        logging.info(f"接收进程已启动({self._name}), pid:{self._proc.pid}")
+
+    def stop(self):
+        """通知接收线程/进程退出, 不等待; 多个分片先全部stop再close, 等待时间不累加"""
+        if self._cap is not None and not self._process:
+            # 接收线程退出前写完抓包文件
+            self.capture(None)
+        if self._flag[0] and self._proc is not None:
+            with self._connLock:
+                self._conn.send(("stop",))
+        self._flag[0] = False
+
+    def close(self):
+        """
+        停止接收并释放资源, 设备专用分片(ip不为None)的套接字在接收者退出后关闭:
+        已连接到设备的套接字是最精确的匹配, 不关闭时内核仍把该设备的包投递给它, 之后新建的DetData收不到
+        """
+        self.stop()
+        self._closed = True
+        if self._thread is not None:
+            # 接收线程在下一次select超时(最多2s)内退出
+            self._thread.join(5)
+            if self._thread.is_alive():
+                logging.warning(f"接收线程({self._name})未能正常退出")
+            self._thread = None
+        if self._proc is not None:
+            # 接收进程在下一次select超时(最多2s)内退出
+            self._proc.join(5)
+            if self._proc.is_alive():
+                logging.warning(f"接收进程({self._name})未能正常退出, 强制结束")
+                self._proc.terminate()
+                self._proc.join()
+            self._listenerC.join()
+            self._conn.close()
+            self._proc = None
+            for ring in list(self.rings.values()):
+                ring.close()
+        if self._process and not isinstance(self.counters, list):
+            # 共享内存已释放, 计数保留供throughput/stats读取
+            rx = self.counters
+            self.counters = list(rx)
+            rx.release()
+            self._rxShm.close()
+            self._rxShm.unlink()
+        if self.ip is not None:
+            self._s.close()
+
+    def _loopC(self, flag: list[bool]):
+        """接收进程转回的控制包, 心跳和命令确认"""
+        conn = self._conn
+        while flag[0]:
+            try:
+                if not conn.poll(2):
+                    continue
+                msg = conn.recv()
+            except (EOFError, OSError):
+                if flag[0]:
+                    logging.error(f"接收进程({self._name})意外退出")
+                break
+            match msg:
+                case ("ctrl", ip, data):
+                    self._onCtrl(ip, data)
+                case ("beat", ip, t):
+                    if self._onBeat is not None:
+                        self._onBeat(ip, t)
+                case ("ack", ip):
+                    self._acks.put(ip)
+                case ("capAck", err):
+                    self._capAcks.put(err)
+
+    def _sendRing(self, ip: str, ring: DetShmRing):
+        """接收进程映射(重新分配后的)共享环, 等待确认后才可释放旧内存"""
+        if self._proc is None:
+            return
+        with self._connLock:
+            self._conn.send(("ring", ip, ring.name(), ring._slots, ring.size()))
+        try:
+            self._acks.get(timeout=5)
+        except Empty:
+            logging.error(f"接收进程未确认设备({ip})的接收缓冲区")
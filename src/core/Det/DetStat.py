@@ -0,0 +1,34 @@
+import time
+
+
+class DetStat():
+    """
+    单设备接收计数, 接收线程与组帧各自只累加自己的字段, 读取时不加锁
+    packets/bytes: 收到的VPDT包, ctrl/heartbeat: 其中的控制包和心跳包
+    malformed: 长度/魔数/类型不正确的包, dLenErr: dLen与当前数据格式不符的数据包
+    gaps: 帧内/帧间序号跳跃的次数, reorders: 比之前已到达的包序号小的包数
+    late/dup/lost: 组帧时迟到/重复/最终缺失的包数
+    """
+    FIELDS = (
+        "packets", "bytes", "ctrl", "heartbeat", "malformed", "dLenErr",
+        "gaps", "reorders", "late", "dup", "lost",
+    )
+
+    def __init__(self):
+        for f in self.FIELDS:
+            setattr(self, f, 0)
+        self._mark = (time.perf_counter(), 0, 0)
+
+    def rate(self) -> tuple[float, float]:
+        """自上次调用以来的(包/秒, 比特/秒)"""
+        now = time.perf_counter()
+        (t, pkts, nbytes) = self._mark
+        self._mark = (now, self.packets, self.bytes)
+        dt = max(now - t, 1e-9)
+        return ((self.packets - pkts) / dt, (self.bytes - nbytes) * 8 / dt)
+
+    def snapshot(self) -> dict[str, int | float]:
+        (pps, bps) = self.rate()
+        d = {f: getattr(self, f) for f in self.FIELDS}
+        d.update(pps=pps, bps=bps)
+        return d
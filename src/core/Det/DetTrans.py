@@ -0,0 +1,225 @@
+import time
+import struct
+import logging
+import threading
+import itertools
+from collections import deque
+from queue import Queue
+
+# 控制包内容: 操作(0读/1写), 地址, 数据
+_REG = struct.Struct("<HHL")
+
+
+class TransError(Exception):
+    pass
+
+
+class DetRtt():
+    """
+    往返时延估计(RFC 6298): 第一个样本srtt = r, rttvar = r / 2, 之后rttvar以1/4, srtt以1/8平滑
+    rto = srtt + 4 * rttvar, 限制在[minRto, maxRto]内, 没有样本时为initRto
+    """
+
+    def __init__(self, initRto: float = 0.5, minRto: float = 0.05, maxRto: float = 2.0):
+        self.srtt = None
+        self.rttvar = None
+        self.last = None
+        self.samples = 0
+        self._initRto = initRto
+        self._minRto = minRto
+        self._maxRto = maxRto
+
+    def add(self, rtt: float):
+        if self.srtt is None:
+            (self.srtt, self.rttvar) = (rtt, rtt / 2)
+        else:
+            self.rttvar += (abs(self.srtt - rtt) - self.rttvar) / 4
+            self.srtt += (rtt - self.srtt) / 8
+        self.last = rtt
+        self.samples += 1
+
+    def measured(self) -> bool:
+        return self.srtt is not None
+
+    def rto(self) -> float:
+        if self.srtt is None:
+            return self._initRto
+        return min(self._maxRto, max(self._minRto, self.srtt + 4 * self.rttvar))
+
+
+class DetReq():
+    """单个寄存器事务, sent为首次发送时刻, tries为发送次数, 失败时error为原因"""
+    __slots__ = ("tag", "ctr", "addr", "data", "value", "done", "sent", "tries", "due", "error")
+
+    def __init__(self, tag: int, ctr: int, addr: int, data: int = 0):
+        self.tag = tag
+        self.ctr = ctr
+        self.addr = addr
+        self.data = data
+        self.value = None
+        self.done = False
+        self.sent = None
+        self.tries = 0
+        # 本次发送的超时时刻
+        self.due = None
+        self.error = None
+
+    def encode(self) -> bytes:
+        if self.ctr == 0:
+            return struct.pack("<HH", 0, self.addr)
+        return _REG.pack(1, self.addr, self.data)
+
+
+class DetTrans():
+    """
+    寄存器事务层, 每个请求分配递增标签, 以滑动窗口流水线发送
+    协议应答中没有标签字段, 以回显的地址(及操作)关联到该地址上最早的未完成请求
+    每个请求的超时为rto(按往返时延估计), 读取是幂等的, 超时后重发(超时依次加倍, 最多retries次),
+    写入(如启动寄存器)可能有副作用, 不重发; 重发过的请求不作为往返时延样本(Karn算法)
+    重发用尽或超过调用的timeout仍未完成的请求, error为失败原因
+    """
+
+    def __init__(self, ip: str, qT: Queue, window: int = 16, retries: int = 3):
+        self._ip = ip
+        self._qt = qT
+        self._window = window
+        self._retries = retries
+        self._pend: dict[int, deque[DetReq]] = {}
+        self._busy = 0
+        self._tag = itertools.count(1)
+        self._cond = threading.Condition()
+        self.rtt = DetRtt()
+        # 最近完成的请求的延迟(首次发送到完成, 含重发), 请求/重发/失败计数
+        self._lat: deque[float] = deque(maxlen=4096)
+        self._count = dict.fromkeys(("requests", "retries", "failed"), 0)
+
+    def read(self, addr: int) -> DetReq:
+        return DetReq(next(self._tag), 0, addr)
+
+    def write(self, addr: int, data: int) -> DetReq:
+        return DetReq(next(self._tag), 1, addr, data)
+
+    def feed(self, data: memoryview):
+        """接收线程调用, 分发控制应答"""
+        with self._cond:
+            if self._match(data) is not None:
+                self._cond.notify_all()
+
+    def _match(self, data: memoryview) -> DetReq | None:
+        """应答关联到该地址上最早的未完成请求并完成它, 过期/重复/格式不符的应答返回None"""
+        if len(data) != _REG.size:
+            return None
+        (flag, addr, value) = _REG.unpack(data)
+        q = self._pend.get(addr)
+        if not q:
+            return None
+        req = next((r for r in q if r.ctr == flag), q[0])
+        q.remove(req)
+        req.value = value
+        req.done = True
+        self._busy -= 1
+        now = time.monotonic()
+        if req.tries == 1:
+            self.rtt.add(now - req.sent)
+        self._lat.append(now - req.sent)
+        return req
+
+    def _transmit(self, req: DetReq, now: float):
+        if req.tries == 0:
+            req.sent = now
+            self._count["requests"] += 1
+        else:
+            self._count["retries"] += 1
+        # 读取的超时按发送次数加倍, 写入只发一次, 等待读取重发用尽的总时间
+        n = (1 << req.tries) if req.ctr == 0 else (2 << self._retries) - 1
+        req.due = now + self.rtt.rto() * n
+        req.tries += 1
+        self._put(req.encode())
+
+    def _put(self, data: bytes):
+        self._qt.put((self._ip, 1, data))
+
+    def _expire(self, reqs: list[DetReq], now: float, deadline: float) -> float:
+        """
+        处理到时的请求: 读取重发, 写入或重发用尽的放弃; 超过deadline的全部放弃
+        返回下一个到时时刻, 全部结束时为None
+        """
+        due = None
+        for req in reqs:
+            if req.done or req.error is not None:
+                continue
+            if req.sent is None:
+                # 窗口一直没有空位, 没有发出
+                req.error = "未发送"
+                self._count["failed"] += 1
+                continue
+            if now >= req.due or now >= deadline:
+                if req.ctr == 0 and req.tries <= self._retries and now < deadline:
+                    self._transmit(req, now)
+                else:
+                    self._fail(req, f"超时(发送{req.tries}次)")
+                    continue
+            due = req.due if due is None else min(due, req.due)
+        return due
+
+    def _fail(self, req: DetReq, error: str):
+        q = self._pend.get(req.addr)
+        if q and req in q:
+            q.remove(req)
+            self._busy -= 1
+        req.error = error
+        self._count["failed"] += 1
+
+    def run(self, reqs: list[DetReq], timeout: float = 2) -> list[DetReq]:
+        """发送并等待一组事务完成, 未完成的事务done为False, error为原因"""
+        return self.collect(reqs, self.submit(reqs, timeout))
+
+    def submit(self, reqs: list[DetReq], timeout: float = 2) -> float:
+        """只发送不等待应答(窗口满时等待空位), 返回交给collect的截止时间"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            for req in reqs:
+                if not self._cond.wait_for(lambda: self._busy < self._window, deadline - time.monotonic()):
+                    break
+                self._pend.setdefault(req.addr, deque()).append(req)
+                self._busy += 1
+                self._transmit(req, time.monotonic())
+        return deadline
+
+    def collect(self, reqs: list[DetReq], deadline: float) -> list[DetReq]:
+        """等待submit发出的事务完成, 期间重发超时的读取"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                due = self._expire(reqs, now, deadline)
+                if due is None:
+                    break
+                self._cond.wait(max(0.0, min(due, deadline) - now))
+            # 重发后窗口可能有空位
+            self._cond.notify_all()
+        self._report(reqs)
+        return reqs
+
+    def _report(self, reqs: list[DetReq]):
+        lost = [f"0x{r.addr:04X}({r.error})" for r in reqs if not r.done]
+        if lost:
+            logging.warning(f"设备({self._ip})寄存器事务失败: {', '.join(lost)}")
+
+    def stats(self) -> dict:
+        """
+        寄存器事务统计: 请求/重发/失败数, 最近请求延迟(首次发送到完成, 含重发)的p50/p99(秒),
+        往返时延估计srtt/rttvar和当前rto
+        """
+        with self._cond:
+            lat = sorted(self._lat)
+
+        def pct(q: float) -> float | None:
+            return lat[min(len(lat) - 1, int(q * len(lat)))] if lat else None
+        return {
+            **self._count,
+            "p50": pct(0.5),
+            "p99": pct(0.99),
+            "srtt": self.rtt.srtt,
+            "rttvar": self.rtt.rttvar,
+            "rto": self.rtt.rto(),
+        }
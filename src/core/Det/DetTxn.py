@@ -0,0 +1,78 @@
+import logging
+
+
+class DetTxn():
+    """
+    配置事务, 暂存期间Det的寄存器写入只记录不下发:
+    同一地址的多次写入合并为最后一次, 与影子寄存器相同的值不再下发,
+    提交时剩余写入作为一个流水线突发发送, 并给出每个寄存器的错误报告
+
+    with det.transaction() as txn:
+        det.DetectRegSet(0x0018, 0x600003FF)
+        det.setWinNum(4)
+        det.setWinRange(0, 0, 119)
+    txn.errors  # {addr: 原因}, 为空表示全部成功
+
+    同一线程中嵌套的事务并入外层事务, 由最外层退出时统一提交, errors与外层相同
+    """
+
+    def __init__(self, det, diff: bool = True):
+        self._det = det
+        self._diff = diff
+        self._items: dict[int, int] = {}
+        self.coalesced = 0
+        self.skipped: list[int] = []
+        self.sent: list[int] = []
+        self.errors: dict[int, str] = {}
+        # 并入的外层事务
+        self._outer: DetTxn | None = None
+
+    def set(self, addr: int, data: int) -> 'DetTxn':
+        if self._outer is not None:
+            self._outer.set(addr, data)
+            return self
+        if addr in self._items:
+            # 保留最后一次写入, 并按最后一次写入的顺序下发
+            del self._items[addr]
+            self.coalesced += 1
+        self._items[addr] = data
+        return self
+
+    def commit(self) -> dict[int, str]:
+        items = list(self._items.items())
+        self._items.clear()
+        if self._diff:
+            shadow = self._det.shadow
+            self.skipped = [addr for (addr, data) in items if shadow.get(addr) == data]
+            items = [(addr, data) for (addr, data) in items if addr not in self.skipped]
+        self.sent = [addr for (addr, _) in items]
+        # 原地清空, 并入的内层事务共享同一个errors
+        self.errors.clear()
+        self._det._regBurst(writes=items, errors=self.errors)
+        if self.errors:
+            logging.error(f"设备({self._det._ip})配置事务失败: {self.errors}")
+        else:
+            logging.debug(f"设备({self._det._ip})配置事务完成, 下发{len(self.sent)}个, "
+                          f"跳过{len(self.skipped)}个, 合并{self.coalesced}个")
+        return self.errors
+
+    def __enter__(self) -> 'DetTxn':
+        outer = getattr(self._det._txnLocal, "txn", None)
+        if outer is not None:
+            self._outer = outer
+            self.errors = outer.errors
+            return self
+        self._det._txnLocal.txn = self
+        return self
+
+    def __exit__(self, excType, exc, tb):
+        if self._outer is not None:
+            # 内层不提交, 异常照常向外传递
+            self._outer = None
+            return False
+        self._det._txnLocal.txn = None
+        if excType is None:
+            self.commit()
+        else:
+            self._items.clear()
+        return False
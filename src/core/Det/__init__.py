@@ -1,2 +1,7 @@
 from .Det import Det
 from .DetData import DetData
+from .DetFrames import DetFrames
+from .DetAio import DetAio, DetAioData
+from .DetGroup import DetGroup
+from .DetReplay import DetReplay
+from .DetLink import DetLink
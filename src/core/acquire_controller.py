@@ -2,7 +2,7 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import threading
-from core.AcqFunc.AcqFunc import histAcqNoMove, saveHist, showHist
+from core.AcqFunc.AcqFunc import histAcqNoMove, saveHist, showHist, _acqCnt
 import traceback
 
 
@@ -99,6 +99,11 @@ class AcquisitionController:
                     raise RuntimeError("未连接探测器（离线模式）")
 
                 det = self.det_ctrl.det.det  # 注意两层 det：controller.det -> interface.det
+                acq_cnt = _acqCnt(None, duration, int(interval))
+                if acq_cnt < 1:
+                    if callback:
+                        callback("[ERROR]", f"采集时长 {duration}s 小于一个采样间隔, 没有可采集的帧")
+                    return
                 win_id, win_low, win_high = win_params
 
                 # 设置窗口范围
@@ -108,9 +113,19 @@ class AcquisitionController:
                 if callback:
                     callback("[RUNNING]", f"开始采集: WinRange({win_id}, {win_low}, {win_high})")
 
-                # 执行采集
-                data = histAcqNoMove(det, cnt=None, time=duration, interval=int(interval))
+                # 执行采集, 每采集约10%反馈一次进度
+                reported = [0]
+
+                def progress(done, total):
+                    if callback and done * 10 // total != reported[0] * 10 // total:
+                        callback("[RUNNING]", f"已采集 {done}/{total} 帧")
+                    reported[0] = done
+
+                data = histAcqNoMove(det, cnt=acq_cnt, interval=int(interval), progress=progress)
                 self.last_data = data
+                stat = det.acqStats()
+                if callback and stat.get("lostPackets"):
+                    callback("[WARN]", f"丢包 {stat['lostPackets']} 个, 不完整帧 {stat['lostFrames']}/{stat['frames']}")
 
                 # 保存结果
                 saveHist(data, file_path, None)
@@ -1,17 +1,25 @@
 # core/det_interface.py
-from core.Det import DetData
+from core.Det import DetData, DetGroup
 
 class DetInterface:
     """封装 DetData 的硬件操作接口"""
 
-    def __init__(self, ip: str):
-        """连接指定 IP 的探测器"""
-        srv = DetData(ip)
-        dets = srv.findDet()
+    def __init__(self, ip: str, process: bool = False, shard: bool = False, known: list[str] = None):
+        """
+        经本机地址 ip 连接探测器, process 为 True 时在独立进程中收包(可选), 界面绘图/保存不会造成丢包
+        shard 为 True 时每台探测器各有一个接收进程(多板时各板的数据流在不同的核上接收)
+        known 为上次连接的探测器地址, 先单播查询, 全部应答后立即返回, 否则按广播查找的结果
+        """
+        srv = DetData(ip, process=process, shard=shard)
+        known = list(known or ())
+        dets = srv.findDet(expect=known or None, hint=known)
         if not dets:
             raise ConnectionError(f"未在 {ip} 找到探测器")
-        self.det = list(dets.values())[0]
-        srv.listen()
+        (self.ip, self.det) = list(dets.items())[0]
+        # 找到的全部设备, 多板同步采集使用 group
+        self.dets = dets
+        self.group = DetGroup(dets.values())
+        self.srv = srv.listen()
 
     # -------------------- 状态信息 --------------------
     def get_status(self):
@@ -21,12 +29,26 @@ class DetInterface:
         # d.update(self.det.statusPower())
         # d.update(self.det.statusFanSpeed())
         
+        status = self.det.status(0.0375)
         return {
-            "温度": self.det.statusTemperature(),
-            "位置": self.det.statusPosition(0.0375),
-            "电源": self.det.statusPower(),
-            "开关": self.det.statusPowerSwitch(),
-            "风扇": self.det.statusFanSpeed(),
+            "温度": status["temperature"],
+            "位置": status["position"],
+            "电源": status["power"],
+            "开关": status["powerSwitch"],
+            "风扇": status["fanSpeed"],
+        }
+
+    def get_net_stats(self):
+        """
+        接收统计(包速率/丢包/乱序/缓冲区积压等), 链路状态(在线/心跳/往返时延)
+        和寄存器事务统计(重发/失败/延迟分位数), 采集中可随时调用
+        """
+        stats = self.srv.stats()
+        return {
+            **stats["device"].get(self.ip, {}),
+            **stats["socket"],
+            "link": stats["link"].get(self.ip),
+            "reg": stats["reg"].get(self.ip),
         }
 
     # -------------------- 参数设置 --------------------
@@ -42,3 +64,11 @@ class DetInterface:
         """更新探测参数"""
         for k, v in params.items():
             self.det.detParam[k] = v
+
+    def apply_config(self, pos_cfgs, power_dict, params) -> dict[int, str]:
+        """位置/电源/探测参数作为一个配置事务下发, 返回失败的寄存器"""
+        with self.det.transaction() as txn:
+            self.set_position_config(pos_cfgs)
+            self.set_power_switch(power_dict)
+            self.update_detector_params(params)
+        return txn.errors
@@ -15,14 +15,22 @@ class DetectorController:
     def __init__(self):
         self.det = None
         self.offline = True
+        self.link_callback = None
 
     # ---------------------------------------------------------
-    def connect(self, ip: str, callback=None):
-        """连接设备 (异步执行)"""
+    def connect(self, ip: str, callback=None, link_callback=None, known=None, process: bool = False):
+        """
+        连接设备 (异步执行), known 为上次连接的探测器地址, 先单播查询, 全部应答即完成查找
+        process 为 True 时在独立进程中收包
+        连接后按心跳/应答检测在线状态, 掉线或恢复时更新 offline 并调用 link_callback(online, msg)
+        """
+        self.link_callback = link_callback
+
         def run():
             try:
-                self.det = DetInterface(ip)
+                self.det = DetInterface(ip, process=process, known=known)
                 self.offline = False
+                self.det.srv.onLinkChange(self._on_link_change)
                 if callback:
                     callback(True, f"成功连接到 {ip}")
             except Exception as e:
@@ -32,6 +40,14 @@ class DetectorController:
                     callback(False, f"连接失败：{e}")
         threading.Thread(target=run, daemon=True).start()
 
+    def _on_link_change(self, ip: str, online: bool):
+        """链路监视线程中调用, 只跟踪主设备"""
+        if self.det is None or ip != self.det.ip:
+            return
+        self.offline = not online
+        if self.link_callback:
+            self.link_callback(online, f"{ip} {'已恢复在线' if online else '无响应, 已离线'}")
+
     # ---------------------------------------------------------
     def get_status(self, callback=None):
         """读取设备状态 (异步)"""
@@ -59,10 +75,12 @@ class DetectorController:
 
         def run():
             try:
-                self.det.set_position_config(pos_cfgs)
-                self.det.set_power_switch(power_dict)
-                self.det.update_detector_params(det_params)
-                if callback:
+                errors = self.det.apply_config(pos_cfgs, power_dict, det_params)
+                if errors:
+                    failed = ", ".join(f"0x{addr:04X}({err})" for addr, err in errors.items())
+                    if callback:
+                        callback(False, f"参数应用失败: {failed}")
+                elif callback:
                     callback(True, "所有参数已成功应用。")
             except Exception as e:
                 if callback:
@@ -2,7 +2,7 @@
 from PySide6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QGroupBox,
     QPushButton, QTextEdit, QLabel, QLineEdit,
-    QFormLayout, QSpinBox
+    QFormLayout, QSpinBox, QCheckBox
 )
 from PySide6.QtCore import QSettings
 from core.detector_controller import DetectorController
@@ -26,10 +26,14 @@ class ConnectTab(QWidget):
         self.ip_edit.setPlaceholderText("例如：10.20.22.230")
         self.settings = QSettings("ScanGUI", "DetectorApp")
         self.ip_edit.setText(self.settings.value("last_ip", "10.20.22.230"))
+        # 独立进程收包, 界面绘图/保存时不丢包, 默认关闭
+        self.chk_process = QCheckBox("独立接收进程")
+        self.chk_process.setChecked(self.settings.value("recv_process", False, type=bool))
         self.btn_connect = QPushButton("连接探测器")
         self.btn_connect.clicked.connect(self.connect_device)
         ip_layout.addWidget(QLabel("设备 IP："))
         ip_layout.addWidget(self.ip_edit)
+        ip_layout.addWidget(self.chk_process)
         ip_layout.addWidget(self.btn_connect)
         main_layout.addLayout(ip_layout)
 
@@ -111,15 +115,26 @@ class ConnectTab(QWidget):
         if not ip:
             self.log_box.append("[ERROR] IP 地址不能为空。")
             return
+        process = self.chk_process.isChecked()
         self.settings.setValue("last_ip", ip)
+        self.settings.setValue("recv_process", process)
         self.settings.sync()
         self.log_box.append(f"[INFO] 正在连接 {ip} ...")
-        self.controller.connect(ip, self._on_connect_result)
+        # 上次找到的探测器地址, 重新连接时不必等待广播查找结束
+        known = self.settings.value("last_dets", [], type=list)
+        self.controller.connect(ip, self._on_connect_result, self._on_link_change, known, process)
 
     def _on_connect_result(self, success, msg):
+        if success:
+            self.settings.setValue("last_dets", list(self.controller.det.dets))
+            self.settings.sync()
         self.status_label.setText(f"当前状态：{'已连接' if success else '离线模式'}")
         self.log_box.append(f"[{'INFO' if success else 'ERROR'}] {msg}")
 
+    def _on_link_change(self, online, msg):
+        self.status_label.setText(f"当前状态：{'已连接' if online else '离线模式'}")
+        self.log_box.append(f"[{'INFO' if online else 'WARN'}] {msg}")
+
     # ---------------------------------------------------------
     def get_status(self):
         self.log_box.append("[INFO] 正在读取状态...")
@@ -0,0 +1,40 @@
+# tests/caps.py
+# 测试用的抓包: 按模拟器(tools.det_sim)的包格式合成能谱模式的采集, 经DetReplay回放, 不需要网络
+# 每个包的data[0]为(idx + frame) & 0xFFFF, 能窗0为[0, 119], 不带包头字段
+import struct
+import numpy as np
+from core.Det.Det import Det
+from core.Det.DetData import DetData
+from core.Det.DetCap import writeCap
+
+MODEL = "D80"
+PER = Det.getModelRef()[MODEL]["pixNum"]
+DTYPE = Det.histDataType((0, 119))()
+
+
+def reply(addr: int, value: int) -> bytes:
+    """读取应答"""
+    return b"VPDT" + struct.pack("<LHHL", 1, 0, addr, value)
+
+
+def packets(frames) -> list[bytes]:
+    """frames中每帧的全部数据包"""
+    frames = np.asarray(list(frames), dtype=np.uint32)
+    pkt = np.zeros((len(frames), PER), dtype=DTYPE)
+    pkt["frame"] = frames[:, None]
+    pkt["idx"] = np.arange(PER)
+    pkt["dLen"] = int(np.prod(DTYPE["data"].shape))
+    pkt["data"][:, :, 0] = (np.arange(PER)[None, :] + frames[:, None]) & 0xFFFF
+    head = b"VPDT" + struct.pack("<L", 2)
+    return [head + row.tobytes() for row in pkt.reshape(-1)]
+
+
+def writeAcq(path: str, frames: dict[str, list[int]]):
+    """写入一次采集的抓包: 各设备的型号和格式寄存器应答, 之后为frames[ip]中各帧的数据包"""
+    recs = []
+    for ip in frames:
+        recs += [(ip, 7493, data) for data in DetData._findReplies(MODEL)]
+        recs += [(ip, 7493, reply(0x0021, 119 << 16)), (ip, 7493, reply(0x0018, 0))]
+    for (ip, fs) in frames.items():
+        recs += [(ip, 7493, data) for data in packets(fs)]
+    writeCap(path, recs)
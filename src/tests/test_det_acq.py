@@ -0,0 +1,54 @@
+# tests/test_det_acq.py
+# Det的分段采集: 段内帧号以设备启动后的0为起点, 开头整帧丢失时该帧为无效帧, 之后的帧号和子帧合并不错位
+# 单帧超过寄存器上限时拆成等长子帧, 无法等分时报错
+#   cd src && python -m pytest tests
+import numpy as np
+import pytest
+from core.Det.Det import Det
+from core.Det.DetReplay import DetReplay
+from caps import writeAcq, PER
+
+IP = "10.0.0.2"
+
+
+def _replay(tmp_path, frames: dict[str, list[int]]) -> DetReplay:
+    path = str(tmp_path / "acq.vpcap")
+    writeAcq(path, frames)
+    return DetReplay(path, speed=None).listen()
+
+
+def test_leading_frame_lost(tmp_path):
+    srv = _replay(tmp_path, {IP: range(1, 300)})
+    try:
+        data = srv.findDet()[IP].histAcq(300, 50)
+    finally:
+        srv.close()
+    np.testing.assert_array_equal(data.head["frame"], np.arange(300))
+    assert not data.valid[0].any() and data.valid[1:].all()
+    # 之后的帧内容与帧号一致
+    first = data["data"][:, :, 0].astype(np.int64)
+    np.testing.assert_array_equal(first[1:], np.arange(1, 300)[:, None] + np.arange(PER)[None, :])
+
+
+def test_leading_subframe_lost(tmp_path):
+    # 单帧超过寄存器上限, 每帧由2个子帧组成; 第一个子帧丢失只影响第一帧
+    srv = _replay(tmp_path, {IP: range(1, 600)})
+    try:
+        data = srv.findDet()[IP].histAcq(300, 131070)
+    finally:
+        srv.close()
+    np.testing.assert_array_equal(data.head["frame"], np.arange(300))
+    assert not data.valid[0].any() and data.valid[1:].all()
+    # 合并后为2f和2f+1两个子帧之和
+    first = data["data"][:, :, 0].astype(np.int64)
+    f = np.arange(1, 300)[:, None]
+    np.testing.assert_array_equal(first[1:], 2 * np.arange(PER)[None, :] + 4 * f + 1)
+
+
+def test_split_intr():
+    assert Det._splitIntr(10000) == (1, 10000)
+    assert Det._splitIntr(131070) == (2, 65535)
+    assert Det._splitIntr(131073) == (3, 43691)
+    # 无法等分时不缩短采集时间
+    with pytest.raises(ValueError):
+        Det._splitIntr(65537)
@@ -0,0 +1,101 @@
+# tests/test_det_asm.py
+# DetAsm组帧: 包按(frame, idx)放置, 与到达顺序无关
+#   cd src && python -m pytest tests
+import numpy as np
+from core.Det.Det import Det
+from core.Det.DetAsm import DetAsm
+
+PER = 4
+DTYPE = Det.histDataType((0, 7))()
+
+
+def _packets(frames, idx=None) -> tuple[np.ndarray, np.ndarray]:
+    """frames中每个帧号的包, idx为None时为整帧的全部包, 否则为对应的包序号"""
+    frames = np.asarray(frames, dtype=np.int64)
+    if idx is None:
+        (frames, idx) = (np.repeat(frames, PER), np.tile(np.arange(PER), len(frames)))
+    rows = np.zeros((len(frames), 8 + DTYPE.itemsize), dtype=np.uint8)
+    pkt = rows[:, 8:].view(DTYPE)[:, 0]
+    pkt["frame"] = frames & 0xFFFFFFFF
+    pkt["idx"] = idx
+    pkt["dLen"] = 8
+    pkt["data"][:, 0] = frames & 0xFFFF
+    pkt["data"][:, 1] = idx
+    return (np.full(len(rows), rows.shape[1]), rows)
+
+
+def test_far_late_packet_before_take():
+    # 产出前已收到帧环末端的帧, 再到一个更早的包: 没有可用的起点时保持当前起点, 不抛出异常
+    asm = DetAsm("a", DTYPE, DTYPE, PER, 8, horizon=2)
+    asm.feed(*_packets([0]))
+    asm.feed(*_packets([9]))
+    asm.feed(*_packets([-9], [0]))
+    assert asm.stats()["late"] == 1
+    out = asm.take(8)
+    assert asm.first == 0
+    np.testing.assert_array_equal(out.head["frame"], np.arange(8))
+    assert out.valid[0].all() and not out.valid[1:].any()
+
+
+def _asm(start: int = 0) -> DetAsm:
+    asm = DetAsm("a", DTYPE, DTYPE, PER, 16, horizon=2)
+    asm.reset(start)
+    return asm
+
+
+def _check(out, frames):
+    """有效的包内容与其帧号/包序号一致"""
+    np.testing.assert_array_equal(out.head["frame"], np.asarray(frames) & 0xFFFFFFFF)
+    data = out.data[:, :, :2].astype(np.int64)
+    expect = np.stack(np.broadcast_arrays((np.asarray(frames) & 0xFFFF)[:, None], np.arange(PER)[None, :]), -1)
+    np.testing.assert_array_equal(data[out.valid], expect[out.valid])
+
+
+def test_loss():
+    asm = _asm()
+    (lens, rows) = _packets(range(12))
+    # 丢失第3帧整帧和第5帧的一个包
+    drop = {3 * PER + i for i in range(PER)} | {5 * PER + 2}
+    keep = [i for i in range(len(rows)) if i not in drop]
+    asm.feed(lens[keep], rows[keep])
+    assert asm.ready(8)
+    out = asm.take(8)
+    _check(out, range(8))
+    assert not out.valid[3].any() and not out.valid[5, 2]
+    assert out.valid.sum() == 8 * PER - PER - 1
+    assert (asm.stats()["lostFrames"], asm.stats()["lostPackets"]) == (2, PER + 1)
+
+
+def test_reorder():
+    asm = _asm()
+    (lens, rows) = _packets(range(10))
+    order = np.random.default_rng(1).permutation(len(rows))
+    asm.feed(lens[order], rows[order])
+    out = asm.take(8)
+    _check(out, range(8))
+    assert out.valid.all()
+
+
+def test_duplicate_and_late():
+    asm = _asm()
+    asm.feed(*_packets(range(10)))
+    asm.feed(*_packets([4], [1]))
+    assert asm.stats()["dup"] == 1
+    out = asm.take(8)
+    _check(out, range(8))
+    assert out.valid.all()
+    # 已产出的帧的包为迟到包
+    asm.feed(*_packets([2]))
+    assert asm.stats()["late"] == PER
+    _check(asm.take(2), range(8, 10))
+
+
+def test_wrap():
+    # 帧号越过uint32上限后回绕
+    start = 0xFFFFFFFC
+    asm = _asm(start)
+    frames = np.arange(start, start + 12)
+    asm.feed(*_packets(frames))
+    out = asm.take(8)
+    _check(out, frames[:8])
+    assert out.valid.all() and asm.first == start
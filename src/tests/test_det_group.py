@@ -0,0 +1,84 @@
+# tests/test_det_group.py
+# DetGroup按帧号对齐: 一台设备丢失第一帧时, 各设备同一位置仍为同一帧号
+#   cd src && python -m pytest tests
+import numpy as np
+from core.Det.Det import Det
+from core.Det.DetAsm import DetAsm
+from core.Det.DetGroup import DetGroup
+from core.Det.DetReplay import DetReplay
+from caps import writeAcq
+
+PER = 4
+DTYPE = Det.histDataType((0, 7))()
+
+
+class _FakeDet():
+    """按DetAsm组帧产出帧流的设备, drop中的设备帧号不发送"""
+
+    def __init__(self, ip: str, drop=()):
+        self._ip = ip
+        self._drop = set(drop)
+
+    def armBurst(self, writes=(), reads=(), cached=True):
+        return None
+
+    def fireBurst(self, burst):
+        return None
+
+    def waitBurst(self, burst, token, errors=None):
+        return []
+
+    def _packets(self, frames) -> tuple[np.ndarray, np.ndarray]:
+        frames = [f for f in frames if f not in self._drop]
+        rows = np.zeros((len(frames) * PER, 8 + DTYPE.itemsize), dtype=np.uint8)
+        pkt = rows[:, 8:].view(DTYPE)[:, 0]
+        pkt["frame"] = np.repeat(frames, PER)
+        pkt["idx"] = np.tile(np.arange(PER), len(frames))
+        pkt["dLen"] = 8
+        pkt["data"][:, 0] = pkt["frame"]
+        return (np.full(len(rows), rows.shape[1]), rows)
+
+    def histStream(self, num, intr=10000, chunk=64, start=None):
+        start()
+        asm = DetAsm(self._ip, DTYPE, DTYPE, PER, 2 * chunk, horizon=2)
+        asm.reset(0)
+        # 多发horizon帧, 使最后一块可以产出
+        asm.feed(*self._packets(range(num + 2)))
+        for c0 in range(0, num, chunk):
+            yield asm.take(min(chunk, num - c0))
+
+
+def test_first_frame_dropped():
+    group = DetGroup([_FakeDet("a"), _FakeDet("b", drop=[0])])
+    data = group.histAcq(100, 100)
+    (a, b) = (data["a"], data["b"])
+    assert len(a) == len(b) == 100
+    np.testing.assert_array_equal(a.head["frame"], np.arange(100))
+    np.testing.assert_array_equal(b.head["frame"], np.arange(100))
+    # 丢失的第一帧补为无效帧, 之后的帧内容与帧号一致
+    assert not b.valid[0].any()
+    assert b.valid[1:].all() and a.valid.all()
+    np.testing.assert_array_equal(b.data[1:, :, 0], np.arange(1, 100)[:, None].repeat(PER, axis=1))
+
+
+def test_frame_offsets():
+    assert DetGroup.frameOffsets({"a": 0, "b": 1}) == {"a": 0, "b": 1}
+    assert DetGroup.frameOffsets({"a": 0xFFFFFFFF, "b": 0}) == {"a": 0, "b": 1}
+    assert DetGroup.frameOffsets({"a": 0, "b": 4}, k=4) == {"a": 0, "b": 1}
+    assert DetGroup.frameOffsets({"a": 0, "b": 1000}, limit=64) == {"a": 0, "b": 0}
+
+
+def test_first_frame_lost_replay(tmp_path):
+    # 经DetData接收的两台设备, b丢失第一帧
+    path = str(tmp_path / "group.vpcap")
+    writeAcq(path, {"10.0.0.2": range(300), "10.0.0.3": range(1, 300)})
+    srv = DetReplay(path, speed=None).listen()
+    try:
+        data = DetGroup(srv.findDet().values()).histAcq(300, 50)
+    finally:
+        srv.close()
+    (a, b) = (data["10.0.0.2"], data["10.0.0.3"])
+    np.testing.assert_array_equal(a.head["frame"], np.arange(300))
+    np.testing.assert_array_equal(b.head["frame"], np.arange(300))
+    assert a.valid.all()
+    assert not b.valid[0].any() and b.valid[1:].all()
@@ -0,0 +1,37 @@
+# tests/test_det_replay.py
+# 抓包回放: 模拟器采集时抓包, 回放同一采集得到逐帧相同的结果
+#   cd src && python -m pytest tests
+import numpy as np
+from core.Det import DetData
+from core.Det.DetReplay import DetReplay
+from tools.det_sim import DetSim
+
+SIM = "127.0.0.232"
+
+
+def test_capture_replay(tmp_path):
+    sim = DetSim(SIM, heartbeat=0, speed=2)
+    try:
+        srv = DetData("127.0.0.1", port=7782)
+        try:
+            det = srv.findDet(expect=[SIM], hint=[SIM], quiet=1.0, timeout=3)[SIM]
+            srv.listen()
+            det.setWinRange(0, 0, 119)
+            paths = srv.capture(str(tmp_path / "acq.vpcap"))
+            live = det.histAcq(300, 50)
+            srv.capture(None)
+        finally:
+            srv.close()
+    finally:
+        sim.close()
+    rep = DetReplay(paths, speed=None).listen()
+    try:
+        dets = rep.findDet()
+        assert dets[SIM].model == det.model
+        replay = dets[SIM].histAcq(300, 50)
+    finally:
+        rep.close()
+    assert live.valid.all()
+    np.testing.assert_array_equal(replay.head, live.head)
+    np.testing.assert_array_equal(replay.valid, live.valid)
+    np.testing.assert_array_equal(replay.data, live.data)
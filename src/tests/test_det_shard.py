@@ -0,0 +1,26 @@
+# tests/test_det_shard.py
+# 设备分片(shard=True)关闭后重新连接: 分片的套接字已关闭, 新的DetData能查找设备并收到数据
+#   cd src && python -m pytest tests
+from core.Det import DetData
+from tools.det_sim import DetSim
+
+SIM = "127.0.0.231"
+
+
+def _connect(port: int) -> DetData:
+    srv = DetData("127.0.0.1", port=port, shard=True)
+    dets = srv.findDet(expect=[SIM], hint=[SIM], quiet=1.0, timeout=3)
+    assert list(dets) == [SIM]
+    srv.listen()
+    data = dets[SIM].histAcq(20, 10)
+    assert len(data) == 20 and data.valid.all()
+    return srv
+
+
+def test_reconnect_after_close():
+    sim = DetSim(SIM, heartbeat=0, speed=None)
+    try:
+        _connect(7781).close()
+        _connect(7781).close()
+    finally:
+        sim.close()
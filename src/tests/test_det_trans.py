@@ -0,0 +1,126 @@
+# tests/test_det_trans.py
+# 寄存器事务: 读取丢失后重发, 重发用尽记为失败; 嵌套的配置事务并入外层, 0x41/0x49每次都下发
+#   cd src && python -m pytest tests
+import struct
+import itertools
+import threading
+from queue import Queue, Empty
+from core.Det.Det import Det
+from core.Det.DetTrans import DetTrans, DetRtt
+
+_REG = struct.Struct("<HHL")
+
+
+class _Dev():
+    """应答DetTrans发出的控制包的设备, lose(第几个包, 从0开始)为True时不应答"""
+
+    def __init__(self, lose=lambda i: False):
+        self.trans = DetTrans("x", Queue(), retries=2)
+        self.trans.rtt = DetRtt(initRto=0.02, minRto=0.02)
+        self.writes: list[tuple[int, int]] = []
+        self._lose = lose
+        self._regs: dict[int, int] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        for i in itertools.count():
+            if self._stop.is_set():
+                return
+            try:
+                (_, _, data) = self.trans._qt.get(timeout=0.05)
+            except Empty:
+                continue
+            if len(data) == _REG.size:
+                (_, addr, value) = _REG.unpack(data)
+                self.writes.append((addr, value))
+                self._regs[addr] = value
+                reply = _REG.pack(1, addr, value)
+            else:
+                (_, addr) = struct.unpack("<HH", data)
+                reply = _REG.pack(0, addr, self._regs.get(addr, addr))
+            if not self._lose(i):
+                self.trans.feed(memoryview(reply))
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def test_read_retry():
+    # 第一次发送丢失, 重发后完成
+    dev = _Dev(lose=lambda i: i == 0)
+    try:
+        trans = dev.trans
+        reqs = trans.run([trans.read(0x0010)], timeout=2)
+    finally:
+        dev.close()
+    assert reqs[0].done and reqs[0].value == 0x0010 and reqs[0].tries == 2
+    stats = trans.stats()
+    assert (stats["requests"], stats["retries"], stats["failed"]) == (1, 1, 0)
+    # 重发过的请求不作为往返时延样本
+    assert trans.rtt.samples == 0
+
+
+def test_read_retries_exhausted():
+    dev = _Dev(lose=lambda i: True)
+    try:
+        trans = dev.trans
+        reqs = trans.run([trans.read(0x0010)], timeout=2)
+    finally:
+        dev.close()
+    assert not reqs[0].done and reqs[0].error == "超时(发送3次)"
+    stats = trans.stats()
+    assert (stats["requests"], stats["retries"], stats["failed"]) == (1, 2, 1)
+
+
+def test_write_not_retried():
+    dev = _Dev(lose=lambda i: True)
+    try:
+        trans = dev.trans
+        reqs = trans.run([trans.write(0x0011, 1)], timeout=2)
+    finally:
+        dev.close()
+    assert not reqs[0].done and reqs[0].tries == 1
+    assert dev.writes == [(0x0011, 1)]
+
+
+def _det(dev: _Dev) -> Det:
+    return Det("x").addQueue((dev.trans, None))
+
+
+def test_nested_transaction():
+    dev = _Dev()
+    det = _det(dev)
+    try:
+        with det.transaction() as outer:
+            det.DetectRegSet(0x0014, 1)
+            with det.transaction() as inner:
+                det.DetectRegSet(0x0015, 2)
+                det.DetectRegSet(0x0014, 3)
+            # 内层退出时不下发
+            assert dev.writes == []
+            det.DetectRegSet(0x0020, 4)
+    finally:
+        dev.close()
+    assert inner.errors is outer.errors and outer.errors == {}
+    assert sorted(dev.writes) == [(0x0014, 3), (0x0015, 2), (0x0020, 4)]
+    assert outer.coalesced == 1
+
+
+def test_encoder_not_cached():
+    dev = _Dev()
+    det = _det(dev)
+    try:
+        for _ in range(2):
+            with det.transaction() as txn:
+                det.DetectRegSet(0x0041, 6)
+                det.DetectRegSet(0x0049, 6)
+                det.DetectRegSet(0x0014, 100)
+    finally:
+        dev.close()
+    # 0x14与影子相同, 第二次跳过; 编码器配置带清零位, 每次都下发
+    assert txn.skipped == [0x0014] and sorted(txn.sent) == [0x0041, 0x0049]
+    assert dev.writes.count((0x0041, 6)) == dev.writes.count((0x0049, 6)) == 2
+    assert dev.writes.count((0x0014, 100)) == 1
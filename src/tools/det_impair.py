@@ -0,0 +1,159 @@
+# tools/det_impair.py
+# 网络损伤代理: 放在设备(或tools.det_sim)与DetData之间, DetData把代理地址当作设备
+# 请求原样转给设备, 设备发来的包按设置丢弃/重复/乱序/加时延抖动/突发积压后转给DetData
+#   cd src && python -m tools.det_impair --ip 127.0.0.20 --dev 127.0.0.2 --loss 0.01 --reorder 0.05
+import time
+import heapq
+import random
+import select
+import socket
+import struct
+import logging
+import argparse
+import threading
+
+_HEAD = struct.Struct("<4sL")
+
+
+class DetImpair():
+    """
+    损伤代理, 默认只损伤数据包(id 2), ctrl=True时控制应答和心跳包也损伤
+    loss/dup/reorder: 每个包丢弃/重复/延后reorderDelay秒(落到之后的包后面)的概率
+    delay/jitter: 每个包的固定时延和均匀分布的附加时延(秒), 抖动也会造成乱序
+    burstEvery/burstHold: 每burstEvery秒积压burstHold秒内的全部包后一次放出, 用于冲满接收缓冲区
+    """
+
+    def __init__(
+        self, ip: str, devIp: str, loss: float = 0.0, dup: float = 0.0, reorder: float = 0.0,
+        reorderDelay: float = 0.002, delay: float = 0.0, jitter: float = 0.0,
+        burstEvery: float = 0.0, burstHold: float = 0.0, ctrl: bool = False, seed: int = 0
+    ):
+        self.ip = ip
+        self._dev = (devIp, 7493)
+        self._loss = loss
+        self._dup = dup
+        self._reorder = reorder
+        self._reorderDelay = reorderDelay
+        self._delay = delay
+        self._jitter = jitter
+        self._burstEvery = burstEvery
+        self._burstHold = burstHold
+        self._ctrl = ctrl
+        self._rng = random.Random(seed)
+        self.counts = dict.fromkeys(("forwarded", "dropped", "duplicated", "reordered", "bursts"), 0)
+        # 面向DetData的套接字冒充设备, 面向设备的套接字冒充DetData
+        self._front = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._front.bind((ip, 7493))
+        self._back = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._back.bind((ip, 0))
+        for s in (self._front, self._back):
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16 * 1024 * 1024)
+            s.setblocking(False)
+        self._host = None
+        self._run = True
+        # 待发送的包: (发送时刻, 序号, 数据)
+        self._pend: list[tuple[float, int, bytes]] = []
+        self._seq = 0
+        self._burstAt = time.monotonic() + burstEvery if burstEvery else None
+        threading.Thread(target=self._loop, name=f"DetImpair-{ip}", daemon=True).start()
+
+    def close(self):
+        self._run = False
+
+    def _impaired(self, data: bytes) -> bool:
+        if self._ctrl:
+            return True
+        return len(data) >= 8 and _HEAD.unpack_from(data)[1] == 2
+
+    def _schedule(self, now: float, data: bytes):
+        if not self._impaired(data):
+            self._push(now, data)
+            return
+        rng = self._rng
+        if self._loss and rng.random() < self._loss:
+            self.counts["dropped"] += 1
+            return
+        copies = 1
+        if self._dup and rng.random() < self._dup:
+            copies = 2
+            self.counts["duplicated"] += 1
+        for _ in range(copies):
+            t = now + self._delay
+            if self._jitter:
+                t += rng.random() * self._jitter
+            if self._reorder and rng.random() < self._reorder:
+                t += self._reorderDelay
+                self.counts["reordered"] += 1
+            hold = self._burstAt
+            if hold is not None and hold <= t < hold + self._burstHold:
+                # 积压期间的包在积压结束时一起放出
+                t = hold + self._burstHold
+            self._push(t, data)
+
+    def _push(self, t: float, data: bytes):
+        heapq.heappush(self._pend, (t, self._seq, data))
+        self._seq += 1
+
+    def _loop(self):
+        front = self._front
+        back = self._back
+        while self._run:
+            now = time.monotonic()
+            if self._burstAt is not None and now >= self._burstAt + self._burstHold:
+                self._burstAt += self._burstEvery
+                self.counts["bursts"] += 1
+            while self._pend and self._pend[0][0] <= now:
+                (_, _, data) = heapq.heappop(self._pend)
+                if self._host is not None:
+                    try:
+                        front.sendto(data, self._host)
+                        self.counts["forwarded"] += 1
+                    except OSError:
+                        # 本机发送缓冲区满, 按丢包处理
+                        self.counts["dropped"] += 1
+            wait = 0.05 if not self._pend else max(0.0, self._pend[0][0] - now)
+            (ready, _, _) = select.select((front, back), (), (), min(wait, 0.05))
+            if front in ready:
+                self._uplink()
+            if back in ready:
+                self._downlink()
+
+    def _uplink(self):
+        """DetData的请求转给设备, 记下DetData的地址"""
+        while True:
+            try:
+                (data, addr) = self._front.recvfrom(65536)
+            except BlockingIOError:
+                return
+            self._host = addr
+            self._back.sendto(data, self._dev)
+
+    def _downlink(self):
+        now = time.monotonic()
+        for _ in range(1024):
+            try:
+                (data, addr) = self._back.recvfrom(65536)
+            except BlockingIOError:
+                return
+            if addr == self._dev:
+                self._schedule(now, data)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    parser = argparse.ArgumentParser(description="VPDT网络损伤代理")
+    parser.add_argument("--ip", required=True, help="代理地址, DetData把它当作设备")
+    parser.add_argument("--dev", required=True, help="设备(或模拟器)地址")
+    for name in ("loss", "dup", "reorder", "delay", "jitter", "burstEvery", "burstHold"):
+        parser.add_argument(f"--{name}", type=float, default=0.0)
+    parser.add_argument("--ctrl", action="store_true", help="控制应答和心跳包也损伤")
+    args = parser.parse_args()
+    proxy = DetImpair(args.ip, args.dev, args.loss, args.dup, args.reorder, delay=args.delay, jitter=args.jitter,
+                      burstEvery=args.burstEvery, burstHold=args.burstHold, ctrl=args.ctrl)
+    logging.info(f"损伤代理{args.ip}:7493 -> {args.dev}:7493")
+    try:
+        while True:
+            time.sleep(5)
+            logging.info(f"损伤代理: {proxy.counts}")
+    except KeyboardInterrupt:
+        pass
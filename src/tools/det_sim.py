@@ -0,0 +1,234 @@
+# tools/det_sim.py
+# 本地VPDT探测器模拟器, 无需硬件即可测试DetData/Det的收包/组帧和吞吐
+# 在ip:7493上应答寄存器读写(含查找设备读取的地址0/1), 定时发送心跳包(id 3),
+# 写启动寄存器(0x11)后按histDataType/winDataType的格式发送能谱/阈值数据流
+# 每帧间隔为采集时间寄存器(0x14, 100us)除以speed, speed为None时尽快发送(超规格包率)
+# 每个包的data[0]为(idx + frame) & 0xFFFF, 便于核对; pos0h/pos1h每帧增加posStep
+#   cd src && python -m tools.det_sim --ip 127.0.0.2 --count 4 --pix 256 --speed 10
+import time
+import socket
+import struct
+import logging
+import argparse
+import threading
+import multiprocessing
+import numpy as np
+from core.Det.Det import Det
+
+_HEAD = struct.Struct("<4sL")
+_REG = struct.Struct("<HHL")
+# 包头寄存器(0x18)中的包头字段标志
+HEAD_INFO = 1 << 8
+HEAD_POS0 = 1 << 29
+HEAD_POS1 = 1 << 30
+
+
+class DetSim():
+    """
+    模拟一台设备, 控制/数据流/心跳各一个线程
+    数据发往最近一次寄存器请求的来源(与设备相同), host不为None时固定发往host
+    """
+
+    def __init__(
+        self, ip: str = "127.0.0.2", model: str = "D80", pixNum: int = None,
+        head: int = HEAD_INFO | HEAD_POS0 | HEAD_POS1, bins: int = 120,
+        speed: float | None = 1.0, heartbeat: float = 1.0, posStep: int = 10, host: tuple[str, int] = None
+    ):
+        param = dict(Det.getModelRef().get(model, Det.getModelRef()["D80"]))
+        if pixNum is not None:
+            param["pixNum"] = pixNum
+        self.param = param
+        self.speed = speed
+        self.posStep = posStep
+        self._host = host
+        # 最近一次寄存器请求的来源
+        self._to = None
+        self._heartbeat = heartbeat
+        name = model.encode("ascii").ljust(8, b"\x00")
+        self.reg = {
+            0x0000: struct.unpack("<L", name[:4])[0],
+            0x0001: struct.unpack("<L", name[4:8])[0],
+            0x0013: 0x01,
+            0x0014: 10000,
+            0x0015: 1,
+            0x0018: head,
+            0x0020: param["winNum"] - 1,
+            0x0080: 2,
+            0x0092: 3,
+        }
+        for win in range(param["winNum"]):
+            self.reg[0x0021 + win] = ((win + 1) * bins - 1) << 16 | win * bins
+        # 发出的数据包数/帧数
+        self.packets = 0
+        self.frames = 0
+        self._run = True
+        self._acq = None
+        self._acqStop = threading.Event()
+        self._lock = threading.Lock()
+        self._s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._s.bind((ip, 7493))
+        self._s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 16 * 1024 * 1024)
+        self._s.settimeout(0.5)
+        self.ip = ip
+        threading.Thread(target=self._loopC, name=f"DetSim-{ip}", daemon=True).start()
+        if heartbeat:
+            threading.Thread(target=self._loopH, daemon=True).start()
+
+    def close(self):
+        self._run = False
+        self._acqStop.set()
+
+    def _loopC(self):
+        while self._run:
+            try:
+                (data, addr) = self._s.recvfrom(2048)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if len(data) < 12:
+                continue
+            (hd, id) = _HEAD.unpack_from(data)
+            if hd != b"VPDT" or id != 1:
+                continue
+            self._to = addr
+            (ctr, addr_) = struct.unpack_from("<HH", data, 8)
+            if ctr == 1 and len(data) >= 16:
+                value = struct.unpack_from("<L", data, 12)[0]
+                self.reg[addr_] = value
+                self._s.sendto(data[:8] + _REG.pack(1, addr_, value), addr)
+                if addr_ == 0x0011:
+                    self._start(value)
+            else:
+                self._s.sendto(data[:8] + _REG.pack(0, addr_, self.reg.get(addr_, 0)), addr)
+
+    def _dst(self) -> tuple[str, int] | None:
+        return self._host if self._host is not None else self._to
+
+    def _loopH(self):
+        n = 0
+        while self._run:
+            time.sleep(self._heartbeat)
+            dst = self._dst()
+            if dst is not None:
+                self._s.sendto(_HEAD.pack(b"VPDT", 3) + struct.pack("<L", n), dst)
+                n += 1
+
+    def _start(self, value: int):
+        """写1启动一次采集(正在进行的采集先停止), 写0停止"""
+        with self._lock:
+            if self._acq is not None:
+                self._acqStop.set()
+                self._acq.join()
+                self._acq = None
+            if value:
+                self._acqStop = threading.Event()
+                self._acq = threading.Thread(target=self._stream, args=(self._acqStop,), daemon=True)
+                self._acq.start()
+
+    def _packets(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        按当前寄存器构造一帧的全部包, 每行为VPDT包头加包内容, 第0个包(包头包)单独一行
+        返回(包头包行, 数据包行, 包头包视图, 数据包视图), 发送前只需改写帧号等字段
+        """
+        reg = self.reg
+        flags = Det._headFlags(reg[0x0018])
+        if reg[0x0013] == 0x01:
+            win = reg[0x0021]
+            dt = Det.histDataType((win & 0xFFFF, win >> 16))
+            per = self.param["pixNum"]
+        else:
+            dt = Det.winDataType(reg[0x0020] + 1, self.param["packagePix"])
+            per = self.param["pixNum"] // self.param["packagePix"]
+        (headType, dataType) = (dt(**flags), dt())
+        dLen = int(np.prod(dataType["data"].shape))
+        rng = np.random.default_rng(0)
+
+        def rows(dtype: np.dtype, n: int) -> tuple[np.ndarray, np.ndarray]:
+            buf = np.zeros((n, 8 + dtype.itemsize), dtype=np.uint8)
+            buf[:, :8] = np.frombuffer(_HEAD.pack(b"VPDT", 2), dtype=np.uint8)
+            pkt = buf[:, 8:].view(dtype)[:, 0]
+            pkt["idx"] = np.arange(n)
+            pkt["dLen"] = dLen
+            pkt["data"] = rng.poisson(20, pkt["data"].shape)
+            return (buf, pkt)
+        (headRow, head) = rows(headType, 1)
+        (dataRows, data) = rows(dataType, per)
+        return (headRow, dataRows, head, data)
+
+    def _stream(self, stop: threading.Event):
+        (headRow, dataRows, head, data) = self._packets()
+        per = len(dataRows)
+        flags = Det._headFlags(self.reg[0x0018])
+        num = self.reg[0x0015]
+        period = None if self.speed is None else self.reg[0x0014] * 1e-4 / self.speed
+        dst = self._dst()
+        send = self._s.sendto
+        rows = [headRow[0]] + list(dataRows[1:])
+        # 每个包的第一个数据
+        first = (slice(None),) + (0,) * (data["data"].ndim - 1)
+        idx = np.arange(per, dtype=np.uint32)
+        t0 = time.perf_counter()
+        for f in range(num):
+            if stop.is_set() or not self._run:
+                break
+            if period is not None:
+                ahead = t0 + f * period - time.perf_counter()
+                if ahead > 0:
+                    stop.wait(ahead)
+            data["frame"] = f
+            data["data"][first] = (idx + f) & 0xFFFF
+            head["frame"] = f
+            head["data"][first] = f & 0xFFFF
+            for pos in ("pos0", "pos1"):
+                if flags["with" + pos.capitalize()]:
+                    head[pos + "h"] = f * self.posStep
+                    head[pos + "t"] = f * self.posStep + self.posStep - 1
+            for row in rows:
+                try:
+                    send(row, dst)
+                except OSError:
+                    # 发送缓冲区满(ENOBUFS), 该包丢弃
+                    pass
+            self.packets += per
+            self.frames += 1
+
+
+def _simMain(ip: str, kw: dict):
+    sim = DetSim(ip, **kw)
+    logging.info(f"模拟设备{ip}:7493已启动")
+    mark = (time.perf_counter(), 0)
+    while True:
+        time.sleep(5)
+        now = time.perf_counter()
+        pps = (sim.packets - mark[1]) / (now - mark[0])
+        if pps:
+            logging.info(f"模拟设备{ip}: {sim.frames}帧, {sim.packets}包, {pps:.0f}包/s")
+        mark = (now, sim.packets)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    parser = argparse.ArgumentParser(description="VPDT探测器模拟器")
+    parser.add_argument("--ip", default="127.0.0.2", help="第一台设备的地址, 多台时依次加1")
+    parser.add_argument("--count", type=int, default=1, help="设备数, 每台一个进程")
+    parser.add_argument("--model", default="D80")
+    parser.add_argument("--pix", type=int, default=None, help="像素数, 默认按型号")
+    parser.add_argument("--head", type=lambda v: int(v, 0), default=HEAD_INFO | HEAD_POS0 | HEAD_POS1,
+                        help="包头寄存器(0x18)初值")
+    parser.add_argument("--bins", type=int, default=120, help="能窗0的道数")
+    parser.add_argument("--speed", type=float, default=1.0, help="帧率相对采集时间的倍数, 0为尽快发送")
+    parser.add_argument("--heartbeat", type=float, default=1.0, help="心跳间隔(s), 0不发送")
+    args = parser.parse_args()
+    kw = dict(model=args.model, pixNum=args.pix, head=args.head, bins=args.bins,
+              speed=args.speed or None, heartbeat=args.heartbeat)
+    base = int.from_bytes(socket.inet_aton(args.ip), "big")
+    ips = [socket.inet_ntoa((base + i).to_bytes(4, "big")) for i in range(args.count)]
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_simMain, args=(ip, kw), daemon=True) for ip in ips[1:]]
+    for p in procs:
+        p.start()
+    try:
+        _simMain(ips[0], kw)
+    except KeyboardInterrupt:
+        pass